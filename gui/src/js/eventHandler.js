@@ -81,7 +81,7 @@ export function eventDispatcher(data) {
   console.debug(data);
 
   if (data["scatter"] !== undefined) {
-    stateStore.scatter = JSON.parse(data["scatter"]);
+    stateStore.scatter = data["scatter"].map(([x, y]) => ({ x: x, y: y }));
     return;
   }
 
@@ -0,0 +1,77 @@
+"""
+Round trip time estimation for ARQ sessions, the retry timeouts follow the measured answer times
+"""
+
+
+class RTTEstimator:
+    """
+    Smoothed round trip time and its variation, like the TCP retransmission timer (RFC 6298).
+
+    The airtime of a burst and its ack depends on the mode and the number of frames, it is known
+    in advance. So the estimator tracks the margin on top of the airtime: PTT switching, decoding
+    and waiting of the other station. Answers to repeated frames are ambiguous and not measured
+    (Karn's rule), every timeout doubles the margin until a new measurement arrives.
+    """
+
+    # gain of the smoothed margin
+    ALPHA = 1 / 8
+    # gain of the margin variation
+    BETA = 1 / 4
+    # variations added to the smoothed margin
+    K = 4
+    # upper limit of the margin multiplier after timeouts
+    BACKOFF_MAX = 4
+
+    def __init__(self, initial_margin: float, minimum_margin: float, maximum_margin: float):
+        """
+        Args:
+            initial_margin: seconds on top of the airtime until the first measurement
+            minimum_margin: lower limit of the margin in seconds
+            maximum_margin: upper limit of the margin in seconds, including the backoff
+        """
+        self.initial_margin = initial_margin
+        self.minimum_margin = minimum_margin
+        self.maximum_margin = maximum_margin
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+
+    def add_sample(self, rtt: float, airtime: float):
+        """
+        Measure the answer to a frame, which has been sent only once
+
+        Args:
+            rtt: seconds from the start of our transmission until the answer has been received
+            airtime: expected airtime of our transmission and the answer
+        """
+        margin = max(rtt - airtime, 0)
+        if self.srtt is None:
+            self.srtt = margin
+            self.rttvar = margin / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - margin)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * margin
+        self.backoff = 1
+
+    def on_timeout(self):
+        self.backoff = min(self.backoff * 2, self.BACKOFF_MAX)
+
+    def get_margin(self) -> float:
+        if self.srtt is None:
+            margin = self.initial_margin
+        else:
+            margin = self.srtt + self.K * self.rttvar
+        margin = max(margin, self.minimum_margin) * self.backoff
+        return min(margin, self.maximum_margin)
+
+    def get_timeout(self, airtime: float) -> float:
+        """
+        Retry timeout for a transmission
+
+        Args:
+            airtime: expected airtime of our transmission and the answer
+
+        Returns:
+            seconds from the start of our transmission
+        """
+        return airtime + self.get_margin()
@@ -0,0 +1,284 @@
+"""
+Single threaded scheduler of the ARQ sessions, it owns their timers, retries and transmissions
+"""
+import collections
+import math
+import queue
+import threading
+import time
+import weakref
+import structlog
+
+log = structlog.get_logger("arq_scheduler")
+
+
+class TimerHandle:
+    """
+    A callback scheduled for a deadline, cancel it with ARQScheduler.cancel()
+    """
+
+    def __init__(self, deadline: float, callback, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.tick = None
+        # neither fired nor cancelled
+        self.active = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel, adding and cancelling a timer costs the same for any number of timers
+
+    Timers are hashed into the slot of their expiry tick. A slot holds timers of all later
+    rounds of the wheel as well, so advancing only fires the timers which are due.
+    """
+
+    def __init__(self, tick: float, slots: int, now: float):
+        """
+        Args:
+            tick: resolution of the wheel in seconds
+            slots: number of slots of the wheel
+            now: current monotonic time
+        """
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.current_tick = math.floor(now / tick)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, timer: TimerHandle):
+        # timers never fire before their deadline, and never in the past
+        timer.tick = max(math.ceil(timer.deadline / self.tick), self.current_tick + 1)
+        self.slots[timer.tick % len(self.slots)].add(timer)
+        self.count += 1
+
+    def remove(self, timer: TimerHandle):
+        slot = self.slots[timer.tick % len(self.slots)]
+        if timer in slot:
+            slot.remove(timer)
+            self.count -= 1
+
+    def advance(self, now: float) -> list:
+        """
+        Move the wheel to the current time
+
+        Returns:
+            expired timers, ordered by deadline
+        """
+        target_tick = math.floor(now / self.tick)
+        expired = []
+        # after a long stall every slot is visited once
+        steps = min(target_tick - self.current_tick, len(self.slots))
+        for step in range(1, steps + 1):
+            slot = self.slots[(self.current_tick + step) % len(self.slots)]
+            due = [timer for timer in slot if timer.tick <= target_tick]
+            slot.difference_update(due)
+            expired.extend(due)
+        self.current_tick = max(self.current_tick, target_tick)
+        self.count -= len(expired)
+        return sorted(expired, key=lambda timer: timer.deadline)
+
+
+class TXWorker:
+    """
+    Runs the transmissions of the ARQ sessions one after another on its own thread
+
+    A transmission blocks until its audio has been played. Meanwhile the scheduler keeps
+    handling frames and timers, and the session continues once the transmission is done.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+        self.transmissions = 0
+        self.errors = 0
+        self.duration_max = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="ARQ transmissions", daemon=True)
+                self.thread.start()
+
+    def submit(self, transmission, args: tuple, callback, callback_args: tuple):
+        self.start()
+        self.queue.put((transmission, args, callback, callback_args))
+
+    def run(self):
+        while True:
+            transmission, args, callback, callback_args = self.queue.get()
+            start = time.perf_counter()
+            try:
+                transmission(*args)
+            except Exception as e:
+                self.errors += 1
+                log.error("[ARQ] Transmission failed", transmission=getattr(transmission, '__qualname__', transmission), e=e)
+            self.transmissions += 1
+            self.duration_max = max(self.duration_max, time.perf_counter() - start)
+            if callback is not None:
+                self.scheduler.call_soon(callback, *callback_args)
+
+
+class ARQScheduler:
+    """
+    Event loop of the ARQ sessions
+
+    Received frames, timeouts and retries of all sessions run one after another on
+    a single thread, so the state machines need no locks and no thread per retry.
+    Transmissions block until their audio has been played, they run on a TXWorker.
+    """
+
+    # resolution of the timers in seconds
+    TICK = 0.05
+    # 25.6 seconds per round of the wheel
+    SLOTS = 512
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.wheel = TimerWheel(self.TICK, self.SLOTS, time.monotonic())
+        self.ready = collections.deque()
+        self.thread = None
+        self.sessions = weakref.WeakSet()
+        self.tx_worker = TXWorker(self)
+
+        self.callbacks = 0
+        self.errors = 0
+        self.timers_fired = 0
+        self.timers_cancelled = 0
+        self.lag_last = 0.0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.callback_duration_max = 0.0
+
+    def start(self):
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="ARQ scheduler", daemon=True)
+                self.thread.start()
+
+    def register_session(self, session):
+        """
+        Count a session for the statistics, sessions are forgotten once deleted
+        """
+        with self.condition:
+            self.sessions.add(session)
+
+    def call_soon(self, callback, *args):
+        """
+        Run a callback on the scheduler thread, after the callbacks queued before
+        """
+        self.start()
+        with self.condition:
+            self.ready.append((callback, args))
+            self.condition.notify()
+
+    def call_later(self, delay: float, callback, *args) -> TimerHandle:
+        """
+        Run a callback on the scheduler thread after a delay
+
+        Args:
+            delay: seconds from now
+
+        Returns:
+            TimerHandle for cancelling the callback
+        """
+        self.start()
+        timer = TimerHandle(time.monotonic() + max(delay, 0), callback, args)
+        with self.condition:
+            self.wheel.add(timer)
+            self.condition.notify()
+        return timer
+
+    def transmit(self, transmission, args: tuple, callback=None, *callback_args):
+        """
+        Run a blocking transmission on the tx worker, after the transmissions queued before
+
+        Args:
+            transmission: function sending the frames, usually ARQSession.transmit_frame
+            args: arguments of the transmission
+            callback: run on the scheduler thread once the transmission is done
+        """
+        self.tx_worker.submit(transmission, args, callback, callback_args)
+
+    def cancel(self, timer: TimerHandle):
+        """
+        Cancel a timer, a timer which has already fired is ignored
+        """
+        with self.condition:
+            if timer.active:
+                timer.active = False
+                self.wheel.remove(timer)
+                self.timers_cancelled += 1
+
+    def run(self):
+        while True:
+            with self.condition:
+                expired = self.wheel.advance(time.monotonic())
+                if not self.ready and not expired:
+                    # sleep until the next tick, or until new work arrives
+                    self.condition.wait(self.TICK if len(self.wheel) else None)
+                    continue
+                ready = list(self.ready)
+                self.ready.clear()
+
+            # answers which arrived before the timeout expired are handled first
+            for callback, args in ready:
+                self.execute(callback, args)
+            for timer in expired:
+                with self.condition:
+                    # a callback before may have cancelled it
+                    if not timer.active:
+                        continue
+                    timer.active = False
+                lag = time.monotonic() - timer.deadline
+                self.timers_fired += 1
+                self.lag_last = lag
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+                self.execute(timer.callback, timer.args)
+
+    def execute(self, callback, args):
+        start = time.perf_counter()
+        try:
+            callback(*args)
+        except Exception as e:
+            self.errors += 1
+            log.error("[ARQ] Scheduled callback failed", callback=getattr(callback, '__qualname__', callback), e=e)
+        self.callbacks += 1
+        self.callback_duration_max = max(self.callback_duration_max, time.perf_counter() - start)
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            sessions = list(self.sessions)
+            return {
+                "running": self.thread is not None and self.thread.is_alive(),
+                # the state is set once the session is constructed
+                "active_sessions": sum(getattr(session, 'state', None) is not None
+                                       and session.state.name not in ['ENDED', 'FAILED', 'ABORTED']
+                                       for session in sessions),
+                "sessions": len(sessions),
+                "pending_timers": len(self.wheel),
+                "queued_callbacks": len(self.ready),
+                "callbacks": self.callbacks,
+                "errors": self.errors,
+                "timers_fired": self.timers_fired,
+                "timers_cancelled": self.timers_cancelled,
+                "lag_last_ms": self.lag_last * 1000,
+                "lag_avg_ms": self.lag_total / max(self.timers_fired, 1) * 1000,
+                "lag_max_ms": self.lag_max * 1000,
+                "callback_duration_max_ms": self.callback_duration_max * 1000,
+                "transmissions": self.tx_worker.transmissions,
+                "queued_transmissions": self.tx_worker.queue.qsize(),
+                "transmission_errors": self.tx_worker.errors,
+                "transmission_duration_max_ms": self.tx_worker.duration_max * 1000,
+            }
+
+
+# process wide scheduler of all ARQ sessions
+SCHEDULER = ARQScheduler()
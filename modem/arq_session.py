@@ -1,5 +1,4 @@
 import datetime
-import threading
 import codec2
 import data_frame_factory
 import structlog
@@ -7,6 +6,8 @@ from event_manager import EventManager
 from modem_frametypes import FRAME_TYPE
 import time
 from arq_data_type_handler import ARQDataTypeHandler
+from arq_speed_controller import SpeedController
+import arq_scheduler
 
 
 class ARQSession:
@@ -32,6 +33,24 @@ class ARQSession:
         },
     }
 
+    # upper limit of data frames sent in a single transmission
+    FRAMES_PER_BURST_MAX = 5
+    # payload blocks covered by the bitmap of a burst ack
+    BURST_BITMAP_BLOCKS = 16
+
+    # protocol versions, a session uses the lower version of both stations
+    VERSION_STOP_AND_WAIT = 1
+    VERSION_SELECTIVE_REPEAT = 2
+    VERSION = VERSION_SELECTIVE_REPEAT
+
+    # DJ2LS: 3 seconds seems to be too small for radios with a too slow PTT toggle time
+    # DJ2LS: 3.5 seconds is working well WITHOUT a channel busy detection delay
+    TIMEOUT_CHANNEL_BUSY = 2
+    # retry timeout of the ISS until answers have been measured, the cost of a lost burst
+    TIMEOUT_TRANSFER = 3.5 + TIMEOUT_CHANNEL_BUSY
+    # extra time of the IRS for the remaining frames of a burst before acknowledging it
+    TIMEOUT_BURST_MARGIN = 1.5
+
     def __init__(self, config: dict, modem, dxcall: str, state_manager):
         self.logger = structlog.get_logger(type(self).__name__)
         self.config = config
@@ -49,11 +68,23 @@ class ARQSession:
         self.modem = modem
         self.speed_level = 0
         self.previous_speed_level = 0
+        # speed levels the session may use, all levels within the maximum bandwidth if None
+        self.allowed_speed_levels = None
 
         self.frames_per_burst = 1
+        self.version = self.VERSION
 
         self.frame_factory = data_frame_factory.DataFrameFactory(self.config)
-        self.event_frame_received = threading.Event()
+
+        # all sessions run on the scheduler thread, a session waits for an answer with a single timer
+        self.scheduler = arq_scheduler.SCHEDULER
+        self.timer = None
+
+        self.speed_controller = SpeedController(
+            self.SPEED_LEVEL_DICT,
+            {level: self.get_data_payload_size(level) for level in self.SPEED_LEVEL_DICT},
+            codec2.get_mode_info(codec2.FREEDV_MODE.signalling).airtime,
+            self.TIMEOUT_TRANSFER)
 
         self.arq_data_type_handler = ARQDataTypeHandler(self.event_manager, self.states)
         self.id = None
@@ -66,6 +97,8 @@ class ARQSession:
         self.bpm_histogram = []
         self.time_histogram = []
 
+        self.scheduler.register_session(self)
+
     def log(self, message, isWarning=False):
         msg = f"[{type(self).__name__}][id={self.id}][state={self.state}]: {message}"
         logger = self.logger.warn if isWarning else self.logger.info
@@ -88,29 +121,64 @@ class ARQSession:
             self.log(f"{type(self).__name__} state change from {self.state.name} to {state.name}")
         self.state = state
 
-    def get_data_payload_size(self):
+    def get_data_payload_size(self, speed_level=None):
+        if speed_level is None:
+            speed_level = self.speed_level
         return self.frame_factory.get_available_data_payload_for_mode(
             FRAME_TYPE.ARQ_BURST_FRAME,
-            self.SPEED_LEVEL_DICT[self.speed_level]["mode"]
+            self.SPEED_LEVEL_DICT[speed_level]["mode"]
             )
 
+    def negotiate_version(self, remote_version):
+        # stations before the version exchange send 0 or nothing, they use stop-and-wait
+        self.version = min(max(remote_version, self.VERSION_STOP_AND_WAIT), self.VERSION)
+        self.log(f"Using protocol version {self.version}")
+        return self.version
+
+    def is_selective_repeat(self):
+        return self.version >= self.VERSION_SELECTIVE_REPEAT
+
     def set_details(self, snr, frequency_offset):
         self.snr = snr
         self.frequency_offset = frequency_offset
 
-    def on_frame_received(self, frame):
-        self.event_frame_received.set()
+    def set_timer(self, timeout, callback, *args):
+        """
+        Run a callback on the scheduler thread after timeout seconds, replacing the pending timer
+        """
+        self.cancel_timer()
+        self.timer = self.scheduler.call_later(timeout, callback, *args)
+
+    def cancel_timer(self):
+        if self.timer:
+            self.scheduler.cancel(self.timer)
+            self.timer = None
+
+    def on_frame_received(self, frame, snr, frequency_offset):
+        # called by the frame dispatcher, the frame and its details are handled on the scheduler thread
+        self.scheduler.call_soon(self.handle_frame, frame, snr, frequency_offset, time.time())
+
+    def answer_received(self, received_time):
+        # any frame of the other station ends the waiting for an answer
+        self.cancel_timer()
+
+    def handle_frame(self, frame, snr, frequency_offset, received_time):
+        self.set_details(snr, frequency_offset)
+        self.answer_received(received_time)
         self.log(f"Received {frame['frame_type']}")
         frame_type = frame['frame_type_int']
         if self.state in self.STATE_TRANSITION and frame_type in self.STATE_TRANSITION[self.state]:
             action_name = self.STATE_TRANSITION[self.state][frame_type]
             received_data, type_byte = getattr(self, action_name)(frame)
-            if isinstance(received_data, bytearray) and isinstance(type_byte, int):
-                self.arq_data_type_handler.dispatch(type_byte, received_data, self.update_histograms(len(received_data), len(received_data)))
+            self.dispatch_received_data(received_data, type_byte)
             return
         
         self.log(f"Ignoring unknown transition from state {self.state.name} with frame {frame['frame_type']}")
 
+    def dispatch_received_data(self, received_data, type_byte):
+        if isinstance(received_data, bytearray) and isinstance(type_byte, int):
+            self.arq_data_type_handler.dispatch(type_byte, received_data, self.update_histograms(len(received_data), len(received_data)))
+
     def is_session_outdated(self):
         session_alivetime = time.time() - self.session_max_age
         return self.session_ended < session_alivetime and self.state.name in [
@@ -164,20 +232,13 @@ class ARQSession:
 
         return stats
 
-    def get_appropriate_speed_level(self, snr, maximum_bandwidth=None):
+    def get_speed_levels_within(self, maximum_bandwidth=None):
+        if self.allowed_speed_levels is not None:
+            return list(self.allowed_speed_levels)
         if maximum_bandwidth is None:
             maximum_bandwidth = self.config['MODEM']['maximum_bandwidth']
-
-        # Adjust maximum_bandwidth based on special conditions or invalid configurations
         if maximum_bandwidth == 0:
-            # Use the maximum available bandwidth from the speed level dictionary
-            maximum_bandwidth = max(details['bandwidth'] for details in self.SPEED_LEVEL_DICT.values())
-
-        # Initialize appropriate_speed_level to the lowest level that meets the minimum criteria
-        appropriate_speed_level = min(self.SPEED_LEVEL_DICT.keys())
-
-        for level, details in self.SPEED_LEVEL_DICT.items():
-            if snr >= details['min_snr'] and details['bandwidth'] <= maximum_bandwidth and level > appropriate_speed_level:
-                appropriate_speed_level = level
-
-        return appropriate_speed_level
+            return list(self.SPEED_LEVEL_DICT)
+        # the lowest speed level is always possible
+        return [level for level, details in self.SPEED_LEVEL_DICT.items()
+                if level == 0 or details['bandwidth'] <= maximum_bandwidth]
@@ -1,6 +1,8 @@
-import threading
 import arq_session
+import codec2
 import helpers
+import math
+from range_map import RangeMap
 from modem_frametypes import FRAME_TYPE
 from codec2 import FREEDV_MODE
 from enum import Enum
@@ -64,7 +66,6 @@ class ARQSessionIRS(arq_session.ARQSession):
 
         self.id = session_id
         self.dxcall = dxcall
-        self.version = 1
 
         self.state = IRS_State.NEW
         self.state_enum = IRS_State  # needed for access State enum from outside
@@ -75,6 +76,16 @@ class ARQSessionIRS(arq_session.ARQSession):
         self.received_data = None
         self.received_bytes = 0
         self.received_crc = None
+        # byte ranges of the received data, which may have gaps
+        self.received_ranges = RangeMap()
+
+        # frames received since the last burst ack
+        self.burst_frames_received = 0
+        # received bytes reported in the last ack, the bitmap window of the next burst starts there
+        self.burst_window_start = 0
+        self.burst_timer = None
+        # time of our latest ack, bursts repeated by the ISS delay the next frame
+        self.ack_sent = None
 
         self.maximum_bandwidth = 0
 
@@ -87,24 +98,28 @@ class ARQSessionIRS(arq_session.ARQSession):
         return self.total_crc == helpers.get_crc_32(bytes(self.received_data)).hex()
 
     def transmit_and_wait(self, frame, timeout, mode):
-        self.event_frame_received.clear()
-        self.transmit_frame(frame, mode)
+        # the timer starts once the frame has been sent
+        self.scheduler.transmit(self.transmit_frame, (frame, mode), self.wait_for_answer, timeout)
+
+    def wait_for_answer(self, timeout):
         self.log(f"Waiting {timeout} seconds...")
-        if not self.event_frame_received.wait(timeout):
-            self.log("Timeout waiting for ISS. Session failed.")
-            self.transmission_failed()
+        self.set_timer(timeout, self.on_answer_timeout)
+
+    def on_answer_timeout(self):
+        self.timer = None
+        self.log("Timeout waiting for ISS. Session failed.")
+        self.transmission_failed()
 
     def launch_transmit_and_wait(self, frame, timeout, mode):
-        thread_wait = threading.Thread(target = self.transmit_and_wait, 
-                                       args = [frame, timeout, mode], daemon=True)
-        thread_wait.start()
+        # transmit once the received frame is handled
+        self.scheduler.call_soon(self.transmit_and_wait, frame, timeout, mode)
     
     def send_open_ack(self, open_frame):
         self.maximum_bandwidth = open_frame['maximum_bandwidth']
         # check for maximum bandwidth. If ISS bandwidth is higher than own, then use own
         if open_frame['maximum_bandwidth'] > self.config['MODEM']['maximum_bandwidth']:
             self.maximum_bandwidth = self.config['MODEM']['maximum_bandwidth']
-
+        self.negotiate_version(open_frame.get('version', 0))
 
         self.event_manager.send_arq_session_new(
             False, self.id, self.dxcall, 0, self.state.name)
@@ -134,40 +149,138 @@ class ARQSessionIRS(arq_session.ARQSession):
         info_ack = self.frame_factory.build_arq_session_info_ack(
             self.id, self.total_crc, self.snr,
             self.speed_level, self.frames_per_burst, flag_abort=self.abort)
+        self.ack_sent = time.time()
         self.launch_transmit_and_wait(info_ack, self.TIMEOUT_CONNECT, mode=FREEDV_MODE.signalling)
         if not self.abort:
             self.set_state(IRS_State.INFO_ACK_SENT)
         return None, None
 
     def process_incoming_data(self, frame):
-        if frame['offset'] != self.received_bytes:
-            self.log(f"Discarding data offset {frame['offset']}")
+        offset = frame['offset']
+        # we only want the remaining length, not the entire frame data
+        data_part = frame['data'][:max(self.total_length - offset, 0)]
+        end = offset + len(data_part)
+        if self.received_ranges.contains(offset, end):
+            self.log(f"Discarding data offset {offset}")
             return False
 
-        remaining_data_length = self.total_length - self.received_bytes
-
-        # Is this the last data part?
-        if remaining_data_length <= len(frame['data']):
-            # we only want the remaining length, not the entire frame data
-            data_part = frame['data'][:remaining_data_length]
-        else:
-            # we want the entire frame data
-            data_part = frame['data']
+        self.received_data[offset:end] = data_part
+        self.received_ranges.add(offset, end)
+        if offset > self.received_bytes:
+            self.log(f"Received data offset {offset} ahead of {self.received_bytes}")
+        self.received_bytes = self.received_ranges.contiguous_end()
 
-        self.received_data[frame['offset']:] = data_part
-        self.received_bytes += len(data_part)
         self.log(f"Received {self.received_bytes}/{self.total_length} bytes")
         self.event_manager.send_arq_session_progress(
             False, self.id, self.dxcall, self.received_bytes, self.total_length, self.state.name, self.calculate_session_statistics(self.received_bytes, self.total_length))
 
         return True
 
+    def get_burst_bitmap(self, payload_size):
+        """
+        Bitmap of the received payload blocks after the received bytes
+        """
+        bitmap = 0
+        for block in range(self.BURST_BITMAP_BLOCKS):
+            start = self.received_bytes + block * payload_size
+            if start >= self.total_length:
+                break
+            if self.received_ranges.contains(start, min(start + payload_size, self.total_length)):
+                bitmap |= 1 << block
+        return bitmap
+
     def receive_data(self, burst_frame):
+        if self.burst_frames_received == 0:
+            self.add_lost_bursts(burst_frame)
         self.process_incoming_data(burst_frame)
+        self.burst_frames_received += 1
+        self.cancel_burst_timer()
+
+        if burst_frame.get('more_frames'):
+            # acknowledge once the remaining frames of the burst had their time on air
+            remaining_frames = self.get_remaining_burst_frames(burst_frame)
+            airtime = codec2.get_mode_info(self.get_mode_by_speed_level(burst_frame['speed_level'])).airtime
+            self.burst_timer = self.scheduler.call_later(remaining_frames * airtime + self.TIMEOUT_BURST_MARGIN,
+                                                         self.on_burst_timeout, burst_frame)
+            return None, None
+
+        return self.acknowledge_burst(burst_frame)
+
+    def add_lost_bursts(self, burst_frame):
+        """
+        Record the bursts the ISS had to repeat after its retry timeout as lost,
+        they delay the first frame after our ack by whole retry cycles
+        """
+        if self.ack_sent is None:
+            return
+        ack_airtime = codec2.get_mode_info(FREEDV_MODE.signalling).airtime
+        frame_airtime = codec2.get_mode_info(self.get_mode_by_speed_level(burst_frame['speed_level'])).airtime
+        delay = time.time() - self.ack_sent - ack_airtime - (burst_frame.get('burst_index', 0) + 1) * frame_airtime
+        burst_airtime = self.frames_per_burst * codec2.get_mode_info(self.get_mode_by_speed_level(self.speed_level)).airtime
+        lost_bursts = round(max(delay, 0) / (burst_airtime + self.TIMEOUT_TRANSFER))
+        self.ack_sent = None
+        if lost_bursts:
+            self.log(f"ISS repeated {lost_bursts} bursts")
+            self.speed_controller.add_frames(self.speed_level, lost_bursts * self.frames_per_burst,
+                                             lost_bursts * self.frames_per_burst)
+
+    def cancel_burst_timer(self):
+        if self.burst_timer:
+            self.scheduler.cancel(self.burst_timer)
+            self.burst_timer = None
+
+    def on_burst_timeout(self, burst_frame):
+        self.burst_timer = None
+        # the session may have ended while waiting for the rest of the burst
+        if self.state not in [IRS_State.INFO_ACK_SENT, IRS_State.BURST_REPLY_SENT]:
+            return
+        self.log("Missing frames at the end of the burst")
+        received_data, type_byte = self.acknowledge_burst(burst_frame)
+        self.dispatch_received_data(received_data, type_byte)
+
+    def get_remaining_burst_frames(self, burst_frame):
+        """
+        Frames of the burst following a frame, which announced more frames.
+        The ISS sends only the missing blocks of the bitmap window, in order,
+        so a burst repeating a few gaps is shorter than frames_per_burst.
+        """
+        payload_size = self.get_data_payload_size(burst_frame['speed_level'])
+        window_end = min(self.burst_window_start + self.BURST_BITMAP_BLOCKS * payload_size, self.total_length)
+        missing_blocks = sum(math.ceil((end - start) / payload_size)
+                             for start, end in self.received_ranges.gaps(burst_frame['offset'], window_end))
+        remaining_frames = min(missing_blocks, self.frames_per_burst - burst_frame['burst_index'] - 1)
+        # the frame announced at least one more
+        return max(remaining_frames, 1)
+
+    def update_frames_per_burst(self, burst_frame):
+        """
+        Adapt the frames per burst to the frame loss of the latest burst
+        """
+        expected_frames = burst_frame.get('burst_index', 0) + 1
+        if burst_frame.get('more_frames'):
+            # the end of the burst got lost
+            expected_frames += self.get_remaining_burst_frames(burst_frame)
+        lost_frames = max(expected_frames - self.burst_frames_received, 0)
+
+        self.speed_controller.add_frames(burst_frame['speed_level'], expected_frames, lost_frames)
+        if lost_frames == 0:
+            self.frames_per_burst = min(self.frames_per_burst + 1, self.FRAMES_PER_BURST_MAX)
+        elif lost_frames * 2 >= expected_frames:
+            self.frames_per_burst = max(self.frames_per_burst // 2, 1)
+        self.log(f"Lost {lost_frames}/{expected_frames} frames, next burst {self.frames_per_burst} frames")
+
+    def acknowledge_burst(self, burst_frame):
         # update statistics
         self.update_histograms(self.received_bytes, self.total_length)
-        
+
         if not self.all_data_received():
+            bitmap = 0
+            if self.is_selective_repeat():
+                self.update_frames_per_burst(burst_frame)
+                bitmap = self.get_burst_bitmap(self.get_data_payload_size(burst_frame['speed_level']))
+            else:
+                self.speed_controller.add_frames(burst_frame['speed_level'], 1, 0)
+            self.burst_frames_received = 0
             self.calibrate_speed_settings(burst_frame=burst_frame)
             ack = self.frame_factory.build_arq_burst_ack(
                 self.id,
@@ -175,13 +288,18 @@ class ARQSessionIRS(arq_session.ARQSession):
                 self.speed_level,
                 self.frames_per_burst,
                 self.snr,
-                flag_abort=self.abort
+                flag_abort=self.abort,
+                bitmap=bitmap,
             )
 
             self.set_state(IRS_State.BURST_REPLY_SENT)
+            self.ack_sent = time.time()
+            self.burst_window_start = self.received_bytes
             self.launch_transmit_and_wait(ack, self.TIMEOUT_DATA, mode=FREEDV_MODE.signalling)
             return None, None
 
+        self.burst_frames_received = 0
+        self.cancel_burst_timer()
         if self.final_crc_matches():
             self.log("All data received successfully!")
             ack = self.frame_factory.build_arq_burst_ack(self.id,
@@ -191,7 +309,7 @@ class ARQSessionIRS(arq_session.ARQSession):
                                                          self.snr,
                                                          flag_final=True,
                                                          flag_checksum=True)
-            self.transmit_frame(ack, mode=FREEDV_MODE.signalling)
+            self.scheduler.transmit(self.transmit_frame, (ack, FREEDV_MODE.signalling))
             self.log("ACK sent")
             self.session_ended = time.time()
             self.set_state(IRS_State.ENDED)
@@ -208,7 +326,7 @@ class ARQSessionIRS(arq_session.ARQSession):
                                                          self.snr,
                                                          flag_final=True,
                                                          flag_checksum=False)
-            self.transmit_frame(ack, mode=FREEDV_MODE.signalling)
+            self.scheduler.transmit(self.transmit_frame, (ack, FREEDV_MODE.signalling))
             self.log("CRC fail at the end of transmission!")
             return self.transmission_failed()
 
@@ -218,8 +336,15 @@ class ARQSessionIRS(arq_session.ARQSession):
         else:
             received_speed_level = 0
 
+        if received_speed_level < self.speed_level and burst_frame:
+            # the ISS fell back after bursts without answer, continue from its speed level
+            self.log(f"ISS sends in speed level {received_speed_level} instead of {self.speed_level}")
+            self.speed_level = received_speed_level
+
         latest_snr = self.snr if self.snr else -10
-        appropriate_speed_level = self.get_appropriate_speed_level(latest_snr, self.maximum_bandwidth)
+        appropriate_speed_level = self.speed_controller.select(
+            self.speed_level, self.snr_histogram or [latest_snr],
+            self.get_speed_levels_within(self.maximum_bandwidth), self.frames_per_burst)
         modes_to_decode = {}
 
         # Log the latest SNR, current, appropriate speed levels, and the previous speed level
@@ -227,15 +352,9 @@ class ARQSessionIRS(arq_session.ARQSession):
             f"Latest SNR: {latest_snr}, Current Speed Level: {self.speed_level}, Appropriate Speed Level: {appropriate_speed_level}, Previous Speed Level: {self.previous_speed_level}",
             isWarning=True)
 
-        # Adjust the speed level by one step towards the appropriate level, if needed
-        if appropriate_speed_level > self.speed_level and self.speed_level < len(self.SPEED_LEVEL_DICT) - 1:
-            # we need to ensure, the received data is equal to our speed level before changing it
-            if received_speed_level == self.speed_level:
-                self.speed_level += 1
-        elif appropriate_speed_level < self.speed_level and self.speed_level > 0:
-            # we need to ensure, the received data is equal to our speed level before changing it
-            if received_speed_level == self.speed_level:
-                self.speed_level -= 1
+        # we need to ensure, the received data is equal to our speed level before changing it
+        if appropriate_speed_level != self.speed_level and received_speed_level == self.speed_level:
+            self.speed_level = appropriate_speed_level
 
         # Always decode the current mode
         current_mode = self.get_mode_by_speed_level(self.speed_level).value
@@ -258,6 +377,7 @@ class ARQSessionIRS(arq_session.ARQSession):
         self.abort = True
 
     def send_stop_ack(self, stop_frame):
+        self.cancel_burst_timer()
         stop_ack = self.frame_factory.build_arq_stop_ack(self.id)
         self.launch_transmit_and_wait(stop_ack, self.TIMEOUT_CONNECT, mode=FREEDV_MODE.signalling)
         self.set_state(IRS_State.ABORTED)
@@ -268,6 +388,7 @@ class ARQSessionIRS(arq_session.ARQSession):
 
     def transmission_failed(self, irs_frame=None):
         # final function for failed transmissions
+        self.cancel_burst_timer()
         self.session_ended = time.time()
         self.set_state(IRS_State.FAILED)
         self.log("Transmission failed!")
@@ -1,10 +1,12 @@
-import threading
 import data_frame_factory
 import random
+import codec2
 from codec2 import FREEDV_MODE
 from modem_frametypes import FRAME_TYPE
 import arq_session
 import helpers
+from range_map import RangeMap
+from arq_rtt_estimator import RTTEstimator
 from enum import Enum
 import time
 
@@ -22,12 +24,8 @@ class ARQSessionISS(arq_session.ARQSession):
 
     RETRIES_CONNECT = 10
 
-    # DJ2LS: 3 seconds seems to be too small for radios with a too slow PTT toggle time
-    # DJ2LS: 3.5 seconds is working well WITHOUT a channel busy detection delay
-    TIMEOUT_CHANNEL_BUSY = 2
-    TIMEOUT_CONNECT_ACK = 3.5 + TIMEOUT_CHANNEL_BUSY
-    TIMEOUT_TRANSFER = 3.5 + TIMEOUT_CHANNEL_BUSY
-    TIMEOUT_STOP_ACK = 3.5 + TIMEOUT_CHANNEL_BUSY
+    # upper limit of the time on top of the airtime
+    TIMEOUT_MARGIN_MAX = 30
 
     STATE_TRANSITION = {
         ISS_State.OPEN_SENT: { 
@@ -60,6 +58,19 @@ class ARQSessionISS(arq_session.ARQSession):
         self.data_crc = ''
         self.type_byte = type_byte
         self.confirmed_bytes = 0
+        # payload size of the latest burst, the bitmap of its ack counts blocks of this size
+        self.burst_payload_size = None
+        # speed level and offsets of the frames of the latest burst
+        self.burst_speed_level = 0
+        self.burst_offsets = []
+        # byte ranges the IRS reported as received
+        self.acknowledged_ranges = RangeMap()
+
+        self.ack_airtime = codec2.get_mode_info(FREEDV_MODE.signalling).airtime
+        self.rtt_estimator = RTTEstimator(self.TIMEOUT_TRANSFER - self.ack_airtime,
+                                          self.get_minimum_margin(), self.TIMEOUT_MARGIN_MAX)
+        # start and airtime of the transmission waiting for an answer, and if it has been repeated
+        self.answer_expected = None
 
         self.state = ISS_State.NEW
         self.state_enum = ISS_State # needed for access State enum from outside
@@ -75,40 +86,120 @@ class ARQSessionISS(arq_session.ARQSession):
             if len(self.state_manager.arq_iss_sessions) >= 255:
                 return False
 
-    def transmit_wait_and_retry(self, frame_or_burst, timeout, retries, mode, isARQBurst=False, ):
-        while retries > 0:
-            self.event_frame_received = threading.Event()
-            if isinstance(frame_or_burst, list): burst = frame_or_burst
-            else: burst = [frame_or_burst]
-            for f in burst:
-                self.transmit_frame(f, mode)
-            self.event_frame_received.clear()
-            self.log(f"Waiting {timeout} seconds...")
-            if self.event_frame_received.wait(timeout):
-                return
-            self.log("Timeout!")
-            retries = retries - 1
-
-            # TODO TEMPORARY TEST FOR SENDING IN LOWER SPEED LEVEL IF WE HAVE TWO FAILED TRANSMISSIONS!!!
-            if retries == 8 and isARQBurst and self.speed_level > 0:
-                self.log("SENDING IN FALLBACK SPEED LEVEL", isWarning=True)
-                self.speed_level = 0
-                self.send_data({'flag':{'ABORT': False, 'FINAL': False}, 'speed_level': self.speed_level})
-                return
+    def get_minimum_margin(self):
+        """
+        Lower limit of the time on top of the airtime. If the last frame of a burst is lost,
+        the IRS acknowledges only after its burst margin and its tx delay, which we assume to be
+        like ours. Another ack airtime covers PTT switching and decoding on both sides.
+        """
+        tx_delay = self.config['MODEM']['tx_delay'] / 1000
+        return self.TIMEOUT_BURST_MARGIN + tx_delay + self.ack_airtime
+
+    def get_airtime(self, frame_or_burst, mode):
+        """
+        Expected airtime of a transmission
+        """
+        if mode in ['auto']:
+            mode = self.get_mode_by_speed_level(self.speed_level)
+        frames = len(frame_or_burst) if isinstance(frame_or_burst, list) else 1
+        return frames * codec2.get_mode_info(mode).airtime
+
+    def transmit_and_retry(self, frame_or_burst, retries, mode, isARQBurst=False, repeated=False):
+        if mode in ['auto']:
+            mode = self.get_mode_by_speed_level(self.speed_level)
+        # all frames of a burst go out in a single transmission, the retry timer starts once it is done
+        self.scheduler.transmit(self.transmit_frame, (frame_or_burst, mode), self.wait_for_answer,
+                                frame_or_burst, retries, mode, isARQBurst, repeated, time.time())
+
+    def wait_for_answer(self, frame_or_burst, retries, mode, isARQBurst, repeated, transmission_started):
+        # the session may have ended or moved on while the frames were on air
+        if self.state in [ISS_State.ENDED, ISS_State.ABORTED] or (isARQBurst and self.state != ISS_State.BURST_SENT):
+            return
+        airtime = self.get_airtime(frame_or_burst, mode)
+        if isARQBurst:
+            timeout = self.rtt_estimator.get_timeout(airtime + self.ack_airtime)
+        else:
+            # connection and stop frames keep a fixed timeout, well below the connect timeout of the IRS
+            timeout = airtime + self.TIMEOUT_TRANSFER
+        # waiting for another transmission to finish does not count
+        transmission_started = max(transmission_started, time.time() - airtime)
+        remaining = max(timeout - (time.time() - transmission_started), 0)
+        self.log(f"Waiting {remaining:.1f} seconds...")
+        self.answer_expected = (transmission_started, airtime + self.ack_airtime, repeated)
+        self.set_timer(remaining, self.on_retry_timeout, frame_or_burst, retries, mode, isARQBurst)
+
+    def on_retry_timeout(self, frame_or_burst, retries, mode, isARQBurst):
+        self.timer = None
+        self.answer_expected = None
+        self.log("Timeout!")
+        if isARQBurst:
+            self.rtt_estimator.on_timeout()
+            self.speed_controller.timeout = self.rtt_estimator.get_timeout(self.ack_airtime)
+        retries = retries - 1
+
+        if isARQBurst and self.fall_back_speed_level(len(frame_or_burst)):
+            return
+        if retries > 0:
+            self.transmit_and_retry(frame_or_burst, retries, mode, isARQBurst, repeated=True)
+            return
 
         self.set_state(ISS_State.FAILED)
         self.transmission_failed()
 
-    def launch_twr(self, frame_or_burst, timeout, retries, mode, isARQBurst=False):
-        twr = threading.Thread(target = self.transmit_wait_and_retry, args=[frame_or_burst, timeout, retries, mode, isARQBurst], daemon=True)
-        twr.start()
+    def fall_back_speed_level(self, frames):
+        """
+        Record a burst without answer and switch to the lowest allowed speed level,
+        when it promises a higher goodput than the current one. The IRS always decodes the lowest level.
+
+        Returns:
+            True if the burst has been sent again in the lowest speed level
+        """
+        self.speed_controller.add_frames(self.speed_level, frames, frames)
+        fallback_level = min(self.get_speed_levels_within())
+        if self.speed_level <= fallback_level:
+            return False
+        # without snr reports of the IRS, our own snr is the best guess
+        snr_history = self.dx_snr or [self.snr]
+        if self.speed_controller.select(self.speed_level, snr_history, [fallback_level, self.speed_level]) != fallback_level:
+            return False
+
+        self.log("SENDING IN FALLBACK SPEED LEVEL", isWarning=True)
+        self.speed_level = fallback_level
+        # the lost frames are recorded already
+        self.burst_offsets = []
+        self.send_data({'flag':{'ABORT': False, 'FINAL': False}, 'speed_level': self.speed_level,
+                        'frames_per_burst': 1})
+        return True
+
+    def answer_received(self, received_time):
+        super().answer_received(received_time)
+        if self.answer_expected:
+            transmission_started, airtime, repeated = self.answer_expected
+            self.answer_expected = None
+            self.add_rtt_sample(received_time - transmission_started, airtime, repeated)
+
+    def add_rtt_sample(self, rtt, airtime, repeated):
+        """
+        Measure the answer time of a transmission, answers to repeated frames are ambiguous (Karn's rule)
+        """
+        if repeated:
+            return
+        self.rtt_estimator.add_sample(rtt, airtime)
+        # the timeout after a burst is the cost of losing it
+        self.speed_controller.timeout = self.rtt_estimator.get_timeout(self.ack_airtime)
+        self.log(f"Round trip time {rtt:.1f}s, retry timeout {self.rtt_estimator.get_margin():.1f}s on top of the airtime")
+
+    def launch_twr(self, frame_or_burst, retries, mode, isARQBurst=False):
+        # transmit once the received frame is handled
+        self.scheduler.call_soon(self.transmit_and_retry, frame_or_burst, retries, mode, isARQBurst)
 
     def start(self):
         maximum_bandwidth = self.config['MODEM']['maximum_bandwidth']
         self.event_manager.send_arq_session_new(
             True, self.id, self.dxcall, self.total_length, self.state.name)
-        session_open_frame = self.frame_factory.build_arq_session_open(self.dxcall, self.id, maximum_bandwidth)
-        self.launch_twr(session_open_frame, self.TIMEOUT_CONNECT_ACK, self.RETRIES_CONNECT, mode=FREEDV_MODE.signalling)
+        session_open_frame = self.frame_factory.build_arq_session_open(self.dxcall, self.id, maximum_bandwidth,
+                                                                       self.VERSION)
+        self.launch_twr(session_open_frame, self.RETRIES_CONNECT, mode=FREEDV_MODE.signalling)
         self.set_state(ISS_State.OPEN_SENT)
 
     def update_speed_level(self, frame):
@@ -139,11 +230,12 @@ class ARQSessionISS(arq_session.ARQSession):
             self.transmission_aborted(irs_frame)
             return
 
+        self.negotiate_version(irs_frame['version'])
         info_frame = self.frame_factory.build_arq_session_info(self.id, self.total_length,
                                                                helpers.get_crc_32(self.data), 
                                                                self.snr, self.type_byte)
 
-        self.launch_twr(info_frame, self.TIMEOUT_CONNECT_ACK, self.RETRIES_CONNECT, mode=FREEDV_MODE.signalling)
+        self.launch_twr(info_frame, self.RETRIES_CONNECT, mode=FREEDV_MODE.signalling)
         self.set_state(ISS_State.INFO_SENT)
 
         return None, None
@@ -172,19 +264,67 @@ class ARQSessionISS(arq_session.ARQSession):
                 self.transmission_failed()
             return None, None
 
+        # stop-and-wait sends a single frame at the confirmed offset
+        if 'frames_per_burst' in irs_frame and self.is_selective_repeat():
+            self.frames_per_burst = max(1, min(irs_frame['frames_per_burst'], self.FRAMES_PER_BURST_MAX))
+            self.update_acknowledged_ranges(irs_frame)
+        if irs_frame.get('frame_type_int') == FRAME_TYPE.ARQ_BURST_ACK.value:
+            self.dx_snr = (self.dx_snr + [irs_frame['snr']])[-self.speed_controller.SNR_HISTORY:]
+            self.add_burst_result()
+
         payload_size = self.get_data_payload_size()
         burst = []
-        for _ in range(0, self.frames_per_burst):
-            offset = self.confirmed_bytes
+        offsets = self.get_burst_offsets(payload_size)
+        for index, offset in enumerate(offsets):
             payload = self.data[offset : offset + payload_size]
             data_frame = self.frame_factory.build_arq_burst_frame(
                 self.SPEED_LEVEL_DICT[self.speed_level]["mode"],
-                self.id, self.confirmed_bytes, payload, self.speed_level)
+                self.id, offset, payload, self.speed_level,
+                burst_index=index, more_frames=index < len(offsets) - 1)
             burst.append(data_frame)
-        self.launch_twr(burst, self.TIMEOUT_TRANSFER, self.RETRIES_CONNECT, mode='auto', isARQBurst=True)
+        self.burst_payload_size = payload_size
+        self.burst_speed_level = self.speed_level
+        self.burst_offsets = offsets
+        self.launch_twr(burst, self.RETRIES_CONNECT, mode='auto', isARQBurst=True)
         self.set_state(ISS_State.BURST_SENT)
         return None, None
 
+    def add_burst_result(self):
+        """
+        Record the frames of the latest burst, which are not acknowledged yet, as lost
+        """
+        lost_frames = 0
+        for offset in self.burst_offsets:
+            end = min(offset + self.burst_payload_size, self.total_length)
+            if end > self.confirmed_bytes and not self.acknowledged_ranges.contains(offset, end):
+                lost_frames += 1
+        self.speed_controller.add_frames(self.burst_speed_level, len(self.burst_offsets), lost_frames)
+        self.burst_offsets = []
+
+    def update_acknowledged_ranges(self, irs_frame):
+        """
+        Add the confirmed bytes and the blocks after them, which the IRS reported in the bitmap
+        """
+        self.acknowledged_ranges.add(0, self.confirmed_bytes)
+        if not irs_frame.get('bitmap') or not self.burst_payload_size:
+            return
+        for block in range(self.BURST_BITMAP_BLOCKS):
+            if irs_frame['bitmap'] & (1 << block):
+                start = self.confirmed_bytes + block * self.burst_payload_size
+                self.acknowledged_ranges.add(start, min(start + self.burst_payload_size, self.total_length))
+
+    def get_burst_offsets(self, payload_size):
+        """
+        Offsets of the frames of the next burst, only the gaps in the acknowledged data are sent.
+        The window of a burst ends with the blocks the IRS can report in its bitmap.
+        """
+        offsets = []
+        window_end = min(self.confirmed_bytes + self.BURST_BITMAP_BLOCKS * payload_size, self.total_length)
+        for start, end in self.acknowledged_ranges.gaps(self.confirmed_bytes, window_end):
+            offsets.extend(range(start, end, payload_size))
+        # the byte at the confirmed offset is missing by definition, never send an empty burst
+        return offsets[:self.frames_per_burst] or [self.confirmed_bytes]
+
     def transmission_ended(self, irs_frame):
         # final function for sucessfully ended transmissions
         self.session_ended = time.time()
@@ -212,6 +352,10 @@ class ARQSessionISS(arq_session.ARQSession):
         return None, None
 
     def abort_transmission(self, irs_frame=None):
+        # requested by the API, the session is changed on the scheduler thread only
+        self.scheduler.call_soon(self.start_abort_sequence)
+
+    def start_abort_sequence(self):
         # function for starting the abort sequence
         self.log("aborting transmission...")
         self.set_state(ISS_State.ABORTING)
@@ -220,21 +364,22 @@ class ARQSessionISS(arq_session.ARQSession):
             True, self.id, self.dxcall, False, self.state.name, statistics=self.calculate_session_statistics(self.confirmed_bytes, self.total_length))
 
         # break actual retries
-        self.event_frame_received.set()
+        self.cancel_timer()
+        self.answer_expected = None
 
         # start with abort sequence
         self.send_stop()
 
     def send_stop(self):
         stop_frame = self.frame_factory.build_arq_stop(self.id)
-        self.launch_twr(stop_frame, self.TIMEOUT_STOP_ACK, self.RETRIES_CONNECT, mode=FREEDV_MODE.signalling)
+        self.launch_twr(stop_frame, self.RETRIES_CONNECT, mode=FREEDV_MODE.signalling)
 
     def transmission_aborted(self, irs_frame):
         self.log("session aborted")
         self.session_ended = time.time()
         self.set_state(ISS_State.ABORTED)
         # break actual retries
-        self.event_frame_received.set()
+        self.cancel_timer()
 
         self.event_manager.send_arq_session_finished(
             True, self.id, self.dxcall, False, self.state.name, statistics=self.calculate_session_statistics(self.confirmed_bytes, self.total_length))
@@ -0,0 +1,130 @@
+"""
+Speed level selection for ARQ sessions, based on the expected goodput of every speed level
+"""
+import math
+
+
+class SpeedController:
+    """
+    Estimates the bytes per minute of every speed level and selects the best one.
+
+    The frame success probability of a level is estimated from the recent SNR values and
+    blended with the frames actually lost at this level. Bursts lost in a row are more likely
+    a fading channel than bad luck, they discount the estimation further. A burst of frames
+    costs their airtime and the ack, or the retry timeout if no frame arrived at all.
+    """
+
+    # number of recent SNR values used for the estimation
+    SNR_HISTORY = 10
+    # weight of an SNR value relative to the next newer one
+    SNR_WEIGHT_DECAY = 0.4
+    # SNR above min_snr, where half of the frames are expected to arrive
+    SNR_MIDPOINT = 0.0
+    # dB per e-fold of the odds of a frame arriving
+    SNR_SCALE = 1.0
+    # frames get lost without a low SNR as well, by QRM or collisions
+    FRAME_LOSS_MIN = 0.05
+    # weight of the SNR based estimation, in frames
+    PRIOR_FRAMES = 2.0
+    # weight of older frame results of all speed levels, applied with every new burst
+    HISTORY_DECAY = 0.9
+    # probability of a fading channel, after a burst got no answer
+    FADING_PROBABILITY = 0.2
+    # weight of older bursts lost in a row, new SNR values soon tell about the fading
+    FADING_DECAY = 0.5
+    # another level has to be this much better than the current one
+    HYSTERESIS = 0.05
+
+    def __init__(self, speed_levels: dict, payload_sizes: dict, ack_duration: float, timeout: float):
+        """
+        Args:
+            speed_levels: SPEED_LEVEL_DICT of the session
+            payload_sizes: data payload per frame in bytes, by speed level
+            ack_duration: airtime of an ack in seconds
+            timeout: time in seconds until an unanswered burst is repeated
+        """
+        self.speed_levels = speed_levels
+        self.payload_sizes = payload_sizes
+        self.ack_duration = ack_duration
+        self.timeout = timeout
+        # decayed frame counts by speed level
+        self.frames = {level: 0.0 for level in speed_levels}
+        self.lost_frames = {level: 0.0 for level in speed_levels}
+        self.lost_bursts_in_row = {level: 0.0 for level in speed_levels}
+
+    def add_frames(self, speed_level: int, frames: int, lost_frames: int):
+        """
+        Record the result of a burst, older results of all levels lose weight,
+        so a level which failed some time ago gets another chance
+        """
+        if speed_level not in self.frames or frames <= 0:
+            return
+        for level in self.frames:
+            self.frames[level] *= self.HISTORY_DECAY
+            self.lost_frames[level] *= self.HISTORY_DECAY
+            if level != speed_level:
+                self.lost_bursts_in_row[level] *= self.FADING_DECAY
+        if lost_frames < frames:
+            self.lost_bursts_in_row[speed_level] = 0.0
+        else:
+            self.lost_bursts_in_row[speed_level] += 1
+        self.frames[speed_level] += frames
+        self.lost_frames[speed_level] += lost_frames
+
+    def get_snr_frame_success(self, speed_level: int, snr_history: list) -> float:
+        """
+        Frame success probability over the recent SNR values, newer values weigh more
+        """
+        snr_values = [snr for snr in snr_history if isinstance(snr, (int, float))][-self.SNR_HISTORY:]
+        if not snr_values:
+            return 0.5
+        midpoint = self.speed_levels[speed_level]['min_snr'] + self.SNR_MIDPOINT
+        weights = [self.SNR_WEIGHT_DECAY ** age for age in range(len(snr_values) - 1, -1, -1)]
+        probabilities = [1 / (1 + math.exp(-max(min((snr - midpoint) / self.SNR_SCALE, 50), -50)))
+                         for snr in snr_values]
+        success = sum(weight * probability for weight, probability in zip(weights, probabilities)) / sum(weights)
+        return min(success, 1 - self.FRAME_LOSS_MIN)
+
+    def get_frame_success(self, speed_level: int, snr_history: list) -> float:
+        """
+        Frame success probability, the SNR estimation corrected by the recorded frame results
+        """
+        snr_success = self.get_snr_frame_success(speed_level, snr_history)
+        received_frames = self.frames[speed_level] - self.lost_frames[speed_level]
+        success = (snr_success * self.PRIOR_FRAMES + received_frames) / (self.PRIOR_FRAMES + self.frames[speed_level])
+
+        # probability of the estimation being right, instead of a fading channel losing everything
+        likelihood = (1 - self.FADING_PROBABILITY) * (1 - success) ** self.lost_bursts_in_row[speed_level]
+        return success * likelihood / (likelihood + self.FADING_PROBABILITY)
+
+    def get_goodput(self, speed_level: int, snr_history: list, frames_per_burst: int = 1) -> float:
+        """
+        Expected goodput of a speed level in bytes per minute
+        """
+        success = self.get_frame_success(speed_level, snr_history)
+        burst_lost = (1 - success) ** frames_per_burst
+        duration = frames_per_burst * self.speed_levels[speed_level]['duration_per_frame']
+        duration += self.ack_duration + burst_lost * max(self.timeout - self.ack_duration, 0)
+        return 60 * frames_per_burst * success * self.payload_sizes[speed_level] / duration
+
+    def select(self, current_level: int, snr_history: list, speed_levels=None, frames_per_burst: int = 1) -> int:
+        """
+        Select the speed level with the highest expected goodput
+
+        Args:
+            current_level: speed level in use
+            snr_history: recent SNR values, oldest first
+            speed_levels: allowed speed levels, all if None
+            frames_per_burst: frames in the next burst
+
+        Returns:
+            speed level
+        """
+        if speed_levels is None:
+            speed_levels = list(self.speed_levels)
+        goodput = {level: self.get_goodput(level, snr_history, frames_per_burst) for level in speed_levels}
+        best_level = max(goodput, key=goodput.get)
+
+        if current_level in goodput and goodput[best_level] <= goodput[current_level] * (1 + self.HYSTERESIS):
+            return current_level
+        return best_level
@@ -0,0 +1,513 @@
+"""
+Audio processing pipeline between the sound card callbacks and codec2
+
+The PortAudio callbacks only copy audio blocks into a preallocated queue,
+all DSP work is done in a dedicated pipeline thread.
+"""
+# pylint: disable=invalid-name, line-too-long
+
+import threading
+import time
+
+import numpy as np
+import structlog
+
+import codec2
+
+
+class BlockQueue:
+    """
+    Single producer, single consumer queue of audio blocks
+
+    Blocks are copied into preallocated slots. The producer never waits and never
+    allocates, a full queue drops the new block and counts an overflow.
+    """
+
+    def __init__(self, depth, blocksize):
+        self.depth = depth
+        self.blocksize = blocksize
+        self.slots = np.zeros((depth, blocksize), dtype=np.int16)
+        self.lengths = np.zeros(depth, dtype=np.int32)
+        # monotonic block counters, each one is written by one side only
+        self.write_index = 0
+        self.read_index = 0
+        self.overflows = 0
+        self.max_depth = 0
+        self.data_ready = threading.Event()
+
+    def qsize(self) -> int:
+        return self.write_index - self.read_index
+
+    def put(self, samples) -> bool:
+        """
+        Copy a block into the next free slot (producer side)
+
+        Args:
+            samples: int16 audio block
+
+        Returns:
+            False if the block has been dropped
+        """
+        length = len(samples)
+        depth = self.write_index - self.read_index
+        if depth >= self.depth or length > self.blocksize:
+            self.overflows += 1
+            return False
+
+        slot = self.write_index % self.depth
+        self.slots[slot, :length] = samples
+        self.lengths[slot] = length
+        self.write_index += 1
+        self.max_depth = max(self.max_depth, depth + 1)
+        self.data_ready.set()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Wait for the next block (consumer side)
+
+        The returned view is valid until release() is called.
+
+        Returns:
+            np.ndarray view of the oldest block, None on timeout
+        """
+        if self.read_index == self.write_index:
+            self.data_ready.clear()
+            # check again, the producer might have added a block before we cleared the event
+            if self.read_index == self.write_index and not self.data_ready.wait(timeout):
+                return None
+            if self.read_index == self.write_index:
+                return None
+        slot = self.read_index % self.depth
+        return self.slots[slot, : self.lengths[slot]]
+
+    def release(self):
+        """
+        Hand the oldest slot back to the producer (consumer side)
+        """
+        self.read_index += 1
+
+
+class RXAudioPipeline:
+    """
+    RX audio processing stage
+
+    The sound card callback only calls push(). The pipeline thread resamples
+    to the modem sample rate, applies the rx audio level and hands the result
+    to all consumers, e.g. the spectrum and the shared rx sample ring.
+    """
+
+    def __init__(self, resampler=None, rx_audio_level=0, blocksize=4800, depth=16):
+        self.log = structlog.get_logger("RXAudioPipeline")
+
+        # resampler is optional, TCI already delivers audio at the modem sample rate
+        self.resampler = resampler
+        self.consumers = []
+        self.queue = BlockQueue(depth, blocksize)
+
+        # work buffers for the resampler and the gain stage
+        self.resample_buffer = np.zeros(blocksize, dtype=np.int16)
+        self.gain_buffer = np.zeros(blocksize, dtype=np.float64)
+        self.output_buffer = np.zeros(blocksize, dtype=np.int16)
+        self.set_audio_level(rx_audio_level)
+
+        # statistics
+        self.callback_count = 0
+        self.callback_duration_last = 0.0
+        self.callback_duration_max = 0.0
+        self.callback_duration_total = 0.0
+        self.stream_status_count = 0
+        self.last_stream_status = None
+        self.processed_blocks = 0
+        self.process_duration_max = 0.0
+        self.process_duration_total = 0.0
+
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.worker, name="RX AUDIO PIPELINE", daemon=True
+        )
+        self.thread.start()
+
+    def add_consumer(self, consumer):
+        """
+        Register a callable which receives every processed block at the modem sample rate.
+        The block is only valid during the call.
+        """
+        self.consumers.append(consumer)
+
+    def set_audio_level(self, dB):
+        """
+        Precompute the linear gain for an rx audio level in dB
+        """
+        try:
+            dB = float(dB)
+        except ValueError as e:
+            self.log.warning("[MDM] Changing audio volume failed", e=e)
+            dB = 0.0
+        # same range as audio.set_audio_volume
+        dB = np.clip(dB, -30, 20)
+        self.audio_level = dB
+        self.gain = 10 ** (dB / 20)
+
+    def push(self, indata, status=None) -> None:
+        """
+        Sound card callback side, only copies the block into the queue
+        """
+        start = time.perf_counter()
+        if status:
+            self.stream_status_count += 1
+            self.last_stream_status = status
+        self.queue.put(indata.reshape(-1))
+
+        duration = time.perf_counter() - start
+        self.callback_count += 1
+        self.callback_duration_last = duration
+        self.callback_duration_total += duration
+        self.callback_duration_max = max(self.callback_duration_max, duration)
+
+    def apply_gain(self, samples):
+        if self.gain == 1.0:
+            return samples
+        length = len(samples)
+        scaled = self.gain_buffer[:length]
+        np.multiply(samples, self.gain, out=scaled)
+        np.clip(scaled, -32768, 32767, out=scaled)
+        output = self.output_buffer[:length]
+        np.copyto(output, scaled, casting="unsafe")
+        return output
+
+    def process(self, samples) -> None:
+        if self.resampler is not None:
+            samples = self.resampler.resample48_to_8(samples, out=self.resample_buffer)
+        samples = self.apply_gain(samples)
+        for consumer in self.consumers:
+            consumer(samples)
+
+    def worker(self):
+        reported_status_count = 0
+        while self.running:
+            block = self.queue.get(timeout=1)
+            if block is None:
+                continue
+
+            # log stream problems here instead of inside the sound card callback
+            if self.stream_status_count != reported_status_count:
+                reported_status_count = self.stream_status_count
+                self.log.warning("[AUDIO STATUS]", status=self.last_stream_status, count=reported_status_count)
+
+            start = time.perf_counter()
+            try:
+                self.process(block)
+            except Exception as e:
+                self.log.warning("[AUDIO EXCEPTION]", e=e)
+            finally:
+                self.queue.release()
+            duration = time.perf_counter() - start
+            self.processed_blocks += 1
+            self.process_duration_total += duration
+            self.process_duration_max = max(self.process_duration_max, duration)
+
+    def stop(self):
+        self.running = False
+        self.queue.data_ready.set()
+
+    def get_stats(self) -> dict:
+        return {
+            "callback_count": self.callback_count,
+            "callback_duration_last_ms": self.callback_duration_last * 1000,
+            "callback_duration_avg_ms": self.callback_duration_total / max(self.callback_count, 1) * 1000,
+            "callback_duration_max_ms": self.callback_duration_max * 1000,
+            "queue_depth": self.queue.qsize(),
+            "queue_depth_max": self.queue.max_depth,
+            "queue_overflows": self.queue.overflows,
+            "stream_status_count": self.stream_status_count,
+            "processed_blocks": self.processed_blocks,
+            "process_duration_avg_ms": self.process_duration_total / max(self.processed_blocks, 1) * 1000,
+            "process_duration_max_ms": self.process_duration_max * 1000,
+        }
+
+
+class TXAudioPlayer:
+    """
+    TX audio stage between the modulator and the sound card output callback
+
+    The modulator writes into a preallocated sample ring while the burst is
+    still being created, so playback starts with the first written block. The
+    output callback only copies samples and zero fills missing ones. Played
+    blocks are handed to a monitor queue for the waterfall, so no DSP work is
+    done inside the callback.
+    """
+
+    def __init__(self, capacity=480000, monitor_blocksize=4800, monitor_depth=4):
+        """
+        Args:
+            capacity: size of the sample ring, 10 s at 48 kHz by default
+            monitor_blocksize: largest block the output callback requests
+            monitor_depth: number of played blocks buffered for the waterfall
+        """
+        self.log = structlog.get_logger("TXAudioPlayer")
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.monitor = BlockQueue(monitor_depth, monitor_blocksize)
+
+        # monotonic sample counters, each one is written by one side only
+        self.write_index = 0
+        self.read_index = 0
+
+        self.active = False
+        self.finished = False
+        self.space_available = threading.Event()
+        self.drained = threading.Event()
+        self.drained.set()
+
+        # statistics of the current transmission
+        self.start_time = 0.0
+        self.first_sample_delay = None
+        self.underrun_samples = 0
+        self.underruns = 0
+        self.max_fill = 0
+        # totals
+        self.transmissions = 0
+        self.played_samples_total = 0
+        self.underrun_samples_total = 0
+
+    def available(self) -> int:
+        return self.write_index - self.read_index
+
+    def start(self) -> None:
+        """
+        Begin a new transmission (writer side)
+        """
+        self.write_index = self.read_index
+        self.finished = False
+        self.drained.clear()
+        self.start_time = time.perf_counter()
+        self.first_sample_delay = None
+        self.underrun_samples = 0
+        self.underruns = 0
+        self.max_fill = 0
+        self.transmissions += 1
+        self.active = True
+
+    def reserve(self, count, timeout=None):
+        """
+        Wait for free space in the ring (writer side)
+
+        The returned view is contiguous, so it may be shorter than count at the
+        end of the ring. Samples written into it become playable with commit().
+
+        Args:
+            count: number of samples the writer wants to write
+            timeout: seconds to wait for free space
+
+        Returns:
+            np.ndarray view of at most count free samples, None on timeout or abort
+        """
+        while self.active:
+            free = self.capacity - self.available()
+            if free > 0:
+                start = self.write_index % self.capacity
+                return self.buffer[start : start + min(count, free, self.capacity - start)]
+
+            self.space_available.clear()
+            # check again, the callback might have consumed samples before we cleared the event
+            if self.capacity == self.available() and not self.space_available.wait(timeout):
+                self.log.warning("[MDM] TX audio ring is not drained", pending=count)
+                return None
+        return None
+
+    def commit(self, count) -> None:
+        """
+        Hand samples written into a reserved view to the output callback (writer side)
+        """
+        self.write_index += count
+        self.max_fill = max(self.max_fill, self.available())
+
+    def write(self, samples, timeout=None) -> bool:
+        """
+        Copy audio into the ring, waits for the output callback if the ring is full
+
+        Args:
+            samples: int16 audio at the sound card sample rate
+            timeout: seconds to wait for free space
+
+        Returns:
+            False if not all samples could be written
+        """
+        samples = np.asarray(samples, dtype=np.int16).reshape(-1)
+        position = 0
+        while position < len(samples):
+            region = self.reserve(len(samples) - position, timeout)
+            if region is None:
+                return False
+            region[:] = samples[position : position + len(region)]
+            self.commit(len(region))
+            position += len(region)
+        return True
+
+    def finish(self) -> None:
+        """
+        Mark the end of the transmission, no more samples are following (writer side)
+        """
+        self.finished = True
+
+    def wait_until_drained(self, timeout=None) -> bool:
+        """
+        Wait until the output callback played all samples of the transmission
+        """
+        return self.drained.wait(timeout)
+
+    def abort(self) -> None:
+        """
+        Drop pending samples and end the transmission
+        """
+        self.active = False
+        self.read_index = self.write_index
+        self.space_available.set()
+        self.drained.set()
+
+    def read(self, outdata) -> int:
+        """
+        Fill an output block (sound card callback side)
+
+        Missing samples are zero filled. They count as underrun while the
+        writer has not finished the transmission yet. The transmission is
+        drained with the first callback after the last sample, when the block
+        holding it has been played.
+
+        Args:
+            outdata: int16 output block
+
+        Returns:
+            number of audio samples copied into the block
+        """
+        if not self.active:
+            outdata.fill(0)
+            return 0
+
+        frames = len(outdata)
+        # read before the available samples, the writer commits its last samples before finishing
+        finished = self.finished
+        count = min(self.available(), frames)
+        if count == 0 and finished:
+            self.active = False
+            self.drained.set()
+            outdata.fill(0)
+            return 0
+
+        start = self.read_index % self.capacity
+        first = min(count, self.capacity - start)
+        outdata[:first] = self.buffer[start : start + first]
+        outdata[first:count] = self.buffer[: count - first]
+        outdata[count:] = 0
+        self.read_index += count
+        self.space_available.set()
+
+        if count > 0:
+            if self.first_sample_delay is None:
+                self.first_sample_delay = time.perf_counter() - self.start_time
+            self.played_samples_total += count
+            self.monitor.put(outdata[:count])
+        if count < frames and not finished:
+            self.underruns += 1
+            self.underrun_samples += frames - count
+            self.underrun_samples_total += frames - count
+        return count
+
+    def get_stats(self) -> dict:
+        return {
+            "active": self.active,
+            "pending_samples": self.available(),
+            "max_fill": self.max_fill,
+            "first_sample_delay_ms": None if self.first_sample_delay is None else self.first_sample_delay * 1000,
+            "underruns": self.underruns,
+            "underrun_samples": self.underrun_samples,
+            "transmissions": self.transmissions,
+            "played_samples_total": self.played_samples_total,
+            "underrun_samples_total": self.underrun_samples_total,
+            "monitor_overflows": self.monitor.overflows,
+        }
+
+
+class TXAudioConditioner:
+    """
+    TX audio stage between the modulator and the tx audio ring
+
+    The tx audio level is applied as fixed point gain while the resampler
+    copies its input, and the 48 kHz output is written straight into the ring
+    of the TXAudioPlayer. So modulated audio is touched only once on its way
+    to the sound card.
+    """
+
+    def __init__(self, player, resampler=None, tx_audio_level=0):
+        """
+        Args:
+            player: TXAudioPlayer which receives the audio
+            resampler: codec2 resampler, None if audio stays at the modem sample rate, e.g. for TCI
+            tx_audio_level: tx audio level in dB
+        """
+        self.log = structlog.get_logger("TXAudioConditioner")
+        self.player = player
+        self.resampler = resampler
+        # only used for the gain stage without resampling
+        self.gain_stage = resampler if resampler is not None else codec2.resampler()
+        self.ratio = codec2.api.FDMDV_OS_48 if resampler is not None else 1
+        self.set_audio_level(tx_audio_level)
+
+    def set_audio_level(self, dB):
+        """
+        Precompute the fixed point gain for a tx audio level in dB
+        """
+        try:
+            dB = float(dB)
+        except ValueError as e:
+            self.log.warning("[MDM] Changing audio volume failed", e=e)
+            dB = 0.0
+        # same range as audio.set_audio_volume
+        dB = np.clip(dB, -30, 20)
+        self.audio_level = dB
+        self.gain = self.gain_stage.fixed_point_gain(10 ** (dB / 20))
+
+    def process(self, samples) -> np.ndarray:
+        """
+        Scale and resample a block into a new array, for outputs without a ring like TCI
+        """
+        if self.resampler is not None:
+            return self.resampler.resample8_to_48(samples, gain=self.gain)
+        return self.gain_stage.apply_gain(samples, self.gain, np.empty_like(samples))
+
+    def write(self, samples, timeout=None, capture=None) -> bool:
+        """
+        Scale and resample modulated audio into the tx audio ring
+
+        Args:
+            samples: modulated audio as np.int16 at the modem sample rate
+            timeout: seconds to wait for free space in the ring
+            capture: optional list which receives a copy of the written audio
+
+        Returns:
+            False if not all samples could be written
+        """
+        position = 0
+        while position < len(samples):
+            region = self.player.reserve(self.ratio * (len(samples) - position), timeout)
+            if region is None:
+                return False
+            count = len(region) // self.ratio
+            if count == 0:
+                # less than one resampled sample left at the end of the ring
+                count = 1
+                output = self.process(samples[position : position + count])
+                if not self.player.write(output, timeout):
+                    return False
+            else:
+                output = region[: count * self.ratio]
+                if self.resampler is not None:
+                    self.resampler.resample8_to_48(samples[position : position + count], out=output, gain=self.gain)
+                else:
+                    self.gain_stage.apply_gain(samples[position : position + count], self.gain, output)
+                self.player.commit(len(output))
+            if capture is not None:
+                capture.append(output.copy())
+            position += count
+        return True
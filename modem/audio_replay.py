@@ -0,0 +1,152 @@
+"""
+Replay recorded audio through the demodulator without a sound card
+
+Recordings are pushed into the rx sample ring as fast as the decoders can
+process them, decoded frames end up in the data queue of the demodulator
+like during normal operation.
+"""
+# pylint: disable=invalid-name, line-too-long
+
+import time
+import wave
+
+import numpy as np
+import structlog
+
+import codec2
+
+
+def read_recording(path, sample_rate=None):
+    """
+    Read a mono recording
+
+    Args:
+        path: WAV file or raw int16 file
+        sample_rate: sample rate of a raw file, 8000 or 48000
+
+    Returns:
+        tuple of audio as np.int16 and its sample rate
+    """
+    if str(path).lower().endswith(".wav"):
+        with wave.open(str(path), "rb") as recording:
+            if recording.getsampwidth() != 2:
+                raise ValueError("Only 16 bit recordings are supported")
+            channels = recording.getnchannels()
+            sample_rate = recording.getframerate()
+            samples = np.frombuffer(recording.readframes(recording.getnframes()), dtype=np.int16)
+        # use the first channel of multichannel recordings
+        samples = samples[::channels]
+    else:
+        if sample_rate is None:
+            raise ValueError("Sample rate of raw recordings is required")
+        samples = np.fromfile(path, dtype=np.int16)
+
+    if sample_rate not in [codec2.api.FREEDV_FS_8000, 48000]:
+        raise ValueError(f"Unsupported sample rate {sample_rate}")
+    return samples, sample_rate
+
+
+class ReplayStream:
+    """Simulates an active audio stream for the demodulator"""
+
+    def __init__(self):
+        self.active = True
+
+
+class AudioReplay:
+    """
+    Feeds recorded audio into a Demodulator
+
+    Every block is pushed only after all running decoders have consumed the
+    previous one, so the replay runs as fast as the slowest decoder and no
+    samples are lost.
+    """
+
+    def __init__(self, demodulator, blocksize=800, timeout=10):
+        """
+        Args:
+            demodulator: Demodulator which decodes the recording
+            blocksize: number of 8 kHz samples per push
+            timeout: seconds to wait for a decoder before giving up on it
+        """
+        self.log = structlog.get_logger("AudioReplay")
+        self.demodulator = demodulator
+        self.blocksize = blocksize
+        self.timeout = timeout
+        self.stream = None
+
+    def start(self) -> None:
+        """
+        Start the decoder threads, if the demodulator is not running yet
+        """
+        if self.demodulator.stream is None:
+            self.stream = ReplayStream()
+            self.demodulator.start(self.stream)
+
+    def wait_for_decoders(self) -> None:
+        for mode in self.demodulator.MODE_DICT.values():
+            if not mode["decode"]:
+                continue
+            if not mode["audio_buffer"].wait_until_consumed(self.timeout):
+                self.log.warning("[MDM] [REPLAY] Decoder does not consume audio", mode=mode["name"])
+
+    def replay(self, samples, sample_rate=8000, tail=1.0) -> dict:
+        """
+        Push audio through all enabled decoders
+
+        Args:
+            samples: audio as np.int16
+            sample_rate: 8000 or 48000
+            tail: seconds of silence appended for flushing the decoders
+
+        Returns:
+            replay statistics with the real-time factor of every decoder
+        """
+        self.start()
+        if sample_rate != codec2.api.FREEDV_FS_8000:
+            samples = codec2.resampler().resample48_to_8(np.ascontiguousarray(samples, dtype=np.int16))
+        samples = np.concatenate([samples, np.zeros(int(tail * codec2.api.FREEDV_FS_8000), dtype=np.int16)])
+        duration = len(samples) / codec2.api.FREEDV_FS_8000
+
+        stats_before = self.demodulator.get_stats()
+        start = time.perf_counter()
+        for position in range(0, len(samples), self.blocksize):
+            self.demodulator.push_audio(samples[position : position + self.blocksize])
+            self.wait_for_decoders()
+        wall_time = time.perf_counter() - start
+
+        return self.get_replay_stats(stats_before, self.demodulator.get_stats(), duration, wall_time)
+
+    def replay_file(self, path, sample_rate=None, tail=1.0) -> dict:
+        samples, sample_rate = read_recording(path, sample_rate)
+        self.log.info("[MDM] [REPLAY] Replaying recording", path=str(path), sample_rate=sample_rate)
+        return self.replay(samples, sample_rate, tail)
+
+    def stop(self) -> None:
+        """
+        Stop the decoder threads started by the replay
+        """
+        if self.stream is None:
+            return
+        self.stream.active = False
+        for mode in self.demodulator.MODE_DICT.values():
+            mode["audio_buffer"].close()
+
+    @staticmethod
+    def get_replay_stats(before, after, duration, wall_time) -> dict:
+        modes = {}
+        for name, mode_after in after.items():
+            if not mode_after["decode"]:
+                continue
+            cpu_time = mode_after["cpu_time"] - before[name]["cpu_time"]
+            modes[name] = {
+                "cpu_time": round(cpu_time, 3),
+                "realtime_factor": round(duration / cpu_time, 1) if cpu_time > 0 else None,
+                "decoded_frames": mode_after["decoded_frames"] - before[name]["decoded_frames"],
+            }
+        return {
+            "duration": round(duration, 3),
+            "wall_time": round(wall_time, 3),
+            "realtime_factor": round(duration / wall_time, 1) if wall_time > 0 else None,
+            "modes": modes,
+        }
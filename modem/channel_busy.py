@@ -0,0 +1,113 @@
+"""
+Channel busy detection based on the signals found in the rx spectrum
+"""
+# pylint: disable=invalid-name, line-too-long
+
+import numpy as np
+
+import codec2
+
+
+class ChannelBusyDetector:
+    """
+    Keeps track of traffic in the channel slots
+
+    A slot becomes busy once signals have been present for ATTACK_TIME. Every
+    second of traffic keeps the slot busy for HOLD_FACTOR seconds after the
+    signal is gone, limited to MAX_HOLD_TIME. The state manager is only
+    updated if something changed.
+    """
+
+    # a slot is busy if it contains at least this number of signal bins
+    SLOT_SIGNAL_BINS = 2
+    # seconds of traffic before a slot is marked as busy
+    ATTACK_TIME = 0.0
+    # seconds a slot stays busy per second of traffic
+    HOLD_FACTOR = 10.0
+    # upper limit for the time a slot stays busy after the traffic is gone
+    MAX_HOLD_TIME = 20.0
+
+    def __init__(self, states, slots=5, attack_time=None, hold_factor=None, max_hold_time=None):
+        self.states = states
+        self.attack_time = self.ATTACK_TIME if attack_time is None else attack_time
+        self.hold_factor = self.HOLD_FACTOR if hold_factor is None else hold_factor
+        self.max_hold_time = self.MAX_HOLD_TIME if max_hold_time is None else max_hold_time
+
+        # per slot statistics of the latest block
+        self.slot_energy = np.zeros(slots, dtype=np.float64)
+        self.slot_signal_bins = np.zeros(slots, dtype=np.int64)
+
+        # per slot timers in seconds
+        self.traffic_time = np.zeros(slots, dtype=np.float64)
+        self.hold_time = np.zeros(slots, dtype=np.float64)
+        self.slot_busy = np.zeros(slots, dtype=bool)
+        self.busy = False
+
+        # last published state
+        self.published_slots = None
+        self.published_busy = None
+
+    def update(self, slot_signal_bins, slot_energy, duration) -> np.ndarray:
+        """
+        Update the busy state with the statistics of one rx block
+
+        Args:
+            slot_signal_bins: number of signal bins per slot
+            slot_energy: average level per slot in dB
+            duration: length of the block in seconds
+
+        Returns:
+            busy flag per slot
+        """
+        self.slot_signal_bins[:] = slot_signal_bins
+        self.slot_energy[:] = slot_energy
+        traffic = self.slot_signal_bins >= self.SLOT_SIGNAL_BINS
+
+        self.traffic_time = np.where(traffic, self.traffic_time + duration, 0.0)
+        active = traffic & (self.traffic_time >= self.attack_time)
+        self.hold_time = np.where(
+            active,
+            np.minimum(self.hold_time + duration * self.hold_factor, self.max_hold_time),
+            np.maximum(self.hold_time - duration, 0.0),
+        )
+        np.greater(self.hold_time, 0.0, out=self.slot_busy)
+        self.slot_busy |= active
+        self.busy = bool(self.slot_busy.any())
+
+        self.publish()
+        return self.slot_busy
+
+    def publish(self):
+        slots = self.slot_busy.tolist()
+        if slots != self.published_slots:
+            self.published_slots = slots
+            self.states.set_channel_slot_busy(slots)
+        if self.busy != self.published_busy:
+            self.published_busy = self.busy
+            self.states.set_channel_busy_condition_traffic(self.busy)
+
+    def is_busy_for_mode(self, mode) -> bool:
+        """
+        Check if one of the slots used by a codec2 mode is busy
+
+        Args:
+            mode: codec2 mode name, e.g. "datac1"
+        """
+        used_slots = codec2.FREEDV_MODE_USED_SLOTS[mode.lower()].value
+        return bool(np.any(self.slot_busy & np.asarray(used_slots)))
+
+    def reset(self):
+        self.traffic_time.fill(0)
+        self.hold_time.fill(0)
+        self.slot_busy.fill(False)
+        self.busy = False
+        self.publish()
+
+    def get_stats(self) -> dict:
+        return {
+            "busy": self.busy,
+            "slot_busy": self.slot_busy.tolist(),
+            "slot_energy_db": self.slot_energy.round(1).tolist(),
+            "slot_signal_bins": self.slot_signal_bins.tolist(),
+            "hold_time": self.hold_time.round(2).tolist(),
+        }
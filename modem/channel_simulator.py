@@ -0,0 +1,222 @@
+"""
+Simulated HF channel for testing the modem without radios
+
+ChannelSimulator degrades 8 kHz audio with clock drift, Watterson fading,
+frequency offset and additive white gaussian noise. LoopbackChannel connects
+the audio of two in-process RF instances through a pair of simulators in
+real time, so complete ARQ sessions run through the real modulator and
+demodulator.
+"""
+# pylint: disable=invalid-name, line-too-long
+
+import threading
+import time
+
+import numpy as np
+import structlog
+
+import codec2
+from audio_replay import ReplayStream
+
+
+class ChannelSimulator:
+    """
+    Streaming channel model for 8 kHz int16 audio
+
+    All impairments keep their state between calls, so a signal can be
+    processed in blocks of any size without discontinuities.
+    """
+
+    # Watterson profiles as (doppler spread in Hz, path delay in s), see ITU-R F.1487
+    FADING_PROFILES = {
+        "mpg": (0.1, 0.0005),
+        "mpp": (1.0, 0.002),
+        "mpd": (2.0, 0.004),
+    }
+    # number of sinusoids per fading path
+    FADING_OSCILLATORS = 32
+    # taps of the hilbert transformer, used for frequency offset and fading
+    HILBERT_TAPS = 127
+    # snr is defined within this noise bandwidth, like codec2 does
+    NOISE_BANDWIDTH = 3000
+    # reference level of the transmitted signal, close to the rms of codec2 data modes
+    SIGNAL_RMS = 7000
+
+    def __init__(self, snr_db=None, frequency_offset=0.0, fading=None, clock_drift_ppm=0.0,
+                 signal_rms=None, sample_rate=codec2.api.FREEDV_FS_8000, seed=None):
+        """
+        Args:
+            snr_db: signal to noise ratio in 3 kHz bandwidth, None for a noiseless channel
+            frequency_offset: frequency offset in Hz
+            fading: Watterson profile name "mpg", "mpp" or "mpd", or a tuple of (doppler spread, delay)
+            clock_drift_ppm: sample clock difference between transmitter and receiver
+            signal_rms: signal level the snr refers to, defaults to SIGNAL_RMS
+            sample_rate: sample rate of the audio
+            seed: seed of the random generator for reproducible runs
+        """
+        self.sample_rate = sample_rate
+        self.snr_db = snr_db
+        self.frequency_offset = frequency_offset
+        self.clock_drift_ppm = clock_drift_ppm
+        self.signal_rms = self.SIGNAL_RMS if signal_rms is None else signal_rms
+        self.rng = np.random.default_rng(seed)
+
+        if isinstance(fading, str):
+            fading = self.FADING_PROFILES[fading.lower()]
+        self.fading = fading
+
+        self.noise_std = 0.0
+        if snr_db is not None:
+            # white noise spreads over fs/2, only NOISE_BANDWIDTH of it counts for the snr
+            noise_power = self.signal_rms ** 2 / 10 ** (snr_db / 10) * (sample_rate / 2) / self.NOISE_BANDWIDTH
+            self.noise_std = float(np.sqrt(noise_power))
+
+        # clock drift, fractional read position within [last sample, block]
+        self.drift_step = 1.0 + clock_drift_ppm * 1e-6
+        self.drift_position = 1.0
+        self.drift_history = np.zeros(1, dtype=np.float64)
+
+        # hilbert transformer for the analytic signal, the real part is delayed by half the filter length
+        half = self.HILBERT_TAPS // 2
+        n = np.arange(-half, half + 1)
+        taps = np.zeros(self.HILBERT_TAPS, dtype=np.float64)
+        odd = n % 2 != 0
+        taps[odd] = 2 / (np.pi * n[odd])
+        self.hilbert_taps = taps * np.hamming(self.HILBERT_TAPS)
+        self.hilbert_history = np.zeros(self.HILBERT_TAPS - 1, dtype=np.float64)
+
+        self.sample_counter = 0
+
+        # fading paths as sums of complex sinusoids with gaussian doppler frequencies
+        if self.fading is not None:
+            spread, delay = self.fading
+            shape = (2, self.FADING_OSCILLATORS)
+            # the watterson doppler spread is two times the standard deviation of the spectrum
+            self.fading_frequencies = self.rng.normal(0, spread / 2, shape)
+            self.fading_phases = self.rng.uniform(0, 2 * np.pi, shape)
+            self.fading_delay = max(int(round(delay * sample_rate)), 1)
+            self.fading_history = np.zeros(self.fading_delay, dtype=np.complex128)
+
+    def needs_analytic_signal(self) -> bool:
+        return self.fading is not None or self.frequency_offset != 0
+
+    def apply_clock_drift(self, samples):
+        if self.drift_step == 1.0:
+            return samples
+        buffer = np.concatenate([self.drift_history, samples])
+        last = len(buffer) - 1
+        count = int(np.ceil((last - self.drift_position) / self.drift_step))
+        positions = self.drift_position + self.drift_step * np.arange(max(count, 0))
+        output = np.interp(positions, np.arange(len(buffer)), buffer)
+        self.drift_position += self.drift_step * len(positions) - last
+        self.drift_history = buffer[-1:]
+        return output
+
+    def analytic_signal(self, samples):
+        buffer = np.concatenate([self.hilbert_history, samples])
+        imag = np.convolve(buffer, self.hilbert_taps, mode="valid")
+        real = buffer[self.HILBERT_TAPS // 2 : self.HILBERT_TAPS // 2 + len(samples)]
+        self.hilbert_history = buffer[len(buffer) - len(self.hilbert_history):]
+        return real + 1j * imag
+
+    def apply_fading(self, analytic, t):
+        # two paths of equal average power, the sum has unity power
+        phase = 2 * np.pi * self.fading_frequencies[:, :, None] * t + self.fading_phases[:, :, None]
+        gains = np.exp(1j * phase).sum(axis=1) / np.sqrt(2 * self.FADING_OSCILLATORS)
+
+        buffer = np.concatenate([self.fading_history, analytic])
+        delayed = buffer[: len(analytic)]
+        self.fading_history = buffer[len(analytic):]
+        return gains[0] * analytic + gains[1] * delayed
+
+    def process(self, samples) -> np.ndarray:
+        """
+        Pass a block of audio through the channel
+
+        Args:
+            samples: audio as np.int16
+
+        Returns:
+            degraded audio as np.int16, its length differs slightly if clock drift is enabled
+        """
+        signal = self.apply_clock_drift(np.asarray(samples, dtype=np.float64))
+
+        if self.needs_analytic_signal():
+            t = (self.sample_counter + np.arange(len(signal))) / self.sample_rate
+            analytic = self.analytic_signal(signal)
+            if self.fading is not None:
+                analytic = self.apply_fading(analytic, t)
+            if self.frequency_offset != 0:
+                analytic = analytic * np.exp(2j * np.pi * self.frequency_offset * t)
+            signal = analytic.real
+        self.sample_counter += len(signal)
+
+        if self.noise_std > 0:
+            signal = signal + self.rng.normal(0, self.noise_std, len(signal))
+
+        return np.clip(np.round(signal), -32768, 32767).astype(np.int16)
+
+
+class LoopbackChannel:
+    """
+    Connects two RF instances through simulated channels
+
+    Every tick the tx audio of both stations is taken from their output
+    callbacks, passed through the channel simulator towards the other station
+    and pushed into its rx path, like a sound card would do. The loop runs in
+    real time, because ARQ timeouts are based on wall clock time.
+    """
+
+    # output callback block length of RF at 48 kHz
+    BLOCKSIZE = 4800
+
+    def __init__(self, rf_a, rf_b, channel_ab=None, channel_ba=None):
+        """
+        Args:
+            rf_a: first RF instance
+            rf_b: second RF instance
+            channel_ab: ChannelSimulator from a to b, None for a clean channel
+            channel_ba: ChannelSimulator from b to a, None for a clean channel
+        """
+        self.log = structlog.get_logger("LoopbackChannel")
+        self.links = [
+            (rf_a, rf_b, channel_ab or ChannelSimulator(), codec2.resampler()),
+            (rf_b, rf_a, channel_ba or ChannelSimulator(), codec2.resampler()),
+        ]
+        self.tick = self.BLOCKSIZE / rf_a.AUDIO_SAMPLE_RATE
+        self.stream = ReplayStream()
+        self.running = False
+        self.thread = None
+
+    def start(self) -> None:
+        for tx, _, _, _ in self.links:
+            if tx.demodulator.stream is None:
+                tx.demodulator.start(self.stream)
+        self.running = True
+        self.thread = threading.Thread(target=self.worker, name="loopback channel", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.stream.active = False
+        for tx, _, _, _ in self.links:
+            for mode in tx.demodulator.MODE_DICT.values():
+                mode["audio_buffer"].close()
+
+    def worker(self) -> None:
+        outdata = np.zeros((self.BLOCKSIZE, 1), dtype=np.int16)
+        next_tick = time.monotonic()
+        while self.running:
+            for tx, rx, channel, resampler in self.links:
+                tx.sd_output_audio_callback(outdata, self.BLOCKSIZE, None, None)
+                audio_8k = resampler.resample48_to_8(outdata.reshape(-1))
+                rx.push_rx_audio(channel.process(audio_8k))
+
+            next_tick += self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.log.debug("[MDM] [LOOPBACK] Channel is running late", delay=round(-delay, 3))
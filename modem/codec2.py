@@ -11,7 +11,7 @@ import glob
 import os
 import sys
 from enum import Enum
-from threading import Lock
+from threading import Condition, Lock
 
 import numpy as np
 import structlog
@@ -61,6 +61,23 @@ def freedv_get_mode_value_by_name(mode: str) -> int:
     return FREEDV_MODE[mode.lower()].value
 
 
+def get_mode_value(mode) -> int:
+    """
+    Get the codec2 mode value of a FREEDV_MODE, mode value or mode name
+
+    Args:
+        mode: FREEDV_MODE, int or str
+
+    Returns:
+        int
+    """
+    if isinstance(mode, FREEDV_MODE):
+        return mode.value
+    if isinstance(mode, str):
+        return freedv_get_mode_value_by_name(mode)
+    return mode
+
+
 # Function for returning the mode name
 def freedv_get_mode_name_by_value(mode: int) -> str:
     """
@@ -77,93 +94,94 @@ def freedv_get_mode_name_by_value(mode: int) -> str:
 # Get the directory of the current script file
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(script_dir)
-# Use script_dir to construct the paths for file search
-if sys.platform == "linux":
-    files = glob.glob(os.path.join(script_dir, "**/*libcodec2*"), recursive=True)
-    files.append(os.path.join(script_dir, "libcodec2.so"))
-elif sys.platform == "darwin":
-    if hasattr(sys, "_MEIPASS"):
-        files = glob.glob(os.path.join(getattr(sys, "_MEIPASS"), '**/*libcodec2*'), recursive=True)
-    else:
-        files = glob.glob(os.path.join(script_dir, "**/*libcodec2*.dylib"), recursive=True)
-elif sys.platform in ["win32", "win64"]:
-    files = glob.glob(os.path.join(script_dir, "**\\*libcodec2*.dll"), recursive=True)
-else:
-    files = []
-
-api = None
-for file in files:
-    try:
-        api = ctypes.CDLL(file)
-        #log.info("[C2 ] Libcodec2 loaded", path=file)
-        break
-    except OSError as err:
-        pass
-        #log.info("[C2 ] Error:  Libcodec2 found but not loaded", path=file, e=err)
-
-# Quit module if codec2 cant be loaded
-if api is None or "api" not in locals():
-    log.critical("[C2 ] Error:  Libcodec2 not loaded - Exiting")
-    sys.exit(1)
-log.info("[C2 ] Libcodec2 loaded...")
-# ctypes function init
-
-# api.freedv_set_tuning_range.restype = ctypes.c_int
-# api.freedv_set_tuning_range.argype = [ctypes.c_void_p, ctypes.c_float, ctypes.c_float]
-
-api.freedv_open.argype = [ctypes.c_int]  # type: ignore
-api.freedv_open.restype = ctypes.c_void_p
-
-api.freedv_set_sync.argype = [ctypes.c_void_p, ctypes.c_int]  # type: ignore
-api.freedv_set_sync.restype = ctypes.c_void_p
-
-api.freedv_open_advanced.argtype = [ctypes.c_int, ctypes.c_void_p]  # type: ignore
-api.freedv_open_advanced.restype = ctypes.c_void_p
 
-api.freedv_get_bits_per_modem_frame.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_bits_per_modem_frame.restype = ctypes.c_int
 
-api.freedv_get_modem_extended_stats.argtype = [ctypes.c_void_p, ctypes.c_void_p]
-api.freedv_get_modem_extended_stats.restype = ctypes.c_int
-
-api.freedv_nin.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_nin.restype = ctypes.c_int
-
-api.freedv_rawdatarx.argtype = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]  # type: ignore
-api.freedv_rawdatarx.restype = ctypes.c_int
-
-api.freedv_rawdatatx.argtype = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]  # type: ignore
-api.freedv_rawdatatx.restype = ctypes.c_int
-
-api.freedv_rawdatapostambletx.argtype = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]  # type: ignore
-api.freedv_rawdatapostambletx.restype = ctypes.c_int
-
-api.freedv_rawdatapreambletx.argtype = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]  # type: ignore
-api.freedv_rawdatapreambletx.restype = ctypes.c_int
-
-api.freedv_get_n_max_modem_samples.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_n_max_modem_samples.restype = ctypes.c_int
-
-api.freedv_set_frames_per_burst.argtype = [ctypes.c_void_p, ctypes.c_int]  # type: ignore
-api.freedv_set_frames_per_burst.restype = ctypes.c_void_p
+def find_library_files() -> list:
+    """
+    Candidate paths of the codec2 library for this platform
+    """
+    if sys.platform == "linux":
+        files = glob.glob(os.path.join(script_dir, "**/*libcodec2*"), recursive=True)
+        files.append(os.path.join(script_dir, "libcodec2.so"))
+    elif sys.platform == "darwin":
+        if hasattr(sys, "_MEIPASS"):
+            files = glob.glob(os.path.join(getattr(sys, "_MEIPASS"), '**/*libcodec2*'), recursive=True)
+        else:
+            files = glob.glob(os.path.join(script_dir, "**/*libcodec2*.dylib"), recursive=True)
+    elif sys.platform in ["win32", "win64"]:
+        files = glob.glob(os.path.join(script_dir, "**\\*libcodec2*.dll"), recursive=True)
+    else:
+        files = []
+    return files
 
-api.freedv_get_rx_status.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_rx_status.restype = ctypes.c_int
 
-api.freedv_get_modem_stats.argtype = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]  # type: ignore
-api.freedv_get_modem_stats.restype = ctypes.c_int
+def load_library():
+    """
+    Load the first codec2 library which works on this platform
 
-api.freedv_get_n_tx_postamble_modem_samples.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_n_tx_postamble_modem_samples.restype = ctypes.c_int
+    Returns:
+        ctypes.CDLL, None if no library could be loaded
+    """
+    for file in find_library_files():
+        try:
+            return ctypes.CDLL(file)
+        except OSError:
+            pass
+    return None
+
+
+# Prototypes of all used library functions. Instances are opaque `struct freedv *`,
+# sample buffers are `short *` passed as integer address (or anything else ctypes
+# accepts as c_void_p), so numpy buffers are handed over without temporary objects.
+API_PROTOTYPES = {
+    "freedv_open": ([ctypes.c_int], ctypes.c_void_p),
+    "freedv_open_advanced": ([ctypes.c_int, ctypes.c_void_p], ctypes.c_void_p),
+    "freedv_close": ([ctypes.c_void_p], None),
+    "freedv_set_sync": ([ctypes.c_void_p, ctypes.c_int], None),
+    "freedv_set_frames_per_burst": ([ctypes.c_void_p, ctypes.c_int], None),
+    "freedv_get_bits_per_modem_frame": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_n_max_modem_samples": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_n_nom_modem_samples": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_n_tx_modem_samples": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_n_tx_preamble_modem_samples": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_n_tx_postamble_modem_samples": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_modem_stats": (
+        [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_float)], None
+    ),
+    "freedv_get_modem_extended_stats": ([ctypes.c_void_p, ctypes.c_void_p], None),
+    # rx
+    "freedv_nin": ([ctypes.c_void_p], ctypes.c_int),
+    "freedv_rawdatarx": ([ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p], ctypes.c_int),
+    "freedv_get_rx_status": ([ctypes.c_void_p], ctypes.c_int),
+    # tx
+    "freedv_rawdatatx": ([ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_ubyte)], None),
+    "freedv_rawdatapreambletx": ([ctypes.c_void_p, ctypes.c_void_p], ctypes.c_int),
+    "freedv_rawdatapostambletx": ([ctypes.c_void_p, ctypes.c_void_p], ctypes.c_int),
+    "freedv_gen_crc16": ([ctypes.c_char_p, ctypes.c_int], ctypes.c_ushort),
+    # resampler
+    "fdmdv_8_to_48_short": ([ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int], None),
+    "fdmdv_48_to_8_short": ([ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int], None),
+}
+
+
+def bind_api(lib) -> None:
+    """
+    Declare argument and result types of all used library functions
+    """
+    for name, (argtypes, restype) in API_PROTOTYPES.items():
+        function = getattr(lib, name)
+        function.argtypes = argtypes
+        function.restype = restype
 
-api.freedv_get_n_tx_preamble_modem_samples.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_n_tx_preamble_modem_samples.restype = ctypes.c_int
 
-api.freedv_get_n_tx_modem_samples.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_n_tx_modem_samples.restype = ctypes.c_int
+api = load_library()
 
-api.freedv_get_n_max_modem_samples.argtype = [ctypes.c_void_p]  # type: ignore
-api.freedv_get_n_max_modem_samples.restype = ctypes.c_int
+# Quit module if codec2 cant be loaded
+if api is None:
+    log.critical("[C2 ] Error:  Libcodec2 not loaded - Exiting")
+    sys.exit(1)
+log.info("[C2 ] Libcodec2 loaded...")
+bind_api(api)
 
 api.FREEDV_FS_8000 = 8000  # type: ignore
 
@@ -261,6 +279,44 @@ class MODEMSTATS(ctypes.Structure):
     ]
 
 
+class modem_stats_snapshot:
+    """
+    Reusable MODEMSTATS buffer of a single decoder
+
+    update() fills the structure with one freedv_get_modem_extended_stats call,
+    all values are read from this copy afterwards.
+    """
+
+    def __init__(self):
+        self.stats = MODEMSTATS()
+        self.stats_ref = ctypes.byref(self.stats)
+        # numpy view of the symbol array, shape (MODEM_STATS_NC_MAX, MODEM_STATS_NR_MAX)
+        self.rx_symbols = np.ctypeslib.as_array(self.stats.rx_symbols)
+
+    def update(self, freedv: ctypes.c_void_p) -> None:
+        """
+        Read the modem stats of the latest demodulated frame
+
+        Args:
+            freedv: codec2 instance
+        """
+        api.freedv_get_modem_extended_stats(freedv, self.stats_ref)
+
+    @property
+    def snr(self) -> int:
+        """
+        Signal-to-noise ratio in dB
+        """
+        return int(round(self.stats.snr_est, 1))
+
+    @property
+    def frequency_offset(self) -> float:
+        """
+        Offset of audio frequency in Hz
+        """
+        return round(self.stats.foff) * (-1)
+
+
 # Return code flags for freedv_get_rx_status() function
 api.FREEDV_RX_TRIAL_SYNC = 0x1  # type: ignore # demodulator has trial sync
 api.FREEDV_RX_SYNC = 0x2  # type: ignore # demodulator has sync
@@ -286,55 +342,199 @@ api.rx_sync_flags_to_text = [  # type: ignore
     "EBST",
 ]
 
-# Audio buffer ---------------------------------------------------------
-class audio_buffer:
+# Audio ring ---------------------------------------------------------
+class audio_ring:
     """
-    Thread-safe audio buffer, which fits the needs of codec2
+    Shared audio sample store, written once per audio block
 
-    made by David Rowe, VK5DGR
+    Every consumer reads through its own audio_ring_cursor, so a block is stored
+    only once, regardless of how many codec2 modes are decoding it.
     """
 
-    # A buffer of int16 samples, using a fixed length numpy array self.buffer for storage
-    # self.nbuffer is the current number of samples in the buffer
+    # Mirrored storage: each sample is stored at its position and again `size`
+    # samples later, so every cursor sees its unread samples as one contiguous block.
+    # self.written is the total number of samples pushed so far
     def __init__(self, size):
-        log.debug("[C2 ] Creating audio buffer", size=size)
+        log.debug("[C2 ] Creating audio ring", size=size)
         self.size = size
-        self.buffer = np.zeros(size, dtype=np.int16)
-        self.nbuffer = 0
+        self.storage = np.zeros(2 * size, dtype=np.int16)
+        # address of the storage for passing samples to codec2
+        self.address = self.storage.ctypes.data
+        self.written = 0
         self.mutex = Lock()
+        self.cursors = []
+
+    def cursor(self, size):
+        """
+        Create a new read cursor, starting at the latest written sample
+
+        Args:
+            size: maximum amount of unread samples the cursor keeps
 
-    def push(self, samples):
+        Returns:
+            audio_ring_cursor
+        """
+        # a cursor may lag one full push behind, which must not overwrite its unread samples
+        assert 2 * size <= self.size
+        with self.mutex:
+            cursor = audio_ring_cursor(self, size)
+            self.cursors.append(cursor)
+        return cursor
+
+    def push(self, samples) -> bool:
         """
-        Push new data to buffer
+        Push new data to the ring and wake up consumers
+        once their requested amount of samples is available
 
         Args:
             samples:
 
         Returns:
-            Nothing
+            True if at least one cursor overflowed and lost its oldest samples
         """
-        self.mutex.acquire()
-        # Add samples at the end of the buffer
-        assert self.nbuffer + len(samples) <= self.size
-        self.buffer[self.nbuffer : self.nbuffer + len(samples)] = samples
-        self.nbuffer += len(samples)
-        self.mutex.release()
+        overflow = False
+        length = len(samples)
+        with self.mutex:
+            head = self.written % self.size
+            end = head + length
+            self.storage[head:end] = samples
+            # Write the mirror copy
+            if end <= self.size:
+                self.storage[head + self.size : end + self.size] = samples
+            else:
+                wrap = self.size - head
+                self.storage[head + self.size :] = samples[:wrap]
+                self.storage[: end - self.size] = samples[wrap:]
+            self.written += length
+
+            for cursor in self.cursors:
+                if not cursor.active:
+                    continue
+                # drop the oldest samples of a cursor which can't keep up
+                if self.written - cursor.position > cursor.size:
+                    cursor.position = self.written - cursor.size
+                    cursor.overflows += 1
+                    overflow = True
+                if self.written - cursor.position >= cursor.wakeup_threshold:
+                    cursor.data_available.notify()
+        return overflow
+
+
+class audio_ring_cursor:
+    """
+    Read cursor of a single consumer on an audio_ring, which fits the needs of codec2
+    """
+
+    def __init__(self, ring, size):
+        self.ring = ring
+        self.size = size
+        # absolute index of the oldest unread sample
+        self.position = ring.written
+        self.active = True
+        self.overflows = 0
+        self.data_available = Condition(ring.mutex)
+        # notified whenever the consumer goes back to waiting for samples
+        self.consumer_idle = Condition(ring.mutex)
+        self.waiting = False
+        self.wakeup_threshold = size + 1
+        self.closed = False
+
+    @property
+    def nbuffer(self):
+        """
+        Number of unread samples
+        """
+        if not self.active:
+            return 0
+        return self.ring.written - self.position
+
+    @property
+    def buffer(self):
+        """
+        Contiguous view of `size` samples, starting with the oldest unread sample
+        """
+        start = self.position % self.ring.size
+        return self.ring.storage[start : start + self.size]
+
+    @property
+    def address(self) -> int:
+        """
+        Address of the oldest unread sample, for passing the unread samples to codec2
+        """
+        return self.ring.address + 2 * (self.position % self.ring.size)
 
     def pop(self, size):
         """
-        get data from buffer in size of NIN
+        Mark data as read in size of NIN
         Args:
           size:
 
         Returns:
             Nothing
         """
-        self.mutex.acquire()
-        # Remove samples from the start of the buffer
-        self.nbuffer -= size
-        self.buffer[: self.nbuffer] = self.buffer[size : size + self.nbuffer]
-        assert self.nbuffer >= 0
-        self.mutex.release()
+        with self.ring.mutex:
+            # the cursor might have been re-attached meanwhile, never read ahead of the ring
+            self.position = min(self.position + size, self.ring.written)
+
+    def set_active(self, active: bool):
+        """
+        Attach or detach the cursor. A detached cursor is skipped by push(), an
+        attached one starts reading at the latest written sample.
+        """
+        with self.ring.mutex:
+            if active and not self.active:
+                self.position = self.ring.written
+            self.active = active
+
+    def wait_for_samples(self, size, timeout=None) -> bool:
+        """
+        Block until at least `size` unread samples are available
+
+        Args:
+            size: number of samples the consumer needs, usually NIN
+            timeout: maximum time to wait in seconds, None waits forever
+
+        Returns:
+            True if enough samples are available, False on timeout or if the cursor was closed
+        """
+        with self.data_available:
+            self.wakeup_threshold = size
+            self.waiting = True
+            self.consumer_idle.notify_all()
+            self.data_available.wait_for(
+                lambda: self.nbuffer >= size or self.closed, timeout
+            )
+            self.waiting = False
+            self.wakeup_threshold = self.size + 1
+            return self.nbuffer >= size and not self.closed
+
+    def wait_until_consumed(self, timeout=None) -> bool:
+        """
+        Block until the consumer has read all samples it can use and waits for more.
+        Used for feeding recorded audio as fast as the consumer can process it.
+
+        Args:
+            timeout: maximum time to wait in seconds, None waits forever
+
+        Returns:
+            False on timeout
+        """
+        with self.consumer_idle:
+            return self.consumer_idle.wait_for(
+                lambda: not self.active
+                or self.closed
+                or (self.waiting and self.nbuffer < self.wakeup_threshold),
+                timeout,
+            )
+
+    def close(self):
+        """
+        Release a consumer blocked in wait_for_samples
+        """
+        with self.data_available:
+            self.closed = True
+            self.data_available.notify_all()
+            self.consumer_idle.notify_all()
 
 
 # Resampler ---------------------------------------------------------
@@ -345,80 +545,165 @@ api.FDMDV_OS_48 = 6  # type: ignore
 api.FDMDV_OS_TAPS_48K = 48  # type: ignore
 # Number of oversampling filter taps at 8kHz
 api.FDMDV_OS_TAPS_48_8K = api.FDMDV_OS_TAPS_48K // api.FDMDV_OS_48  # type: ignore
-api.fdmdv_8_to_48_short.argtype = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]  # type: ignore
-api.fdmdv_48_to_8_short.argtype = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]  # type: ignore
 
 
 class resampler:
     """
     Re-sampler class
+
+    Streaming 48<->8 kHz resampler. Filter memories and input samples live in
+    preallocated work buffers, so resampling a block does not allocate when the
+    caller provides the output array. Blocks of any length are accepted, 48 kHz
+    samples which do not fill a complete 8 kHz sample are carried over to the
+    next call. Blocks larger than the work buffers are processed in chunks.
     """
 
-    # Re-sample an array of variable length, we just store the filter memories here
     MEM8 = api.FDMDV_OS_TAPS_48_8K
     MEM48 = api.FDMDV_OS_TAPS_48K
+    # fraction bits of the fixed point tx gain
+    GAIN_SHIFT = 12
 
-    def __init__(self):
+    def __init__(self, blocksize: int = 4800, tx_blocksize: int = 8000):
+        """
+        Args:
+            blocksize: largest 48 kHz block downsampled in one codec2 call
+            tx_blocksize: largest 8 kHz block upsampled in one codec2 call
+        """
         log.debug("[C2 ] Create 48<->8 kHz resampler")
-        self.filter_mem8 = np.zeros(self.MEM8, dtype=np.int16)
-        self.filter_mem48 = np.zeros(self.MEM48)
+        self.capacity48 = max(blocksize // api.FDMDV_OS_48, 1) * api.FDMDV_OS_48  # type: ignore
+        self.capacity8 = max(tx_blocksize, 1)
+
+        # filter memory followed by the input samples, codec2 updates the
+        # filter memory at the start of the buffer itself
+        self.in48_mem = np.zeros(self.MEM48 + self.capacity48, dtype=np.int16)
+        self.in8_mem = np.zeros(self.MEM8 + self.capacity8, dtype=np.int16)
+        # In C: pin48=&in48_mem[MEM48], pin8=&in8_mem[MEM8]
+        self.pin48 = self.in48_mem.ctypes.data + 2 * self.MEM48
+        self.pin8 = self.in8_mem.ctypes.data + 2 * self.MEM8
+        # work buffer for scaling the 8 kHz input
+        self.gain_mem = np.zeros(self.capacity8, dtype=np.int32)
+
+        # number of 48 kHz samples waiting behind the filter memory
+        self.carry48 = 0
+
+    def reset(self) -> None:
+        """
+        Clear filter memories and carried over samples
+        """
+        self.in48_mem.fill(0)
+        self.in8_mem.fill(0)
+        self.carry48 = 0
 
-    def resample48_to_8(self, in48):
+    def output_length48_to_8(self, n48: int) -> int:
+        """
+        Number of 8 kHz samples the next resample48_to_8 call returns for n48 input samples
+        """
+        return (self.carry48 + n48) // api.FDMDV_OS_48  # type: ignore
+
+    @staticmethod
+    def prepare_output(out, length):
+        if out is None:
+            return np.empty(length, dtype=np.int16)
+        assert out.dtype == np.int16 and out.flags.c_contiguous
+        assert len(out) >= length
+        return out[:length]
+
+    def resample48_to_8(self, in48, out=None):
         """
         Audio resampler integration from codec2
         Downsample audio from 48000Hz to 8000Hz
         Args:
             in48: input data as np.int16
+            out: optional np.int16 output array, see output_length48_to_8
 
         Returns:
-            Downsampled 8000Hz data as np.int16
+            Downsampled 8000Hz data as np.int16, a view into out if given
         """
         assert in48.dtype == np.int16
-        # Length of input vector must be an integer multiple of api.FDMDV_OS_48
-        assert len(in48) % api.FDMDV_OS_48 == 0  # type: ignore
-
-        # Concatenate filter memory and input samples
-        in48_mem = np.zeros(self.MEM48 + len(in48), dtype=np.int16)
-        in48_mem[: self.MEM48] = self.filter_mem48
-        in48_mem[self.MEM48 :] = in48
-
-        # In C: pin48=&in48_mem[MEM48]
-        pin48 = ctypes.byref(np.ctypeslib.as_ctypes(in48_mem), 2 * self.MEM48)
-        n8 = int(len(in48) / api.FDMDV_OS_48)  # type: ignore
-        out8 = np.zeros(n8, dtype=np.int16)
-        api.fdmdv_48_to_8_short(out8.ctypes, pin48, n8)  # type: ignore
-
-        # Store memory for next time
-        self.filter_mem48 = in48_mem[: self.MEM48]
+        out8 = self.prepare_output(out, self.output_length48_to_8(len(in48)))
+
+        pos_in = 0
+        pos_out = 0
+        while pos_in < len(in48):
+            take = min(len(in48) - pos_in, self.capacity48 - self.carry48)
+            start = self.MEM48 + self.carry48
+            self.in48_mem[start : start + take] = in48[pos_in : pos_in + take]
+            pos_in += take
+
+            total = self.carry48 + take
+            n8 = total // api.FDMDV_OS_48  # type: ignore
+            if n8:
+                pout8 = out8.ctypes.data + 2 * pos_out
+                api.fdmdv_48_to_8_short(pout8, self.pin48, n8)  # type: ignore
+                pos_out += n8
+
+            # move samples which did not make a complete output sample to the front
+            used = n8 * api.FDMDV_OS_48  # type: ignore
+            self.carry48 = total - used
+            if used and self.carry48:
+                self.in48_mem[self.MEM48 : self.MEM48 + self.carry48] = self.in48_mem[
+                    self.MEM48 + used : self.MEM48 + used + self.carry48
+                ]
 
         return out8
 
-    def resample8_to_48(self, in8):
+    @classmethod
+    def fixed_point_gain(cls, gain: float) -> int:
+        """
+        Convert a linear gain into the fixed point format of resample8_to_48
+        """
+        gain_q = int(round(gain * (1 << cls.GAIN_SHIFT)))
+        # int16 samples scaled by the gain have to fit into int32
+        assert 0 <= gain_q < (1 << 31) // 32768
+        return gain_q
+
+    def resample8_to_48(self, in8, out=None, gain=None):
         """
         Audio resampler integration from codec2
         Re-sample audio from 8000Hz to 48000Hz
         Args:
             in8: input data as np.int16
+            out: optional np.int16 output array with at least 6 * len(in8) samples
+            gain: optional fixed point gain from fixed_point_gain(), applied while
+                  copying the input into the filter buffer
 
         Returns:
-            48000Hz audio as np.int16
+            48000Hz audio as np.int16, a view into out if given
         """
         assert in8.dtype == np.int16
+        out48 = self.prepare_output(out, api.FDMDV_OS_48 * len(in8))  # type: ignore
+
+        pos_in = 0
+        while pos_in < len(in8):
+            n8 = min(len(in8) - pos_in, self.capacity8)
+            if gain is None:
+                self.in8_mem[self.MEM8 : self.MEM8 + n8] = in8[pos_in : pos_in + n8]
+            else:
+                self.apply_gain(in8[pos_in : pos_in + n8], gain, self.in8_mem[self.MEM8 : self.MEM8 + n8])
+            pout48 = out48.ctypes.data + 2 * api.FDMDV_OS_48 * pos_in  # type: ignore
+            api.fdmdv_8_to_48_short(pout48, self.pin8, n8)  # type: ignore
+            pos_in += n8
 
-        # Concatenate filter memory and input samples
-        in8_mem = np.zeros(self.MEM8 + len(in8), dtype=np.int16)
-        in8_mem[: self.MEM8] = self.filter_mem8
-        in8_mem[self.MEM8 :] = in8
-
-        # In C: pin8=&in8_mem[MEM8]
-        pin8 = ctypes.byref(np.ctypeslib.as_ctypes(in8_mem), 2 * self.MEM8)
-        out48 = np.zeros(api.FDMDV_OS_48 * len(in8), dtype=np.int16)  # type: ignore
-        api.fdmdv_8_to_48_short(out48.ctypes, pin8, len(in8))  # type: ignore
+        return out48
 
-        # Store memory for next time
-        self.filter_mem8 = in8_mem[: self.MEM8]
+    def apply_gain(self, samples, gain: int, out):
+        """
+        Scale int16 samples by a fixed point gain with rounding and saturation
 
-        return out48
+        Args:
+            samples: input as np.int16
+            gain: fixed point gain from fixed_point_gain()
+            out: np.int16 output array of the same length, may be samples itself
+        """
+        for position in range(0, len(samples), self.capacity8):
+            chunk = samples[position : position + self.capacity8]
+            scaled = self.gain_mem[: len(chunk)]
+            np.multiply(chunk, gain, out=scaled, dtype=np.int32)
+            scaled += 1 << (self.GAIN_SHIFT - 1)
+            scaled >>= self.GAIN_SHIFT
+            np.clip(scaled, -32768, 32767, out=scaled)
+            out[position : position + len(chunk)] = scaled
+        return out
 
 def open_instance(mode: int) -> ctypes.c_void_p:
     """
@@ -458,7 +743,149 @@ def get_bytes_per_frame(mode: int) -> int:
     :return: Bytes per frame of the supplied codec2 data mode
     :rtype: int
     """
-    freedv = open_instance(mode)
-    # TODO add close session
-    # get number of bytes per frame for mode
-    return int(api.freedv_get_bits_per_modem_frame(freedv) / 8)
+    return get_mode_info(mode).bytes_per_frame
+
+
+class mode_info:
+    """
+    Frame geometry of a codec2 data mode
+
+    Queried once from a temporary instance, which is closed afterwards.
+    """
+
+    def __init__(self, mode: int):
+        freedv = open_instance(mode)
+        try:
+            self.mode = mode
+            self.name = FREEDV_MODE(mode).name
+            self.bytes_per_frame = int(api.freedv_get_bits_per_modem_frame(freedv) / 8)
+            # 2 bytes crc16
+            self.payload_per_frame = self.bytes_per_frame - 2
+            self.preamble_samples = api.freedv_get_n_tx_preamble_modem_samples(freedv)
+            self.modem_samples = api.freedv_get_n_tx_modem_samples(freedv)
+            self.postamble_samples = api.freedv_get_n_tx_postamble_modem_samples(freedv)
+            self.frame_samples = self.preamble_samples + self.modem_samples + self.postamble_samples
+            # seconds on air of a frame including preamble and postamble
+            self.airtime = self.frame_samples / api.FREEDV_FS_8000
+        finally:
+            api.freedv_close(freedv)
+
+
+# process wide registry of mode_info by mode value
+MODE_REGISTRY = {}
+MODE_REGISTRY_LOCK = Lock()
+
+
+def get_mode_info(mode) -> mode_info:
+    """
+    Frame geometry of a codec2 mode, without opening an instance after the first call
+
+    Args:
+        mode: FREEDV_MODE, mode value or mode name
+
+    Returns:
+        mode_info of the mode
+    """
+    mode = get_mode_value(mode)
+    info = MODE_REGISTRY.get(mode)
+    if info is None:
+        with MODE_REGISTRY_LOCK:
+            info = MODE_REGISTRY.get(mode)
+            if info is None:
+                info = MODE_REGISTRY[mode] = mode_info(mode)
+    return info
+
+
+def init_mode_registry() -> None:
+    """
+    Query all data modes at startup, so frame building never touches codec2
+    """
+    for mode in FREEDV_MODE:
+        get_mode_info(mode)
+
+
+class instance_pool:
+    """
+    Owner of the codec2 instances of the modem
+
+    Instances are opened on demand and handed back with release() once their
+    user is stopped. The next acquire() of the same mode reuses them, so a modem
+    restart doesn't open new instances and close_all() frees them for good.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # idle instances by mode value
+        self.idle = {}
+        # mode value of every instance handed out, by instance address
+        self.in_use = {}
+
+        self.opened = 0
+        self.closed = 0
+        self.reused = 0
+
+    def acquire(self, mode) -> ctypes.c_void_p:
+        """
+        Get an instance of a mode, an idle one is reused with its sync state reset
+
+        Args:
+            mode: FREEDV_MODE, mode value or mode name
+
+        Returns:
+            ctypes.c_void_p codec2 instance
+        """
+        mode = get_mode_value(mode)
+        with self.lock:
+            idle = self.idle.get(mode)
+            if idle:
+                instance = idle.pop()
+                self.reused += 1
+            else:
+                instance = None
+
+        if instance is None:
+            instance = open_instance(mode)
+            with self.lock:
+                self.opened += 1
+        else:
+            api.freedv_set_sync(instance, 0)
+
+        with self.lock:
+            self.in_use[instance.value] = mode
+        return instance
+
+    def release(self, instance) -> None:
+        """
+        Hand an instance back to the pool. It must not be used by the caller anymore.
+        """
+        with self.lock:
+            mode = self.in_use.pop(instance.value, None)
+            if mode is None:
+                log.warning("[C2 ] Releasing unknown codec2 instance", instance=instance.value)
+                return
+            self.idle.setdefault(mode, []).append(instance)
+
+    def close_all(self) -> None:
+        """
+        Close all idle instances, instances in use stay open
+        """
+        with self.lock:
+            idle = [instance for instances in self.idle.values() for instance in instances]
+            self.idle.clear()
+            self.closed += len(idle)
+        for instance in idle:
+            api.freedv_close(instance)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "in_use": len(self.in_use),
+                "idle": sum(len(instances) for instances in self.idle.values()),
+                "opened": self.opened,
+                "closed": self.closed,
+                "reused": self.reused,
+            }
+
+
+# process wide pool of the codec2 instances used by modulator and demodulator
+INSTANCE_POOL = instance_pool()
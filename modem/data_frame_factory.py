@@ -17,6 +17,13 @@ class DataFrameFactory:
         'CHECKSUM': 2,  # Bit-position for indicating the CHECKSUM is correct or not
     }
 
+    # The speed level byte of an ARQ burst frame also carries the position of the frame
+    # in its burst. A single frame is encoded as the plain speed level, like older versions.
+    BURST_SPEED_LEVEL_MASK = 0x0F
+    BURST_INDEX_SHIFT = 4
+    BURST_INDEX_MASK = 0x07
+    BURST_MORE_FRAMES = 0x80
+
     def __init__(self, config):
 
         self.myfullcall = f"{config['STATION']['mycall']}-{config['STATION']['myssid']}"
@@ -101,6 +108,7 @@ class DataFrameFactory:
             "origin": 6,
             "session_id": 1,
             "maximum_bandwidth": 2,
+            "version": 1,
         }
 
         self.template_list[FR_TYPE.ARQ_SESSION_OPEN_ACK.value] = {
@@ -161,6 +169,8 @@ class DataFrameFactory:
             "frames_per_burst": 1,
             "snr": 1,
             "flag": 1,
+            # received payload blocks after offset, bit n is the block at offset + n * payload size
+            "bitmap": 2,
         }
     
     def _load_p2p_connection_templates(self):
@@ -277,9 +287,15 @@ class DataFrameFactory:
             elif key == "gridsquare":
                 extracted_data[key] = helpers.decode_grid(data)
 
+            elif key == "speed_level" and frametype == FR_TYPE.ARQ_BURST_FRAME.value:
+                data = int.from_bytes(data, 'big')
+                extracted_data[key] = data & self.BURST_SPEED_LEVEL_MASK
+                extracted_data["burst_index"] = (data >> self.BURST_INDEX_SHIFT) & self.BURST_INDEX_MASK
+                extracted_data["more_frames"] = bool(data & self.BURST_MORE_FRAMES)
+
             elif key in ["session_id", "speed_level", 
                             "frames_per_burst", "version",
-                            "offset", "total_length", "state", "type", "maximum_bandwidth"]:
+                            "offset", "total_length", "state", "type", "maximum_bandwidth", "bitmap"]:
                 extracted_data[key] = int.from_bytes(data, 'big')
 
             elif key in ["snr"]:
@@ -305,9 +321,7 @@ class DataFrameFactory:
         return extracted_data
 
     def get_bytes_per_frame(self, mode: codec2.FREEDV_MODE) -> int:
-        freedv = codec2.open_instance(mode.value)
-        bytes_per_frame = int(codec2.api.freedv_get_bits_per_modem_frame(freedv) / 8)
-        return bytes_per_frame
+        return codec2.get_mode_info(mode).bytes_per_frame
     
     def get_available_data_payload_for_mode(self, type: FR_TYPE, mode:codec2.FREEDV_MODE):
         whole_frame_length = self.get_bytes_per_frame(mode)
@@ -388,12 +402,13 @@ class DataFrameFactory:
         test_frame[:1] = bytes([FR_TYPE.TEST_FRAME.value])
         return test_frame
 
-    def build_arq_session_open(self, destination, session_id, maximum_bandwidth):
+    def build_arq_session_open(self, destination, session_id, maximum_bandwidth, version=1):
         payload = {
             "destination_crc": helpers.get_crc_24(destination),
             "origin": helpers.callsign_to_bytes(self.myfullcall),
             "session_id": session_id.to_bytes(1, 'big'),
             "maximum_bandwidth": maximum_bandwidth.to_bytes(2, 'big'),
+            "version": bytes([version]),
         }
         return self.construct(FR_TYPE.ARQ_SESSION_OPEN, payload)
 
@@ -456,10 +471,14 @@ class DataFrameFactory:
         }        
         return self.construct(FR_TYPE.ARQ_SESSION_INFO_ACK, payload)
 
-    def build_arq_burst_frame(self, freedv_mode: codec2.FREEDV_MODE, session_id: int, offset: int, data: bytes, speed_level: int):
+    def build_arq_burst_frame(self, freedv_mode: codec2.FREEDV_MODE, session_id: int, offset: int, data: bytes, speed_level: int,
+                              burst_index: int = 0, more_frames: bool = False):
+        speed_level_byte = speed_level | (burst_index << self.BURST_INDEX_SHIFT)
+        if more_frames:
+            speed_level_byte |= self.BURST_MORE_FRAMES
         payload = {
             "session_id": session_id.to_bytes(1, 'big'),
-            "speed_level": speed_level.to_bytes(1, 'big'),
+            "speed_level": speed_level_byte.to_bytes(1, 'big'),
             "offset": offset.to_bytes(4, 'big'),
             "data": data,
         }
@@ -468,7 +487,7 @@ class DataFrameFactory:
         )
 
     def build_arq_burst_ack(self, session_id: bytes, offset, speed_level: int, 
-                            frames_per_burst: int, snr: int, flag_final=False, flag_checksum=False, flag_abort=False):
+                            frames_per_burst: int, snr: int, flag_final=False, flag_checksum=False, flag_abort=False, bitmap=0):
         flag = 0b00000000
         if flag_final:
             flag = helpers.set_flag(flag, 'FINAL', True, self.ARQ_FLAGS)
@@ -486,6 +505,7 @@ class DataFrameFactory:
             "frames_per_burst": frames_per_burst.to_bytes(1, 'big'),
             "snr": helpers.snr_to_bytes(snr),
             "flag": flag.to_bytes(1, 'big'),
+            "bitmap": bitmap.to_bytes(2, 'big'),
         }
         return self.construct(FR_TYPE.ARQ_BURST_ACK, payload)
     
@@ -3,34 +3,22 @@ import codec2
 import ctypes
 import structlog
 import threading
-import audio
-import itertools
+import time
 
 TESTMODE = False
 
 class Demodulator():
 
-    MODE_DICT = {}
-    # Iterate over the FREEDV_MODE enum members
-    for mode in codec2.FREEDV_MODE:
-        MODE_DICT[mode.value] = {
-            'decode': False,
-            'bytes_per_frame': None,
-            'bytes_out': None,
-            'audio_buffer': None,
-            'nin': None,
-            'instance': None,
-            'state_buffer': [],
-            'name': mode.name.upper(),
-            'decoding_thread': None
-        }
-
-    def __init__(self, config, audio_rx_q, data_q_rx, states, event_manager, service_queue, fft_queue):
+    # scatter plot updates per second
+    SCATTER_MAX_RATE = 2
+    # maximum number of symbols per scatter plot update
+    SCATTER_MAX_POINTS = 150
+
+    def __init__(self, config, audio_rx_q, data_q_rx, states, event_manager, service_queue, spectrum):
         self.log = structlog.get_logger("Demodulator")
 
         self.service_queue = service_queue
         self.AUDIO_FRAMES_PER_BUFFER_RX = 4800
-        self.buffer_overflow_counter = [0, 0, 0, 0, 0, 0, 0, 0]
         self.is_codec2_traffic_counter = 0
         self.is_codec2_traffic_cooldown = 5
 
@@ -40,7 +28,9 @@ class Demodulator():
         self.states = states
         self.event_manager = event_manager
 
-        self.fft_queue = fft_queue
+        self.spectrum = spectrum
+        self.stream = None
+        self.last_scatter_time = 0.0
 
         # init codec2 resampler
         self.resampler = codec2.resampler()
@@ -49,6 +39,7 @@ class Demodulator():
 
         # enable decoding of signalling modes
         self.MODE_DICT[codec2.FREEDV_MODE.signalling.value]["decode"] = True
+        self.update_audio_cursors()
 
         tci_rx_callback_thread = threading.Thread(
             target=self.tci_rx_callback,
@@ -58,6 +49,33 @@ class Demodulator():
         tci_rx_callback_thread.start()
 
     def init_codec2(self):
+        # decoder state per mode, owned by this instance
+        self.MODE_DICT = {}
+        # Iterate over the FREEDV_MODE enum members
+        for mode in codec2.FREEDV_MODE:
+            self.MODE_DICT[mode.value] = {
+                'decode': False,
+                'bytes_per_frame': None,
+                'bytes_out': None,
+                'audio_buffer': None,
+                'nin': None,
+                'instance': None,
+                'state_buffer': [],
+                'name': mode.name.upper(),
+                'decoding_thread': None,
+                'modem_stats': None,
+                # set when the mode gets enabled again, the decoder drops its old sync state
+                'resync': False,
+                # statistics, updated by the decoding thread
+                'cpu_time': 0.0,
+                'wakeups': 0,
+                'demodulated_frames': 0,
+                'decoded_frames': 0,
+            }
+
+        # shared rx sample store, every mode reads it with its own cursor
+        self.audio_ring = codec2.audio_ring(4 * self.AUDIO_FRAMES_PER_BUFFER_RX)
+
         # Open codec2 instances
         for mode in codec2.FREEDV_MODE:
             self.init_codec2_mode(mode.value)
@@ -68,24 +86,21 @@ class Demodulator():
         Init codec2 and return some important parameters
         """
 
-        # create codec2 instance
-        c2instance = ctypes.cast(
-            codec2.api.freedv_open(mode), ctypes.c_void_p
-        )
+        # get codec2 instance, it is handed back to the pool by stop()
+        c2instance = codec2.INSTANCE_POOL.acquire(mode)
 
         # get bytes per frame
-        bytes_per_frame = int(
-            codec2.api.freedv_get_bits_per_modem_frame(c2instance) / 8
-        )
+        bytes_per_frame = codec2.get_mode_info(mode).bytes_per_frame
 
         # create byte out buffer
         bytes_out = ctypes.create_string_buffer(bytes_per_frame)
 
-        # set initial frames per burst
+        # every ARQ frame has its own preamble, so a codec2 burst is always a single frame
         codec2.api.freedv_set_frames_per_burst(c2instance, 1)
 
-        # init audio buffer
-        audio_buffer = codec2.audio_buffer(2 * self.AUDIO_FRAMES_PER_BUFFER_RX)
+        # init audio buffer as read cursor on the shared rx samples
+        audio_buffer = self.audio_ring.cursor(2 * self.AUDIO_FRAMES_PER_BUFFER_RX)
+        audio_buffer.set_active(False)
 
         # get initial nin
         nin = codec2.api.freedv_nin(c2instance)
@@ -110,32 +125,55 @@ class Demodulator():
         self.MODE_DICT[mode]["bytes_out"] = bytes_out
         self.MODE_DICT[mode]["audio_buffer"] = audio_buffer
         self.MODE_DICT[mode]["nin"] = nin
+        self.MODE_DICT[mode]["modem_stats"] = codec2.modem_stats_snapshot()
 
     def start(self, stream):
 
         self.stream = stream
 
+        # decoder threads of the other modes are started once they get enabled
         for mode in self.MODE_DICT:
-            # Start decoder threads
-            self.MODE_DICT[mode]['decoding_thread'] = threading.Thread(
-                target=self.demodulate_audio,args=[mode], name=self.MODE_DICT[mode]['name'], daemon=True
-            )
-            self.MODE_DICT[mode]['decoding_thread'].start()
+            if self.MODE_DICT[mode]["decode"]:
+                self.start_decoder(mode)
 
+    def stop(self, timeout=2.0) -> None:
+        """
+        Stop all decoder threads and hand the codec2 instances back to the pool
 
-    def get_frequency_offset(self, freedv: ctypes.c_void_p) -> float:
+        Args:
+            timeout: maximum time to wait for each decoder thread in seconds
         """
-        Ask codec2 for the calculated (audio) frequency offset of the received signal.
+        for mode in self.MODE_DICT:
+            self.MODE_DICT[mode]["decode"] = False
+            self.MODE_DICT[mode]["audio_buffer"].close()
+        # release the tci rx thread
+        self.audio_received_queue.put(None)
 
-        :param freedv: codec2 instance to query
-        :type freedv: ctypes.c_void_p
-        :return: Offset of audio frequency in Hz
-        :rtype: float
+        for mode in self.MODE_DICT:
+            thread = self.MODE_DICT[mode]["decoding_thread"]
+            if thread is not None:
+                thread.join(timeout)
+                if thread.is_alive():
+                    # never hand out an instance which is still decoding
+                    self.log.warning("[MDM] decoder thread did not stop", mode=self.MODE_DICT[mode]["name"])
+                    continue
+            instance = self.MODE_DICT[mode]["instance"]
+            if instance is not None:
+                codec2.INSTANCE_POOL.release(instance)
+                self.MODE_DICT[mode]["instance"] = None
+
+    def start_decoder(self, mode):
         """
-        modemStats = codec2.MODEMSTATS()
-        codec2.api.freedv_get_modem_extended_stats(freedv, ctypes.byref(modemStats))
-        offset = round(modemStats.foff) * (-1)
-        return offset
+        Start the decoder thread of a mode, if not already running
+        """
+        thread = self.MODE_DICT[mode]['decoding_thread']
+        if thread is not None and thread.is_alive():
+            return
+        self.MODE_DICT[mode]['decoding_thread'] = threading.Thread(
+            target=self.demodulate_audio,args=[mode], name=self.MODE_DICT[mode]['name'], daemon=True
+        )
+        self.MODE_DICT[mode]['decoding_thread'].start()
+
 
     def demodulate_audio(self, mode) -> int:
         """
@@ -148,15 +186,29 @@ class Demodulator():
         freedv = self.MODE_DICT[mode]["instance"]
         bytes_out = self.MODE_DICT[mode]["bytes_out"]
         bytes_per_frame= self.MODE_DICT[mode]["bytes_per_frame"]
+        modem_stats = self.MODE_DICT[mode]["modem_stats"]
         state_buffer = self.MODE_DICT[mode]["state_buffer"]
         mode_name = self.MODE_DICT[mode]["name"]
+        mode_stats = self.MODE_DICT[mode]
         try:
             while self.stream.active:
-                threading.Event().wait(0.01)
+                # sleep until the audio callback has pushed at least nin samples.
+                # A disabled mode has a detached audio cursor and is never woken up here
+                if not audiobuffer.wait_for_samples(nin):
+                    break
+                cpu_start = time.thread_time()
+                mode_stats["wakeups"] += 1
+
+                if mode_stats["resync"]:
+                    # mode has been parked, forget the old sync and start with fresh samples
+                    mode_stats["resync"] = False
+                    codec2.api.freedv_set_sync(freedv, 0)
+                    nin = codec2.api.freedv_nin(freedv)
+
                 while audiobuffer.nbuffer >= nin:
                     # demodulate audio
                     nbytes = codec2.api.freedv_rawdatarx(
-                        freedv, bytes_out, audiobuffer.buffer.ctypes
+                        freedv, bytes_out, audiobuffer.address
                     )
                     # get current modem states and write to list
                     # 1 trial
@@ -165,6 +217,7 @@ class Demodulator():
                     # 6 decoded
                     # 10 error decoding == NACK
                     rx_status = codec2.api.freedv_get_rx_status(freedv)
+                    mode_stats["demodulated_frames"] += 1
 
                     if rx_status not in [0]:
                         self.is_codec2_traffic_counter = self.is_codec2_traffic_cooldown
@@ -188,20 +241,25 @@ class Demodulator():
                         self.log.debug(
                             "[MDM] [demod_audio] Pushing received data to received_queue", nbytes=nbytes
                         )
-                        snr = self.calculate_snr(freedv)
-                        self.get_scatter(freedv)
+                        # one modem stats query per decoded frame
+                        modem_stats.update(freedv)
+                        snr = modem_stats.snr
+                        self.log.info("[MDM] calculate_snr: ", snr=snr)
+                        self.get_scatter(modem_stats)
 
                         item = {
                             'payload': bytes_out,
                             'freedv': freedv,
                             'bytes_per_frame': bytes_per_frame,
                             'snr': snr,
-                            'frequency_offset': self.get_frequency_offset(freedv),
+                            'frequency_offset': modem_stats.frequency_offset,
                         }
                         self.data_queue_received.put(item)
-
+                        mode_stats["decoded_frames"] += 1
 
                         state_buffer = []
+
+                mode_stats["cpu_time"] += time.thread_time() - cpu_start
         except Exception as e:
             error_message = str(e)
             # we expect this error when shutdown
@@ -222,110 +280,92 @@ class Demodulator():
         while True:
 
             audio_48k = self.audio_received_queue.get()
+            if audio_48k is None:
+                break
             audio_48k = np.frombuffer(audio_48k, dtype=np.int16)
 
-            audio.calculate_fft(audio_48k, self.fft_queue, self.states)
-
-            length_audio_48k = len(audio_48k)
-            index = 0
-            for mode in self.MODE_DICT:
-                mode_data = self.MODE_DICT[mode]
-                audiobuffer = mode_data['audio_buffer']
-                decode = mode_data['decode']
-                index += 1
-                if audiobuffer:
-                    if (audiobuffer.nbuffer + length_audio_48k) > audiobuffer.size:
-                        self.buffer_overflow_counter[index] += 1
-                        self.event_manager.send_buffer_overflow(self.buffer_overflow_counter)
-                    elif decode:
-                        audiobuffer.push(audio_48k)
-
-    def set_frames_per_burst(self, frames_per_burst: int) -> None:
-        """
-        Configure codec2 to send the configured number of frames per burst.
+            self.spectrum.process(audio_48k)
 
-        :param frames_per_burst: Number of frames per burst requested
-        :type frames_per_burst: int
-        """
-        # Limit frames per burst to acceptable values
-        frames_per_burst = min(frames_per_burst, 1)
-        frames_per_burst = max(frames_per_burst, 5)
+            self.push_audio(audio_48k)
 
-        # FIXME
-        frames_per_burst = 1
+    def push_audio(self, audio_8k) -> None:
+        """
+        Write 8 kHz audio to the shared rx samples, the decoders of all
+        selected modes read it from there
 
-        codec2.api.freedv_set_frames_per_burst(self.dat0_datac1_freedv, frames_per_burst)
-        codec2.api.freedv_set_frames_per_burst(self.dat0_datac3_freedv, frames_per_burst)
-        codec2.api.freedv_set_frames_per_burst(self.dat0_datac4_freedv, frames_per_burst)
+        :param audio_8k: Audio samples at modem sample rate
+        :type audio_8k: np.ndarray
+        """
+        if self.audio_ring.push(audio_8k):
+            self.event_manager.send_buffer_overflow(self.get_buffer_overflow_counter())
 
-    def calculate_snr(self, freedv: ctypes.c_void_p) -> float:
+    def get_buffer_overflow_counter(self) -> list:
+        """
+        Number of overflows of the audio cursor of each mode
         """
-        Ask codec2 for data about the received signal and calculate
-        the signal-to-noise ratio.
+        return [self.MODE_DICT[mode]["audio_buffer"].overflows for mode in self.MODE_DICT]
 
-        :param freedv: codec2 instance to query
-        :type freedv: ctypes.c_void_p
-        :return: Signal-to-noise ratio of the decoded data
-        :rtype: float
+    def update_audio_cursors(self) -> None:
         """
-        try:
-            modem_stats_snr = ctypes.c_float()
-            modem_stats_sync = ctypes.c_int()
+        Attach the audio cursors of all decoding modes to the shared rx samples,
+        and detach all others. Decoders of detached modes stay parked until the
+        mode gets enabled again.
+        """
+        for mode in self.MODE_DICT:
+            decode = self.MODE_DICT[mode]["decode"]
+            audio_buffer = self.MODE_DICT[mode]["audio_buffer"]
+            if decode and not audio_buffer.active:
+                self.MODE_DICT[mode]["resync"] = True
+            audio_buffer.set_active(decode)
 
-            codec2.api.freedv_get_modem_stats(
-                freedv, ctypes.byref(modem_stats_sync), ctypes.byref(modem_stats_snr)
-            )
-            modem_stats_snr = modem_stats_snr.value
-            modem_stats_sync = modem_stats_sync.value
-
-            snr = round(modem_stats_snr, 1)
-            self.log.info("[MDM] calculate_snr: ", snr=snr)
-            # snr = np.clip(
-            #    snr, -127, 127
-            # )  # limit to max value of -128/128 as a possible fix of #188
-            return int(snr)
-        except Exception as err:
-            self.log.error(f"[MDM] calculate_snr: Exception: {err}")
-            return 0
-
-    def get_scatter(self, freedv: ctypes.c_void_p) -> None:
+            if decode and self.stream is not None:
+                self.start_decoder(mode)
+
+    def get_stats(self) -> dict:
+        """
+        Decoder statistics per mode, cpu_time is the cpu time in seconds used by the decoding thread
         """
-        Ask codec2 for data about the received signal and calculate the scatter plot.
+        stats = {}
+        for mode in self.MODE_DICT:
+            thread = self.MODE_DICT[mode]["decoding_thread"]
+            stats[self.MODE_DICT[mode]["name"]] = {
+                "decode": self.MODE_DICT[mode]["decode"],
+                "thread_running": thread is not None and thread.is_alive(),
+                "cpu_time": round(self.MODE_DICT[mode]["cpu_time"], 3),
+                "wakeups": self.MODE_DICT[mode]["wakeups"],
+                "demodulated_frames": self.MODE_DICT[mode]["demodulated_frames"],
+                "decoded_frames": self.MODE_DICT[mode]["decoded_frames"],
+                "buffer_overflows": self.MODE_DICT[mode]["audio_buffer"].overflows,
+            }
+        return stats
+
+    def get_scatter(self, modem_stats: codec2.modem_stats_snapshot) -> None:
+        """
+        Calculate the scatter plot from the modem stats of the latest decoded frame.
+        Sent at most SCATTER_MAX_RATE times per second, as int8 x/y pairs scaled to
+        the strongest symbol.
 
-        :param freedv: codec2 instance to query
-        :type freedv: ctypes.c_void_p
+        :param modem_stats: modem stats snapshot of the decoder
+        :type modem_stats: codec2.modem_stats_snapshot
         """
-       
-        modemStats = codec2.MODEMSTATS()
-        ctypes.cast(
-            codec2.api.freedv_get_modem_extended_stats(freedv, ctypes.byref(modemStats)),
-            ctypes.c_void_p,
-        )
+        now = time.monotonic()
+        if now - self.last_scatter_time < 1 / self.SCATTER_MAX_RATE:
+            return
+        self.last_scatter_time = now
 
-        scatterdata = []
-        # original function before itertool
-        # for i in range(codec2.MODEM_STATS_NC_MAX):
-        #    for j in range(1, codec2.MODEM_STATS_NR_MAX, 2):
-        #        # print(f"{modemStats.rx_symbols[i][j]} - {modemStats.rx_symbols[i][j]}")
-        #        xsymbols = round(modemStats.rx_symbols[i][j - 1] // 1000)
-        #        ysymbols = round(modemStats.rx_symbols[i][j] // 1000)
-        #        if xsymbols != 0.0 and ysymbols != 0.0:
-        #            scatterdata.append({"x": str(xsymbols), "y": str(ysymbols)})
-
-        for i, j in itertools.product(range(codec2.MODEM_STATS_NC_MAX), range(1, codec2.MODEM_STATS_NR_MAX, 2)):
-            # print(f"{modemStats.rx_symbols[i][j]} - {modemStats.rx_symbols[i][j]}")
-            xsymbols = round(modemStats.rx_symbols[i][j - 1] // 1000)
-            ysymbols = round(modemStats.rx_symbols[i][j] // 1000)
-            if xsymbols != 0.0 and ysymbols != 0.0:
-                scatterdata.append({"x": str(xsymbols), "y": str(ysymbols)})
+        # every row holds the x/y pairs of one carrier, unused entries are zero
+        symbols = modem_stats.rx_symbols.reshape(-1, 2)
+        symbols = symbols[np.all(symbols != 0, axis=1)]
+        if len(symbols) == 0:
+            return
 
         # Send all the data if we have too-few samples, otherwise send a sampling
-        if 150 > len(scatterdata) > 0:
-            self.event_manager.send_scatter_change(scatterdata)
+        step = -(-len(symbols) // self.SCATTER_MAX_POINTS)
+        symbols = symbols[::step]
 
-        else:
-            # only take every tenth data point
-            self.event_manager.send_scatter_change(scatterdata[::10])
+        scale = 127 / np.max(np.abs(symbols))
+        scatter = np.rint(symbols * scale).astype(np.int8)
+        self.event_manager.send_scatter_change(scatter)
 
     def reset_data_sync(self) -> None:
         """
@@ -353,3 +393,5 @@ class Demodulator():
             for mode, decode in modes_to_decode.items():
                 if mode in self.MODE_DICT:
                     self.MODE_DICT[mode]["decode"] = decode
+
+        self.update_audio_cursors()
@@ -1,5 +1,4 @@
 import base64
-import json
 import structlog
 
 class EventManager:
@@ -23,7 +22,8 @@ class EventManager:
         self.broadcast({"ptt": bool(on)})
 
     def send_scatter_change(self, data):
-        self.broadcast({"scatter": json.dumps(data)})
+        # data is an array of x/y pairs
+        self.broadcast({"scatter": data.tolist()})
 
     def send_buffer_overflow(self, data):
         self.broadcast({"buffer-overflow": str(data)})
@@ -75,10 +75,16 @@ class DISPATCHER():
         """Starts worker threads for transmit and receive operations."""
         threading.Thread(target=self.worker_receive, name="Receive Worker", daemon=True).start()
 
+    def stop(self):
+        """Stops the receive worker"""
+        self.data_queue_received.put(None)
+
     def worker_receive(self) -> None:
         """Queue received data for processing"""
         while True:
             data = self.data_queue_received.get()
+            if data is None:
+                break
             self.new_process_data(
                 data['payload'],
                 data['freedv'],
@@ -55,5 +55,4 @@ class ARQFrameHandler(frame_handler.FrameHandler):
             self.logger.warning("DISCARDING FRAME", frame=frame)
             return
 
-        session.set_details(snr, frequency_offset)
-        session.on_frame_received(frame)
+        session.on_frame_received(frame, snr, frequency_offset)
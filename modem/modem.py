@@ -18,8 +18,15 @@ import structlog
 import tci
 import cw
 import audio
+import audio_pipeline
+import audio_replay
+import arq_scheduler
+import channel_busy
 import demodulator
 import modulator
+import spectrum
+import waveform_cache
+import websocket_manager
 
 TESTMODE = False
 
@@ -55,7 +62,6 @@ class RF:
 
 
         self.ptt_state = False
-        self.enqueuing_audio = False # set to True, while we are processing audio
 
         self.AUDIO_SAMPLE_RATE = 48000
         self.modem_sample_rate = codec2.api.FREEDV_FS_8000
@@ -67,14 +73,36 @@ class RF:
         self.MODE = 0
         self.rms_counter = 0
 
-        self.audio_out_queue = queue.Queue()
-
         # Make sure our resampler will work
         assert (self.AUDIO_SAMPLE_RATE / self.modem_sample_rate) == codec2.api.FDMDV_OS_48  # type: ignore
 
+        # init codec2 resampler
+        self.resampler = codec2.resampler()
+
+        # tx audio ring, filled while modulating and drained by the output callback
+        self.tx_player = audio_pipeline.TXAudioPlayer()
+        # scales and resamples modulated audio straight into the tx audio ring
+        self.tx_conditioner = audio_pipeline.TXAudioConditioner(
+            self.tx_player,
+            resampler=self.resampler if self.radiocontrol not in ["tci"] else None,
+            tx_audio_level=self.tx_audio_level,
+        )
+        # final tx audio of recently sent bursts
+        self.waveform_cache = waveform_cache.WaveformCache()
+
         self.audio_received_queue = queue.Queue()
         self.data_queue_received = queue.Queue()
         self.fft_queue = fft_queue
+        self.rx_pipeline = None
+        self.sd_input_stream = None
+        self.sd_output_stream = None
+
+        self.channel_busy = channel_busy.ChannelBusyDetector(self.states)
+
+        # waterfall data is only needed while a client is connected to the fft socket
+        self.spectrum = spectrum.SpectrumEngine(self.fft_queue, self.states,
+                                                subscribers=websocket_manager.fft_client_list,
+                                                busy_detector=self.channel_busy)
 
         self.demodulator = demodulator.Demodulator(self.config, 
                                             self.audio_received_queue, 
@@ -82,7 +110,7 @@ class RF:
                                             self.states,
                                             self.event_manager,
                                             self.service_queue,
-                                            self.fft_queue
+                                            self.spectrum
                                                    )
 
         self.modulator = modulator.Modulator(self.config)
@@ -119,6 +147,25 @@ class RF:
         except Exception:
             self.log.error("[MDM] Error stopping modem")
 
+    def close(self) -> None:
+        """
+        Stop audio streams and decoders and hand all codec2 instances back to the pool.
+        Called by the service manager before the modem is dropped.
+        """
+        for stream in [self.sd_input_stream, self.sd_output_stream]:
+            if stream is None:
+                continue
+            try:
+                stream.stop()
+                stream.close()
+            except Exception as e:
+                self.log.warning("[MDM] Error closing audio stream", e=e)
+        self.tx_player.abort()
+        if self.rx_pipeline is not None:
+            self.rx_pipeline.stop()
+        self.demodulator.stop()
+        self.modulator.close()
+
     def init_audio(self):
         self.log.info(f"[MDM] init: get audio devices", input_device=self.audio_input_device,
                       output_device=self.audio_output_device)
@@ -142,8 +189,12 @@ class RF:
             sd.default.samplerate = self.AUDIO_SAMPLE_RATE
             sd.default.device = (in_dev_index, out_dev_index)
 
-            # init codec2 resampler
-            self.resampler = codec2.resampler()
+            # rx processing stage, fed by the input stream callback
+            self.rx_pipeline = audio_pipeline.RXAudioPipeline(
+                resampler=codec2.resampler(),
+                rx_audio_level=self.rx_audio_level,
+            )
+            self.rx_pipeline.add_consumer(self.push_rx_audio)
 
             # SoundDevice audio input stream
             self.sd_input_stream = sd.InputStream(
@@ -223,19 +274,19 @@ class RF:
         # self.states.channel_busy_event.wait()
 
         start_of_transmission = time.time()
-        txbuffer = self.modulator.create_burst(mode, repeats, repeat_delay, frames)
-
-        # Re-sample back up to 48k (resampler works on np.int16)
-        x = np.frombuffer(txbuffer, dtype=np.int16)
-        x = audio.set_audio_volume(x, self.tx_audio_level)
 
-        if self.radiocontrol not in ["tci"]:
-            txbuffer_out = self.resampler.resample8_to_48(x)
+        # repeated frames like ACKs are played from the cache
+        cache_key = self.waveform_cache.create_key(mode, frames, repeats, repeat_delay, self.tx_audio_level)
+        waveform = self.waveform_cache.get(cache_key)
+        if waveform is not None:
+            self.stream_audio_out([waveform])
         else:
-            txbuffer_out = x
-
-        # transmit audio
-        self.enqueue_audio_out(txbuffer_out)
+            # modulate piece by piece, so playback starts while the burst is still being created
+            captured = []
+            complete = self.stream_audio_out(self.modulator.generate_burst(mode, repeats, repeat_delay, frames),
+                                             self.tx_conditioner, captured)
+            if complete and captured:
+                self.waveform_cache.put(cache_key, np.concatenate(captured))
 
         end_of_transmission = time.time()
         transmission_time = end_of_transmission - start_of_transmission
@@ -244,85 +295,127 @@ class RF:
 
 
     def enqueue_audio_out(self, audio_48k) -> None:
-        self.enqueuing_audio = True
+        self.stream_audio_out([audio_48k])
 
+    def stream_audio_out(self, audio_blocks, conditioner=None, capture=None) -> bool:
+        """
+        Key the radio and play audio blocks, returns after the last sample has been played
+
+        Args:
+            audio_blocks: iterable of int16 audio blocks
+            conditioner: TXAudioConditioner for modulator output, None if the blocks are
+                         ready for the sound card, 48 kHz or 8 kHz for TCI
+            capture: optional list which receives copies of the final audio
+
+        Returns:
+            True if all blocks have been played
+        """
         if not self.states.isTransmitting():
             self.states.setTransmitting(True)
 
         self.radio.set_ptt(True)
         self.event_manager.send_ptt_change(True)
 
+        complete = False
         if self.radiocontrol in ["tci"]:
+            if conditioner is not None:
+                audio_blocks = [conditioner.process(block) for block in audio_blocks]
+            audio_48k = np.concatenate(list(audio_blocks))
+            if capture is not None:
+                capture.append(audio_48k)
             self.tci_tx_callback(audio_48k)
             # we need to wait manually for tci processing
             self.tci_module.wait_until_transmitted(audio_48k)
+            complete = True
         else:
-            # slice audio data to needed blocklength
-            block_size = 4800
-            pad_length = -len(audio_48k) % block_size
-            padded_data = np.pad(audio_48k, (0, pad_length), mode='constant')
-            sliced_audio_data = padded_data.reshape(-1, block_size)
-            # add each block to audio out queue
-            for block in sliced_audio_data:
-                self.audio_out_queue.put(block)
-
-        self.enqueuing_audio = False
-        self.states.transmitting_event.wait()
+            self.tx_player.start()
+            try:
+                for block in audio_blocks:
+                    if conditioner is not None:
+                        written = conditioner.write(block, capture=capture)
+                    else:
+                        written = self.tx_player.write(block)
+                    if not written:
+                        break
+                else:
+                    complete = True
+            finally:
+                self.tx_player.finish()
+            self.tx_player.wait_until_drained()
+
+            stats = self.tx_player.get_stats()
+            if stats["underruns"]:
+                self.log.warning("[MDM] TX audio underrun", underruns=stats["underruns"],
+                                 samples=stats["underrun_samples"])
+
+        self.states.setTransmitting(False)
 
         self.radio.set_ptt(False)
         self.event_manager.send_ptt_change(False)
 
-        return
+        return complete
 
     def sd_output_audio_callback(self, outdata: np.ndarray, frames: int, time, status) -> None:
         try:
-            if not self.audio_out_queue.empty():
-                chunk = self.audio_out_queue.get_nowait()
-                audio.calculate_fft(chunk, self.fft_queue, self.states)
-                outdata[:] = chunk.reshape(outdata.shape)
-
-            else:
-                # reset transmitting state only, if we are not actively processing audio
-                # for avoiding a ptt toggle state bug
-                if not self.enqueuing_audio:
-                    self.states.setTransmitting(False)
-                # Fill with zeros if the queue is empty
-                outdata.fill(0)
+            self.tx_player.read(outdata.reshape(-1))
         except Exception as e:
             self.log.warning("[AUDIO STATUS]", status=status, time=time, frames=frames, e=e)
             outdata.fill(0)
 
     def sd_input_audio_callback(self, indata: np.ndarray, frames: int, time, status) -> None:
-            if status:
-                self.log.warning("[AUDIO STATUS]", status=status, time=time, frames=frames)
-                # FIXME on windows input overflows crashing the rx audio stream. Lets restart the server then
-                #if status.input_overflow:
-                #    self.service_queue.put("restart")
-                return
+        # Only copy the block into the rx pipeline queue. Resampling, audio level, fft and
+        # feeding the decoders is done in the pipeline thread, so the callback never blocks.
+        # FIXME on windows input overflows crashing the rx audio stream. Lets restart the server then
+        # if status.input_overflow:
+        #    self.service_queue.put("restart")
+        self.rx_pipeline.push(indata, status)
+
+    def push_rx_audio(self, audio_8k) -> None:
+        """
+        Feed received 8 kHz audio into the decoders and the spectrum. Used by the
+        rx pipeline and by simulated channels.
+        """
+        self.demodulator.push_audio(audio_8k)
+        self.process_rx_spectrum(audio_8k)
+
+    def process_rx_spectrum(self, audio_8k) -> None:
+        # while transmitting, the waterfall shows the audio played by the output callback
+        while True:
+            block = self.tx_player.monitor.get(0)
+            if block is None:
+                break
             try:
-                audio_48k = np.frombuffer(indata, dtype=np.int16)
-                audio_8k = self.resampler.resample48_to_8(audio_48k)
-
-                audio_8k_level_adjusted = audio.set_audio_volume(audio_8k, self.rx_audio_level)
-
-                if not self.states.isTransmitting():
-                    audio.calculate_fft(audio_8k_level_adjusted, self.fft_queue, self.states)
-
-                length_audio_8k_level_adjusted = len(audio_8k_level_adjusted)
-                # Avoid buffer overflow by filling only if buffer for
-                # selected datachannel mode is not full
-                index = 0
-                for mode in self.demodulator.MODE_DICT:
-                    mode_data = self.demodulator.MODE_DICT[mode]
-                    audiobuffer = mode_data['audio_buffer']
-                    decode = mode_data['decode']
-                    index += 1
-                    if audiobuffer:
-                        if (audiobuffer.nbuffer + length_audio_8k_level_adjusted) > audiobuffer.size:
-                            self.demodulator.buffer_overflow_counter[index] += 1
-                            self.event_manager.send_buffer_overflow(self.demodulator.buffer_overflow_counter)
-                        elif decode:
-                            audiobuffer.push(audio_8k_level_adjusted)
-            except Exception as e:
-                self.log.warning("[AUDIO EXCEPTION]", status=status, time=time, frames=frames, e=e)
+                self.spectrum.process(block, self.AUDIO_SAMPLE_RATE, transmitting=True)
+            finally:
+                self.tx_player.monitor.release()
 
+        if not self.states.isTransmitting():
+            self.spectrum.process(audio_8k, self.modem_sample_rate)
+
+    def replay_audio(self, path, sample_rate=None) -> dict:
+        """
+        Decode a WAV or raw int16 recording instead of sound card audio, faster than real time.
+        Decoded frames are processed like received ones. The decoders are stopped afterwards,
+        so only a modem without audio stream can replay, once.
+        """
+        # the recording would be interleaved with the live audio in the rx ring
+        if self.demodulator.stream is not None:
+            raise RuntimeError("Audio replay is not possible while the demodulator has an audio stream")
+        replay = audio_replay.AudioReplay(self.demodulator)
+        try:
+            return replay.replay_file(path, sample_rate)
+        finally:
+            replay.stop()
+
+    def get_stats(self) -> dict:
+        stats = {
+            "channel_busy": self.channel_busy.get_stats(),
+            "demodulator": self.demodulator.get_stats(),
+            "tx_audio_player": self.tx_player.get_stats(),
+            "tx_waveform_cache": self.waveform_cache.get_stats(),
+            "codec2_instances": codec2.INSTANCE_POOL.get_stats(),
+            "arq_scheduler": arq_scheduler.SCHEDULER.get_stats(),
+        }
+        if self.rx_pipeline is not None:
+            stats["rx_audio_pipeline"] = self.rx_pipeline.get_stats()
+        return stats
@@ -1,5 +1,6 @@
 import ctypes
 import codec2
+import numpy as np
 import structlog
 
 
@@ -18,133 +19,203 @@ class Modulator:
         # Open codec2 instances
 
         # INIT TX MODES - here we need all modes.
-        self.freedv_datac0_tx = codec2.open_instance(codec2.FREEDV_MODE.datac0.value)
-        self.freedv_datac1_tx = codec2.open_instance(codec2.FREEDV_MODE.datac1.value)
-        self.freedv_datac3_tx = codec2.open_instance(codec2.FREEDV_MODE.datac3.value)
-        self.freedv_datac4_tx = codec2.open_instance(codec2.FREEDV_MODE.datac4.value)
-        self.freedv_datac13_tx = codec2.open_instance(codec2.FREEDV_MODE.datac13.value)
-
-    def transmit_add_preamble(self, buffer, freedv):
-        # Init buffer for preample
-        n_tx_preamble_modem_samples = codec2.api.freedv_get_n_tx_preamble_modem_samples(
-            freedv
-        )
-        mod_out_preamble = ctypes.create_string_buffer(n_tx_preamble_modem_samples * 2)
+        self.freedv_datac0_tx = codec2.INSTANCE_POOL.acquire(codec2.FREEDV_MODE.datac0.value)
+        self.freedv_datac1_tx = codec2.INSTANCE_POOL.acquire(codec2.FREEDV_MODE.datac1.value)
+        self.freedv_datac3_tx = codec2.INSTANCE_POOL.acquire(codec2.FREEDV_MODE.datac3.value)
+        self.freedv_datac4_tx = codec2.INSTANCE_POOL.acquire(codec2.FREEDV_MODE.datac4.value)
+        self.freedv_datac13_tx = codec2.INSTANCE_POOL.acquire(codec2.FREEDV_MODE.datac13.value)
+
+        # freedv instance by mode
+        self.mode_transition = {
+            codec2.FREEDV_MODE.signalling: self.freedv_datac13_tx,
+            codec2.FREEDV_MODE.datac0: self.freedv_datac0_tx,
+            codec2.FREEDV_MODE.datac1: self.freedv_datac1_tx,
+            codec2.FREEDV_MODE.datac3: self.freedv_datac3_tx,
+            codec2.FREEDV_MODE.datac4: self.freedv_datac4_tx,
+            codec2.FREEDV_MODE.datac13: self.freedv_datac13_tx,
+        }
 
-        # Write preamble to txbuffer
-        codec2.api.freedv_rawdatapreambletx(freedv, mod_out_preamble)
-        buffer += bytes(mod_out_preamble)
-        return buffer
+        # frame geometry per tx instance, it never changes after opening the instance
+        self.tx_frame_info = {}
+        for mode, freedv in self.mode_transition.items():
+            info = codec2.get_mode_info(mode)
+            self.tx_frame_info[freedv.value] = {
+                "bytes_per_frame": info.bytes_per_frame,
+                "preamble_samples": info.preamble_samples,
+                "modem_samples": info.modem_samples,
+                "postamble_samples": info.postamble_samples,
+                "frame_samples": info.frame_samples,
+            }
+
+    def close(self) -> None:
+        """
+        Hand the tx instances back to the codec2 instance pool
+        """
+        # signalling and datac13 share an instance
+        instances = {freedv.value: freedv for freedv in self.mode_transition.values()}
+        for freedv in instances.values():
+            codec2.INSTANCE_POOL.release(freedv)
+        self.mode_transition = {}
 
-    def transmit_add_postamble(self, buffer, freedv):
-        # Init buffer for postamble
-        n_tx_postamble_modem_samples = (
-            codec2.api.freedv_get_n_tx_postamble_modem_samples(freedv)
-        )
-        mod_out_postamble = ctypes.create_string_buffer(
-            n_tx_postamble_modem_samples * 2
-        )
-        # Write postamble to txbuffer
-        codec2.api.freedv_rawdatapostambletx(freedv, mod_out_postamble)
-        # Append postamble to txbuffer
-        buffer += bytes(mod_out_postamble)
-        return buffer
-
-    def transmit_add_silence(self, buffer, duration):
-        data_delay = int(self.modem_sample_rate * (duration / 1000))  # type: ignore
-        mod_out_silence = ctypes.create_string_buffer(data_delay * 2)
-        buffer += bytes(mod_out_silence)
-        return buffer
-
-    def transmit_create_frame(self, txbuffer, freedv, frame):
+    def get_frame_info(self, freedv) -> dict:
+        return self.tx_frame_info[freedv.value]
+
+    def get_frame_length(self, freedv) -> int:
+        """
+        Number of samples of a frame including preamble and postamble
+        """
+        return self.get_frame_info(freedv)["frame_samples"]
+
+    def get_silence_length(self, duration) -> int:
+        return int(self.modem_sample_rate * (duration / 1000))  # type: ignore
+
+    def transmit_add_preamble(self, buffer, freedv) -> int:
+        """
+        Write the preamble to the start of buffer, returns the number of samples
+        """
+        n_tx_preamble_modem_samples = self.get_frame_info(freedv)["preamble_samples"]
+        assert len(buffer) >= n_tx_preamble_modem_samples
+        codec2.api.freedv_rawdatapreambletx(freedv, buffer.ctypes.data)
+        return n_tx_preamble_modem_samples
+
+    def transmit_add_postamble(self, buffer, freedv) -> int:
+        """
+        Write the postamble to the start of buffer, returns the number of samples
+        """
+        n_tx_postamble_modem_samples = self.get_frame_info(freedv)["postamble_samples"]
+        assert len(buffer) >= n_tx_postamble_modem_samples
+        codec2.api.freedv_rawdatapostambletx(freedv, buffer.ctypes.data)
+        return n_tx_postamble_modem_samples
+
+    def transmit_create_frame(self, buffer, freedv, frame) -> int:
+        """
+        Modulate a frame to the start of buffer, returns the number of samples
+        """
         # Get number of bytes per frame for mode
-        bytes_per_frame = int(codec2.api.freedv_get_bits_per_modem_frame(freedv) / 8)
+        frame_info = self.get_frame_info(freedv)
+        bytes_per_frame = frame_info["bytes_per_frame"]
         payload_bytes_per_frame = bytes_per_frame - 2
 
-        # Init buffer for data
-        n_tx_modem_samples = codec2.api.freedv_get_n_tx_modem_samples(freedv)
-        mod_out = ctypes.create_string_buffer(n_tx_modem_samples * 2)
+        n_tx_modem_samples = frame_info["modem_samples"]
+        assert len(buffer) >= n_tx_modem_samples
 
         # Create buffer for data
         # Use this if CRC16 checksum is required (DATAc1-3)
-        buffer = bytearray(payload_bytes_per_frame)
+        payload = bytearray(payload_bytes_per_frame)
         # Set buffersize to length of data which will be send
-        buffer[: len(frame)] = frame  # type: ignore
+        payload[: len(frame)] = frame  # type: ignore
 
         # Create crc for data frame -
         #   Use the crc function shipped with codec2
         #   to avoid CRC algorithm incompatibilities
         # Generate CRC16
         crc = ctypes.c_ushort(
-            codec2.api.freedv_gen_crc16(bytes(buffer), payload_bytes_per_frame)
+            codec2.api.freedv_gen_crc16(bytes(payload), payload_bytes_per_frame)
         )
         # Convert crc to 2-byte (16-bit) hex string
         crc = crc.value.to_bytes(2, byteorder="big")
         # Append CRC to data buffer
-        buffer += crc
+        payload += crc
 
-        assert (bytes_per_frame == len(buffer))
-        data = (ctypes.c_ubyte * bytes_per_frame).from_buffer_copy(buffer)
-        # modulate DATA and save it into mod_out pointer
-        codec2.api.freedv_rawdatatx(freedv, mod_out, data)
-        txbuffer += bytes(mod_out)
-        return txbuffer
+        assert (bytes_per_frame == len(payload))
+        data = (ctypes.c_ubyte * bytes_per_frame).from_buffer_copy(payload)
+        # modulate DATA directly into the tx buffer
+        codec2.api.freedv_rawdatatx(freedv, buffer.ctypes.data, data)
+        return n_tx_modem_samples
+
+    def transmit_add_frame(self, buffer, freedv, frame) -> int:
+        """
+        Write preamble, modulated frame and postamble to the start of buffer,
+        returns the number of samples
+        """
+        position = self.transmit_add_preamble(buffer, freedv)
+        position += self.transmit_create_frame(buffer[position:], freedv, frame)
+        position += self.transmit_add_postamble(buffer[position:], freedv)
+        return position
+
+    def get_tx_instance(self, mode):
+        if mode in self.mode_transition:
+            return self.mode_transition[mode]
+
+        print("wrong mode.................")
+        print(mode)
+        return None
 
     def create_burst(
             self, mode, repeats: int, repeat_delay: int, frames: bytearray
-    ) -> bool:
+    ):
         """
+        Modulate a complete burst into a single buffer. Its length is known
+        from the codec2 sample counts, so every part is written in place.
 
         Args:
-          mode:
-          repeats:
-          repeat_delay:
-          frames:
+          mode: codec2 mode
+          repeats: number of burst repetitions
+          repeat_delay: silence after every repetition in ms
+          frames: frame or list of frames
 
+        Returns:
+          np.ndarray of int16 audio, False for an unknown mode
         """
+        freedv = self.get_tx_instance(mode)
+        if freedv is None:
+            return False
 
+        self.MODE = mode
+        self.log.debug(
+            "[MDM] TRANSMIT", mode=self.MODE.name, delay=self.tx_delay
+        )
 
+        if not isinstance(frames, list): frames = [frames]
+        tx_delay = self.get_silence_length(self.tx_delay) if self.tx_delay > 0 else 0
+        repeat_length = len(frames) * self.get_frame_length(freedv) + self.get_silence_length(repeat_delay)
 
-        # get freedv instance by mode
-        mode_transition = {
-            codec2.FREEDV_MODE.signalling: self.freedv_datac13_tx,
-            codec2.FREEDV_MODE.datac0: self.freedv_datac0_tx,
-            codec2.FREEDV_MODE.datac1: self.freedv_datac1_tx,
-            codec2.FREEDV_MODE.datac3: self.freedv_datac3_tx,
-            codec2.FREEDV_MODE.datac4: self.freedv_datac4_tx,
-            codec2.FREEDV_MODE.datac13: self.freedv_datac13_tx,
-        }
-        if mode in mode_transition:
-            freedv = mode_transition[mode]
-        else:
-            print("wrong mode.................")
-            print(mode)
-            return False
+        # silence is already part of the zeroed buffer
+        txbuffer = np.zeros(tx_delay + repeats * repeat_length, dtype=np.int16)
+        position = tx_delay
+        for _ in range(repeats):
+            for frame in frames:
+                position += self.transmit_add_frame(txbuffer[position:], freedv, frame)
+            position += self.get_silence_length(repeat_delay)
+
+        return txbuffer
+
+    def generate_burst(self, mode, repeats: int, repeat_delay: int, frames: bytearray):
+        """
+        Modulate a burst piece by piece, so the audio can be played while the
+        remaining frames are still being modulated
 
+        Args:
+          mode: codec2 mode
+          repeats: number of burst repetitions
+          repeat_delay: silence after every repetition in ms
+          frames: frame or list of frames
+
+        Yields:
+          np.ndarray of int16 audio, the tx delay silence and one piece per frame
+        """
+        freedv = self.get_tx_instance(mode)
+        if freedv is None:
+            return
 
-        # Open codec2 instance
         self.MODE = mode
         self.log.debug(
             "[MDM] TRANSMIT", mode=self.MODE.name, delay=self.tx_delay
         )
 
-        txbuffer = bytes()
-
         # Add empty data to handle ptt toggle time
         if self.tx_delay > 0:
-            txbuffer = self.transmit_add_silence(txbuffer, self.tx_delay)
+            yield np.zeros(self.get_silence_length(self.tx_delay), dtype=np.int16)
 
         if not isinstance(frames, list): frames = [frames]
+        frame_length = self.get_frame_length(freedv)
         for _ in range(repeats):
 
             # Create modulation for all frames in the list
             for frame in frames:
-                txbuffer = self.transmit_add_preamble(txbuffer, freedv)
-                txbuffer = self.transmit_create_frame(txbuffer, freedv, frame)
-                txbuffer = self.transmit_add_postamble(txbuffer, freedv)
+                txbuffer = np.zeros(frame_length, dtype=np.int16)
+                self.transmit_add_frame(txbuffer, freedv, frame)
+                yield txbuffer
 
             # Add delay to end of frames
-            txbuffer = self.transmit_add_silence(txbuffer, repeat_delay)
-
-        return txbuffer
-
+            yield np.zeros(self.get_silence_length(repeat_delay), dtype=np.int16)
@@ -0,0 +1,86 @@
+"""
+Byte ranges of a transfer, for reassembling ARQ data received out of order
+"""
+import bisect
+
+
+class RangeMap:
+    """
+    Sorted, non overlapping [start, end) byte ranges. Overlapping and adjacent ranges are merged.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start: int, end: int) -> int:
+        """
+        Add a range
+
+        Args:
+            start: first byte of the range
+            end: byte after the last byte of the range
+
+        Returns:
+            number of bytes which were not in the map before
+        """
+        if end <= start:
+            return 0
+
+        # ranges overlapping or touching the new one
+        first = bisect.bisect_left(self.ends, start)
+        last = bisect.bisect_right(self.starts, end)
+        known = sum(max(min(stop, end) - max(begin, start), 0)
+                    for begin, stop in zip(self.starts[first:last], self.ends[first:last]))
+        added = end - start - known
+
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+        return added
+
+    def contains(self, start: int, end: int) -> bool:
+        """
+        Check if a range is completely in the map
+        """
+        if end <= start:
+            return True
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+
+    def contiguous_end(self, start: int = 0) -> int:
+        """
+        End of the gapless data beginning at start
+        """
+        index = bisect.bisect_right(self.starts, start) - 1
+        if index >= 0 and self.ends[index] >= start:
+            return self.ends[index]
+        return start
+
+    def gaps(self, start: int, end: int) -> list:
+        """
+        Missing ranges between start and end
+
+        Returns:
+            list of (start, end) tuples
+        """
+        gaps = []
+        position = start
+        first = bisect.bisect_right(self.ends, start)
+        for begin, stop in zip(self.starts[first:], self.ends[first:]):
+            if begin >= end:
+                break
+            if begin > position:
+                gaps.append((position, begin))
+            position = max(position, stop)
+        if position < end:
+            gaps.append((position, end))
+        return gaps
@@ -8,6 +8,7 @@ import sys
 import serial_ports
 from config import CONFIG
 import audio
+import codec2
 import queue
 import service_manager
 import state_manager
@@ -133,6 +134,12 @@ def get_serial_devices():
 def get_modem_state():
     return api_response(app.state_manager.sendState())
 
+@app.route('/modem/stats', methods=['GET'])
+def get_modem_stats():
+    if not app.state_manager.is_modem_running:
+        api_abort('Modem not running', 503)
+    return api_response(app.service_manager.modem.get_stats())
+
 @app.route('/modem/cqcqcq', methods=['POST', 'GET'])
 def post_cqcqcq():
     if request.method not in ['POST']:
@@ -361,6 +368,8 @@ if __name__ == "__main__":
     # start service manager
     app.service_manager = service_manager.SM(app)
 
+    # query frame geometry of all codec2 modes once, so frame building never opens an instance
+    codec2.init_mode_registry()
     # start modem service
     app.modem_service.put("start")
     # initialize database default values
@@ -102,6 +102,10 @@ class SM:
         
     def stop_modem(self):
         self.log.info("stopping modem....")
+        if self.modem:
+            # release decoder threads and codec2 instances, otherwise every restart leaks them
+            self.frame_dispatcher.stop()
+            self.modem.close()
         del self.modem
         self.modem = False
         self.state_manager.set("is_modem_running", False)
@@ -0,0 +1,193 @@
+"""
+Spectrum calculation for the waterfall and the channel busy detection
+"""
+# pylint: disable=invalid-name, line-too-long
+
+import queue
+
+import numpy as np
+import structlog
+
+
+class SpectrumPlan:
+    """
+    Precomputed window, slot masks and work buffers for one block length and sample rate
+    """
+
+    def __init__(self, blocksize, sample_rate, bandwidth, slot_edges):
+        self.blocksize = blocksize
+        self.sample_rate = sample_rate
+
+        # hann window, scaled to a coherent gain of 1 so levels match the unwindowed fft
+        window = np.hanning(blocksize)
+        self.window = (window * blocksize / np.sum(window)).astype(np.float32)
+
+        self.nbins = blocksize // 2 + 1
+        bin_frequencies = np.fft.rfftfreq(blocksize, 1 / sample_rate)
+        self.nbins_out = int(np.count_nonzero(bin_frequencies < bandwidth))
+
+        # one row per slot, the last slot reaches up to the nyquist frequency
+        edges = list(slot_edges) + [sample_rate]
+        self.slot_masks = np.zeros((len(slot_edges), self.nbins), dtype=bool)
+        for slot, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+            self.slot_masks[slot] = (bin_frequencies >= low) & (bin_frequencies < high)
+        # averaging weights for the level per slot
+        self.slot_weights = self.slot_masks / np.maximum(self.slot_masks.sum(axis=1, keepdims=True), 1)
+
+        # work buffers
+        self.windowed = np.zeros(blocksize, dtype=np.float32)
+        self.spectrum = np.zeros(self.nbins, dtype=np.float64)
+        self.signal = np.zeros(self.nbins, dtype=bool)
+        self.slot_hits = np.zeros_like(self.slot_masks)
+        self.average = np.zeros(self.nbins_out, dtype=np.float64)
+        self.output = np.zeros(self.nbins_out, dtype=np.uint8)
+        self.averaged_frames = 0
+
+
+class SpectrumEngine:
+    """
+    Windowed FFT of audio blocks
+
+    Received blocks are checked for signals per channel slot if a busy detector
+    is attached, the waterfall data is only calculated if someone is listening.
+    """
+
+    # lower edges of the channel busy slots in Hz
+    SLOT_EDGES = [0, 650, 1200, 1760, 2310]
+    # bandwidth of the waterfall data in Hz
+    BANDWIDTH = 3150
+    # bins above average + threshold (dB) are treated as signal
+    SIGNAL_THRESHOLD = 15
+    # update audio dbfs every n rx blocks
+    DBFS_INTERVAL = 6
+
+    def __init__(self, fft_queue, states, subscribers=None, busy_detector=None, averaging=1, decimation=1):
+        """
+        Args:
+            fft_queue: queue which receives the waterfall data as bytes
+            states: state manager
+            subscribers: collection of waterfall clients, None for always publishing
+            busy_detector: ChannelBusyDetector which receives the slot statistics
+            averaging: number of spectrums averaged for the waterfall
+            decimation: publish only every n-th waterfall line
+        """
+        self.log = structlog.get_logger("SpectrumEngine")
+        self.fft_queue = fft_queue
+        self.states = states
+        self.subscribers = subscribers
+        self.busy_detector = busy_detector
+        self.averaging = max(int(averaging), 1)
+        self.decimation = max(int(decimation), 1)
+
+        self.plans = {}
+        self.frame_counter = 0
+        self.dbfs_counter = 0
+
+    def has_subscribers(self) -> bool:
+        return self.subscribers is None or len(self.subscribers) > 0
+
+    def get_plan(self, blocksize, sample_rate) -> SpectrumPlan:
+        key = (blocksize, sample_rate)
+        if key not in self.plans:
+            self.plans[key] = SpectrumPlan(blocksize, sample_rate, self.BANDWIDTH, self.SLOT_EDGES)
+        return self.plans[key]
+
+    def process(self, samples, sample_rate=8000, transmitting=False):
+        """
+        Calculate the spectrum of an audio block
+
+        While receiving, the busy detector and audio dbfs are updated for every
+        block. While transmitting, the spectrum is only calculated for the waterfall.
+
+        Args:
+            samples: audio block as np.int16
+            sample_rate: sample rate of the block
+            transmitting: True if the block is our own tx audio
+
+        Returns:
+            np.ndarray of busy flags per slot, None if the busy state was not evaluated
+        """
+        publish = self.has_subscribers()
+        detect = self.busy_detector is not None and not transmitting
+        if not transmitting:
+            self.update_dbfs(samples)
+        if not publish and not detect:
+            return None
+
+        try:
+            plan = self.get_plan(len(samples), sample_rate)
+
+            np.multiply(samples, plan.window, out=plan.windowed)
+            # 10*log10(abs) is to scale it to dB, values below 1 are clipped for avoiding negative values
+            np.abs(np.fft.rfft(plan.windowed), out=plan.spectrum)
+            np.maximum(plan.spectrum, 1, out=plan.spectrum)
+            np.log10(plan.spectrum, out=plan.spectrum)
+            plan.spectrum *= 10
+
+            slot_busy = None
+            if not transmitting:
+                # Data higher than the average must be a signal
+                avg = plan.spectrum.sum() / plan.nbins
+                np.greater(plan.spectrum, avg + self.SIGNAL_THRESHOLD, out=plan.signal)
+                if detect:
+                    np.logical_and(plan.slot_masks, plan.signal, out=plan.slot_hits)
+                    slot_busy = self.busy_detector.update(
+                        np.count_nonzero(plan.slot_hits, axis=1),
+                        plan.slot_weights @ plan.spectrum,
+                        len(samples) / sample_rate,
+                    )
+                if publish:
+                    # highlight signals in the waterfall
+                    np.copyto(plan.spectrum, 100, where=plan.signal)
+
+            if publish:
+                self.publish(plan)
+
+            return slot_busy
+        except Exception as err:
+            self.log.warning("[MDM] Spectrum calculation failed", e=err)
+            return None
+
+    def update_dbfs(self, samples):
+        """
+        Calculate audio dbfs every DBFS_INTERVAL blocks for reducing CPU load
+        """
+        self.dbfs_counter += 1
+        if self.dbfs_counter < self.DBFS_INTERVAL:
+            return
+        self.dbfs_counter = 0
+
+        # https://dsp.stackexchange.com/questions/8785/how-to-compute-dbfs
+        peak = max(int(np.max(samples)), -int(np.min(samples)))
+        if peak == 0:
+            self.states.set("audio_dbfs", -100)
+        else:
+            self.states.set("audio_dbfs", 20 * np.log10(peak / 32768))
+
+    def publish(self, plan):
+        """
+        Average the spectrum and put every n-th line into the fft queue
+        """
+        spectrum = plan.spectrum[: plan.nbins_out]
+        if self.averaging > 1:
+            if plan.averaged_frames == 0:
+                plan.average[:] = spectrum
+            else:
+                plan.average += (spectrum - plan.average) / self.averaging
+            plan.averaged_frames += 1
+            spectrum = plan.average
+
+        self.frame_counter += 1
+        if self.frame_counter < self.decimation:
+            return
+        self.frame_counter = 0
+
+        np.clip(spectrum, 0, 255, out=plan.output, casting="unsafe")
+
+        # only keep the latest line, the websocket worker might be slower than us
+        while True:
+            try:
+                self.fft_queue.get_nowait()
+            except queue.Empty:
+                break
+        self.fft_queue.put(plan.output.tobytes())
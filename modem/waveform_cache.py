@@ -0,0 +1,107 @@
+"""
+Cache of complete tx waveforms
+
+Beacons, CQs, ARQ stop frames and many ACKs are byte-identical from one
+transmission to the next, so their final sound card audio can be reused
+instead of modulating, scaling and resampling them again.
+"""
+# pylint: disable=invalid-name, line-too-long
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class WaveformCache:
+    """
+    Least recently used cache of int16 waveforms with a memory limit
+
+    Waveforms are stored read-only, so a cached buffer can be handed to the
+    tx audio stage without copying it.
+    """
+
+    # memory limit in bytes, about 70 signalling bursts at 48 kHz
+    MAX_BYTES = 16 * 1024 * 1024
+    # larger waveforms are not cached, so a single data burst can't flush the cache
+    MAX_ENTRY_FRACTION = 0.25
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def create_key(mode, frames, repeats, repeat_delay, audio_level) -> tuple:
+        """
+        Build the cache key of a burst
+
+        Args:
+            mode: codec2 mode
+            frames: frame or list of frames
+            repeats: number of burst repetitions
+            repeat_delay: silence after every repetition in ms
+            audio_level: tx audio level in dB
+        """
+        if not isinstance(frames, list):
+            frames = [frames]
+        return mode, tuple(bytes(frame) for frame in frames), repeats, repeat_delay, audio_level
+
+    def get(self, key):
+        """
+        Returns:
+            the cached np.ndarray, None if the key is unknown
+        """
+        with self.lock:
+            waveform = self.entries.get(key)
+            if waveform is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return waveform
+
+    def put(self, key, waveform) -> bool:
+        """
+        Store a waveform, the least recently used ones are evicted if the memory limit is exceeded
+
+        Returns:
+            False if the waveform is too large for the cache
+        """
+        if waveform.nbytes > self.max_bytes * self.MAX_ENTRY_FRACTION:
+            return False
+        waveform = np.array(waveform, dtype=np.int16)
+        waveform.flags.writeable = False
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).nbytes
+            self.entries[key] = waveform
+            self.size += waveform.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+                self.evictions += 1
+        return True
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -29,6 +29,9 @@ def transmit_sock_data_worker(client_list, event_queue):
         if isinstance(event, str):
             print(f"WARNING: Queue event:\n'{event}'\n still in string format")
             json_event = event
+        elif isinstance(event, bytes):
+            # fft data
+            json_event = json.dumps(list(event))
         else:
             json_event = json.dumps(event)
         clients = client_list.copy()
@@ -0,0 +1,47 @@
+import sys
+sys.path.append('modem')
+
+import unittest
+from arq_rtt_estimator import RTTEstimator
+
+
+class TestRTTEstimator(unittest.TestCase):
+
+    def testInitialTimeout(self):
+        estimator = RTTEstimator(3.3, 2, 30)
+        # the airtime of slow modes extends the timeout
+        self.assertAlmostEqual(estimator.get_timeout(2.2), 5.5)
+        self.assertAlmostEqual(estimator.get_timeout(5.4 + 2.2), 10.9)
+
+    def testSamples(self):
+        estimator = RTTEstimator(3.3, 2, 30)
+        estimator.add_sample(10.0, 7.6)
+        self.assertAlmostEqual(estimator.srtt, 2.4)
+        self.assertAlmostEqual(estimator.rttvar, 1.2)
+        self.assertAlmostEqual(estimator.get_margin(), 2.4 + 4 * 1.2)
+
+        # steady answers shrink the margin down to its lower limit
+        for _ in range(50):
+            estimator.add_sample(8.1, 7.6)
+        self.assertAlmostEqual(estimator.get_margin(), 2)
+
+        # a slower station raises it again
+        for _ in range(50):
+            estimator.add_sample(12.6, 7.6)
+        self.assertAlmostEqual(estimator.get_margin(), 5, places=1)
+
+    def testBackoff(self):
+        estimator = RTTEstimator(3.3, 2, 10)
+        estimator.on_timeout()
+        self.assertAlmostEqual(estimator.get_margin(), 6.6)
+        estimator.on_timeout()
+        self.assertAlmostEqual(estimator.get_margin(), 10)
+
+        # a measured answer ends the backoff
+        estimator.add_sample(5.2, 2.2)
+        self.assertEqual(estimator.backoff, 1)
+        self.assertAlmostEqual(estimator.get_margin(), 3 + 4 * 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import sys
+sys.path.append('modem')
+
+import threading
+import time
+import unittest
+from arq_scheduler import ARQScheduler, TimerHandle, TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def testAdvance(self):
+        wheel = TimerWheel(0.1, 8, 0)
+        timers = [TimerHandle(deadline, None, ()) for deadline in [0.35, 0.05, 2.0, 0.3]]
+        for timer in timers:
+            wheel.add(timer)
+        self.assertEqual(len(wheel), 4)
+
+        self.assertEqual(wheel.advance(0.2), [timers[1]])
+        self.assertEqual(wheel.advance(0.4), [timers[3], timers[0]])
+        # a later round of the wheel shares the slot, it stays
+        self.assertEqual(wheel.advance(1.0), [])
+        self.assertEqual(len(wheel), 1)
+        # a stall longer than the wheel fires it as well
+        self.assertEqual(wheel.advance(5.0), [timers[2]])
+        self.assertEqual(len(wheel), 0)
+
+    def testRemove(self):
+        wheel = TimerWheel(0.1, 8, 0)
+        timer = TimerHandle(0.5, None, ())
+        wheel.add(timer)
+        wheel.remove(timer)
+        wheel.remove(timer)
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(wheel.advance(1.0), [])
+
+
+class TestARQScheduler(unittest.TestCase):
+
+    def testOrder(self):
+        scheduler = ARQScheduler()
+        calls = []
+        done = threading.Event()
+        scheduler.call_later(0.3, lambda: (calls.append('late'), done.set()))
+        scheduler.call_later(0.1, calls.append, 'early')
+        scheduler.call_soon(calls.append, 'soon')
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, ['soon', 'early', 'late'])
+
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['timers_fired'], 2)
+        self.assertEqual(stats['pending_timers'], 0)
+        self.assertLess(stats['lag_max_ms'], 500)
+
+    def testCancel(self):
+        scheduler = ARQScheduler()
+        calls = []
+        timer = scheduler.call_later(0.1, calls.append, 'cancelled')
+        scheduler.cancel(timer)
+        scheduler.cancel(timer)
+        done = threading.Event()
+        scheduler.call_later(0.2, done.set)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, [])
+        self.assertEqual(scheduler.get_stats()['timers_cancelled'], 1)
+
+    def testSingleThread(self):
+        scheduler = ARQScheduler()
+        threads = set()
+        done = threading.Event()
+
+        def callback(remaining):
+            threads.add(threading.current_thread())
+            if remaining:
+                scheduler.call_later(0.01, callback, remaining - 1)
+            else:
+                done.set()
+
+        for _ in range(20):
+            scheduler.call_soon(callback, 3)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(threads, {scheduler.thread})
+
+    def testErrorKeepsRunning(self):
+        scheduler = ARQScheduler()
+        done = threading.Event()
+        scheduler.call_soon(lambda: 1 / 0)
+        scheduler.call_soon(done.set)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(scheduler.get_stats()['errors'], 1)
+
+    def testTransmitDoesNotBlockTimers(self):
+        scheduler = ARQScheduler()
+        calls = []
+        done = threading.Event()
+        on_air = threading.Event()
+
+        def transmission(frame):
+            on_air.set()
+            time.sleep(0.5)
+            calls.append(frame)
+
+        def transmitted(frame):
+            calls.append(('transmitted', frame, threading.current_thread() is scheduler.thread))
+            done.set()
+
+        scheduler.call_soon(scheduler.transmit, transmission, ('burst',), transmitted, 'burst')
+        self.assertTrue(on_air.wait(2))
+        # timers of other sessions fire while the burst is on air
+        scheduler.call_later(0.05, calls.append, 'timer')
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, ['timer', 'burst', ('transmitted', 'burst', True)])
+
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['transmissions'], 1)
+        self.assertLess(stats['lag_max_ms'], 200)
+
+    def testLag(self):
+        scheduler = ARQScheduler()
+        done = threading.Event()
+        # a transmission blocking the loop delays the timers
+        scheduler.call_later(0.05, done.set)
+        scheduler.call_soon(time.sleep, 0.3)
+        self.assertTrue(done.wait(2))
+        self.assertGreater(scheduler.get_stats()['lag_max_ms'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
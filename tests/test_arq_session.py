@@ -20,6 +20,8 @@ from state_manager import StateManager
 from data_frame_factory import DataFrameFactory
 import codec2
 import arq_session_irs
+import arq_session_iss
+from modem_frametypes import FRAME_TYPE
 class TestModem:
     def __init__(self, event_q, state_q):
         self.data_queue_received = queue.Queue()
@@ -39,16 +41,19 @@ class TestModem:
 
     def transmit(self, mode, repeats: int, repeat_delay: int, frames: bytearray) -> bool:
 
-        # Simulate transmission time
-        tx_time = self.getFrameTransmissionTime(mode) + 0.1 # PTT
+        if not isinstance(frames, list): frames = [frames]
+        # Simulate transmission time, a burst of frames is sent with a single PTT
+        tx_time = len(frames) * self.getFrameTransmissionTime(mode) + 0.1 # PTT
         self.logger.info(f"TX {tx_time} seconds...")
         threading.Event().wait(tx_time)
 
-        transmission = {
-            'mode': mode,
-            'bytes': frames,
-        }
-        self.data_queue_received.put(transmission)
+        for frame in frames:
+            transmission = {
+                'mode': mode,
+                # received frames end with the crc16 added by the modulator
+                'bytes': frame + bytes(2),
+            }
+            self.data_queue_received.put(transmission)
 
 class TestARQSession(unittest.TestCase):
 
@@ -235,5 +240,159 @@ class TestARQSession(unittest.TestCase):
                 self.irs_state_manager.remove_arq_irs_session(session_id)
                 break
 
+    def testIRSReceivesBurstOutOfOrder(self):
+        session = arq_session_irs.ARQSessionIRS(self.config, self.irs_modem, 'AA1AAA-1', 1,
+                                                self.irs_state_manager)
+        session.total_length = 100
+        session.received_data = bytearray(100)
+        data = bytes(range(100))
+
+        # the second and fourth block of a burst arrive, the first one is lost
+        for offset in [20, 60]:
+            self.assertTrue(session.process_incoming_data({'offset': offset, 'data': data[offset:offset + 20]}))
+        self.assertEqual(session.received_bytes, 0)
+        self.assertEqual(session.get_burst_bitmap(20), 0b01010)
+
+        self.assertTrue(session.process_incoming_data({'offset': 0, 'data': data[0:20]}))
+        self.assertEqual(session.received_bytes, 40)
+        self.assertFalse(session.process_incoming_data({'offset': 20, 'data': data[20:40]}))
+        session.process_incoming_data({'offset': 40, 'data': data[40:60]})
+        # the last frame is padded
+        session.process_incoming_data({'offset': 80, 'data': data[80:100] + bytes(5)})
+        self.assertEqual(session.received_bytes, 100)
+        self.assertEqual(bytes(session.received_data), data)
+
+    def testIRSStopDuringBurst(self):
+        modem = TestModem(queue.Queue(), queue.Queue())
+        session = arq_session_irs.ARQSessionIRS(self.config, modem, 'AA1AAA-1', 2,
+                                                self.irs_state_manager)
+        session.state = session.state_enum.INFO_ACK_SENT
+        session.total_length = 100
+        session.received_data = bytearray(100)
+        session.frames_per_burst = 3
+        burst_frame = {'offset': 0, 'data': bytes(20), 'speed_level': 0, 'burst_index': 0, 'more_frames': True}
+
+        # the first frame of a burst arrives, the IRS waits for the remaining ones
+        session.receive_data(burst_frame)
+        self.assertIsNotNone(session.burst_timer)
+
+        session.send_stop_ack({})
+        self.assertIsNone(session.burst_timer)
+        self.assertEqual(session.state, session.state_enum.ABORTED)
+
+        # a burst timer firing late leaves the ended session alone
+        session.on_burst_timeout(burst_frame)
+        self.assertEqual(session.state, session.state_enum.ABORTED)
+        session.cancel_timer()
+
+    def testFrameDetailsAppliedWithFrame(self):
+        session = arq_session_irs.ARQSessionIRS(self.config, self.irs_modem, 'AA1AAA-1', 3,
+                                                self.irs_state_manager)
+        session.scheduler = unittest.mock.Mock()
+        frame = {'frame_type': 'ARQ_BURST_FRAME', 'frame_type_int': FRAME_TYPE.ARQ_BURST_FRAME.value}
+
+        # two frames arrive before the scheduler handles the first one
+        session.on_frame_received(frame, 5, 10.0)
+        session.on_frame_received(frame, -3, 20.0)
+        self.assertEqual(session.snr, [])
+
+        for (callback, *args), _ in session.scheduler.call_soon.call_args_list:
+            snr, frequency_offset = args[1], args[2]
+            callback(*args)
+            self.assertEqual(session.snr, snr)
+            self.assertEqual(session.frequency_offset, frequency_offset)
+
+    def testIRSCountsLostTailOfRepeatBurst(self):
+        session = arq_session_irs.ARQSessionIRS(self.config, self.irs_modem, 'AA1AAA-1', 4,
+                                                self.irs_state_manager)
+        payload_size = session.get_data_payload_size(0)
+        session.total_length = 10 * payload_size
+        session.received_data = bytearray(session.total_length)
+        session.version = session.VERSION_SELECTIVE_REPEAT
+        session.frames_per_burst = 5
+        # everything but the blocks 1 and 3 has been received, the ISS repeats just those two
+        for block in [0, 2, 4, 5, 6, 7, 8, 9]:
+            session.process_incoming_data({'offset': block * payload_size, 'data': bytes(payload_size)})
+        session.burst_window_start = session.received_bytes
+
+        burst_frame = {'offset': payload_size, 'data': bytes(payload_size), 'speed_level': 0,
+                       'burst_index': 0, 'more_frames': True}
+        session.process_incoming_data(burst_frame)
+        session.burst_frames_received = 1
+        self.assertEqual(session.get_remaining_burst_frames(burst_frame), 1)
+
+        # the second frame got lost, one of two frames is missing instead of four of five
+        session.speed_controller.add_frames = unittest.mock.Mock()
+        session.update_frames_per_burst(burst_frame)
+        session.speed_controller.add_frames.assert_called_once_with(0, 2, 1)
+        self.assertEqual(session.frames_per_burst, 2)
+
+    def testISSResendsOnlyGaps(self):
+        session = arq_session_iss.ARQSessionISS(self.config, self.iss_modem, 'AA1AAA-1',
+                                                self.iss_state_manager, bytes(200), 0)
+        session.frames_per_burst = 5
+        session.burst_payload_size = 20
+        session.confirmed_bytes = 20
+        # blocks at 40 and 80 arrived, the one at 20 and 60 got lost
+        session.update_acknowledged_ranges({'bitmap': 0b1010})
+        self.assertEqual(session.get_burst_offsets(20), [20, 60, 100, 120, 140])
+
+        session.frames_per_burst = 1
+        self.assertEqual(session.get_burst_offsets(20), [20])
+
+    def testISSTimeoutCoversLostTailFrame(self):
+        session = arq_session_iss.ARQSessionISS(self.config, self.iss_modem, 'AA1AAA-1',
+                                                self.iss_state_manager, bytes(200), 0)
+        # fast answers let the margin converge to its lower limit
+        for _ in range(50):
+            session.rtt_estimator.add_sample(2 * session.ack_airtime + 0.3, 2 * session.ack_airtime)
+        # the IRS acks a burst with a lost tail frame only after its burst margin and tx delay
+        tail_delay = session.TIMEOUT_BURST_MARGIN + self.config['MODEM']['tx_delay'] / 1000
+        self.assertGreater(session.rtt_estimator.get_margin(), tail_delay + session.ack_airtime / 2)
+
+    def testISSConnectionRetriesWithoutBackoff(self):
+        session = arq_session_iss.ARQSessionISS(self.config, self.iss_modem, 'AA1AAA-1',
+                                                self.iss_state_manager, bytes(200), 0)
+        session.scheduler = unittest.mock.Mock()
+        session.state = session.state_enum.OPEN_SENT
+        mode = codec2.FREEDV_MODE.signalling
+        for _ in range(5):
+            session.on_retry_timeout(bytearray(10), 5, mode, False)
+        self.assertEqual(session.rtt_estimator.backoff, 1)
+
+        # every retry waits the same fixed time, the IRS keeps the session open meanwhile
+        session.wait_for_answer(bytearray(10), 5, mode, False, True, time.time())
+        timeout = session.scheduler.call_later.call_args[0][0]
+        self.assertLessEqual(timeout, session.ack_airtime + session.TIMEOUT_TRANSFER)
+
+        session.state = session.state_enum.BURST_SENT
+        session.on_retry_timeout([bytearray(10)], 5, mode, True)
+        self.assertEqual(session.rtt_estimator.backoff, 2)
+
+    def testAllowedSpeedLevels(self):
+        irs = arq_session_irs.ARQSessionIRS(self.config, self.irs_modem, 'AA1AAA-1', 5,
+                                            self.irs_state_manager)
+        irs.allowed_speed_levels = [1]
+        irs.snr = -10
+        self.assertEqual(irs.calibrate_speed_settings(), 1)
+
+        iss = arq_session_iss.ARQSessionISS(self.config, self.iss_modem, 'AA1AAA-1',
+                                            self.iss_state_manager, bytes(200), 0)
+        iss.allowed_speed_levels = [2]
+        iss.speed_level = 2
+        iss.snr = -10
+        # the lowest allowed level is the current one, there is nothing to fall back to
+        self.assertFalse(iss.fall_back_speed_level(1))
+        self.assertEqual(iss.speed_level, 2)
+
+    def testVersionNegotiation(self):
+        session = arq_session_irs.ARQSessionIRS(self.config, self.irs_modem, 'AA1AAA-1', 1,
+                                                self.irs_state_manager)
+        # older stations send no version at all
+        self.assertEqual(session.negotiate_version(0), session.VERSION_STOP_AND_WAIT)
+        self.assertFalse(session.is_selective_repeat())
+        self.assertEqual(session.negotiate_version(session.VERSION + 1), session.VERSION)
+        self.assertTrue(session.is_selective_repeat())
+
 if __name__ == '__main__':
     unittest.main()
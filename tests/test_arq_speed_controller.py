@@ -0,0 +1,49 @@
+import sys
+sys.path.append('modem')
+
+import unittest
+from arq_session import ARQSession
+from arq_speed_controller import SpeedController
+
+
+class TestSpeedController(unittest.TestCase):
+
+    def create_controller(self):
+        payload_sizes = {0: 47, 1: 119, 2: 503}
+        return SpeedController(ARQSession.SPEED_LEVEL_DICT, payload_sizes, 2.2, 5.5)
+
+    def testSelectBySNR(self):
+        controller = self.create_controller()
+        self.assertEqual(controller.select(0, [10, 10, 10]), 2)
+        self.assertEqual(controller.select(2, [-8, -8, -8]), 0)
+        # the allowed speed levels limit the selection
+        self.assertEqual(controller.select(0, [10, 10, 10], [0, 1]), 1)
+
+    def testNewerSNRWeighsMore(self):
+        controller = self.create_controller()
+        self.assertEqual(controller.select(0, [-8, -8, -8, 10]), 2)
+        self.assertEqual(controller.select(2, [10, 10, 10, -8, -8, -8]), 0)
+
+    def testLostBurstsFallBack(self):
+        controller = self.create_controller()
+        snr_history = [1, 1, 1]
+        self.assertEqual(controller.select(2, snr_history, [0, 2]), 2)
+        controller.add_frames(2, 1, 1)
+        self.assertEqual(controller.select(2, snr_history, [0, 2]), 0)
+
+        # received frames make the speed level attractive again
+        controller.add_frames(2, 1, 0)
+        self.assertEqual(controller.select(0, snr_history, [0, 2]), 2)
+
+    def testHysteresis(self):
+        controller = self.create_controller()
+        snr_history = [2.2]
+        goodput = {level: controller.get_goodput(level, snr_history) for level in [1, 2]}
+        self.assertGreater(goodput[2], goodput[1])
+        self.assertLess(goodput[2], goodput[1] * (1 + controller.HYSTERESIS))
+        self.assertEqual(controller.select(1, snr_history), 1)
+        self.assertEqual(controller.select(0, snr_history), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import sys
+sys.path.append('modem')
+
+import queue
+import threading
+import unittest
+import numpy as np
+import codec2
+from audio_pipeline import BlockQueue, RXAudioPipeline, TXAudioConditioner, TXAudioPlayer
+
+
+class TestAudioPipeline(unittest.TestCase):
+
+    def testBlockQueueOverflow(self):
+        block_queue = BlockQueue(2, 10)
+        self.assertTrue(block_queue.put(np.ones(10, dtype=np.int16)))
+        self.assertTrue(block_queue.put(np.ones(10, dtype=np.int16) * 2))
+        self.assertFalse(block_queue.put(np.ones(10, dtype=np.int16) * 3))
+        self.assertEqual(block_queue.overflows, 1)
+        self.assertEqual(block_queue.qsize(), 2)
+
+        np.testing.assert_array_equal(block_queue.get(0), np.ones(10, dtype=np.int16))
+        block_queue.release()
+        np.testing.assert_array_equal(block_queue.get(0), np.ones(10, dtype=np.int16) * 2)
+        block_queue.release()
+        self.assertIsNone(block_queue.get(0.01))
+
+    def testPipelineResamplesAndScales(self):
+        received = queue.Queue()
+        pipeline = RXAudioPipeline(resampler=codec2.resampler(), rx_audio_level=-6)
+        pipeline.add_consumer(lambda samples: received.put(samples.copy()))
+
+        indata = (np.ones((4800, 1)) * 10000).astype(np.int16)
+        for _ in range(5):
+            pipeline.push(indata, None)
+
+        blocks = [received.get(timeout=5) for _ in range(5)]
+        pipeline.stop()
+
+        self.assertEqual(len(blocks[-1]), 800)
+        # -6 dB is roughly half of the resampled amplitude
+        self.assertLess(np.max(blocks[-1]), 10000 * 0.6)
+        stats = pipeline.get_stats()
+        self.assertEqual(stats['callback_count'], 5)
+        self.assertEqual(stats['queue_overflows'], 0)
+
+    def testTXPlayerUnderrunAndDrain(self):
+        player = TXAudioPlayer(capacity=100, monitor_blocksize=40)
+        outdata = np.zeros(40, dtype=np.int16)
+
+        player.start()
+        player.write(np.arange(1, 61, dtype=np.int16))
+        self.assertEqual(player.read(outdata), 40)
+        np.testing.assert_array_equal(outdata, np.arange(1, 41))
+
+        # writer is still modulating, missing samples are an underrun
+        self.assertEqual(player.read(outdata), 20)
+        self.assertEqual(player.underruns, 1)
+        self.assertEqual(player.underrun_samples, 20)
+        self.assertTrue(np.all(outdata[20:] == 0))
+
+        # the tail of a finished transmission is not an underrun
+        player.write(np.ones(10, dtype=np.int16))
+        player.finish()
+        self.assertEqual(player.read(outdata), 10)
+        self.assertEqual(player.underrun_samples, 20)
+        self.assertFalse(player.wait_until_drained(0))
+        self.assertEqual(player.read(outdata), 0)
+        self.assertTrue(player.wait_until_drained(0))
+        self.assertEqual(player.monitor.qsize(), 3)
+
+    def testTXPlayerWritesLargerThanRing(self):
+        player = TXAudioPlayer(capacity=64, monitor_blocksize=48)
+        samples = np.arange(1000, dtype=np.int16)
+        played = []
+
+        def callback():
+            outdata = np.zeros(48, dtype=np.int16)
+            while not player.wait_until_drained(0):
+                count = player.read(outdata)
+                played.append(outdata[:count].copy())
+                # keep the monitor queue empty, nobody is reading it
+                while player.monitor.get(0) is not None:
+                    player.monitor.release()
+
+        player.start()
+        thread = threading.Thread(target=callback)
+        thread.start()
+        self.assertTrue(player.write(samples, timeout=5))
+        player.finish()
+        self.assertTrue(player.wait_until_drained(5))
+        thread.join()
+
+        np.testing.assert_array_equal(np.concatenate(played), samples)
+        self.assertEqual(player.get_stats()["max_fill"], 64)
+
+    def testTXPlayerFinishDuringRead(self):
+        player = TXAudioPlayer(capacity=64, monitor_blocksize=48)
+        player.start()
+        available = player.available
+
+        def commit_and_finish():
+            # the writer commits its last samples and finishes while the callback is running
+            player.available = available
+            pending = available()
+            self.assertTrue(player.write(np.ones(10, dtype=np.int16), timeout=0))
+            player.finish()
+            return pending
+
+        player.available = commit_and_finish
+        outdata = np.zeros(48, dtype=np.int16)
+        self.assertEqual(player.read(outdata), 0)
+        self.assertFalse(player.wait_until_drained(0))
+        self.assertEqual(player.read(outdata), 10)
+        self.assertEqual(player.read(outdata), 0)
+        self.assertTrue(player.wait_until_drained(0))
+
+    def testTXConditionerWritesIntoRing(self):
+        samples = (np.random.default_rng(0).standard_normal(2000) * 5000).astype(np.int16)
+        # the ring size is no multiple of the resampling ratio, so writes wrap in the middle of a sample
+        player = TXAudioPlayer(capacity=6 * 2000 + 1000 + 1, monitor_blocksize=4800)
+        conditioner = TXAudioConditioner(player, resampler=codec2.resampler(), tx_audio_level=-6)
+        reference = codec2.resampler().resample8_to_48(
+            np.clip(samples * 10 ** (-6 / 20), -32768, 32767).astype(np.int16))
+
+        outdata = np.zeros(4800, dtype=np.int16)
+        player.start()
+        for _ in range(2):
+            captured = []
+            self.assertTrue(conditioner.write(samples, capture=captured))
+            played = []
+            while player.available():
+                played.append(outdata[:player.read(outdata)].copy())
+                player.monitor.release()
+            played = np.concatenate(played)
+            np.testing.assert_array_equal(np.concatenate(captured), played)
+            self.assertEqual(len(played), 6 * len(samples))
+        # fixed point gain with rounding differs from the float gain by a few LSB
+        self.assertLess(np.max(np.abs(played[-6000:].astype(int) - reference[-6000:])), 8)
+
+    def testTXConditionerWithoutResampler(self):
+        player = TXAudioPlayer(capacity=100)
+        conditioner = TXAudioConditioner(player, tx_audio_level=20)
+        output = conditioner.process(np.array([1000, -1000, 5000], dtype=np.int16))
+        np.testing.assert_array_equal(output, [10000, -10000, 32767])
+
+
+if __name__ == '__main__':
+    unittest.main()
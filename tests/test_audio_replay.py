@@ -0,0 +1,71 @@
+import sys
+sys.path.append('modem')
+
+import os
+import queue
+import tempfile
+import unittest
+import wave
+import numpy as np
+import codec2
+import modulator
+from audio_replay import AudioReplay, read_recording
+from demodulator import Demodulator
+from event_manager import EventManager
+from state_manager import StateManager
+
+
+class TestAudioReplay(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # one signalling and two datac1 bursts
+        modem = modulator.Modulator({'MODEM': {'tx_delay': 50}})
+        bursts = []
+        for mode, frames in [(codec2.FREEDV_MODE.datac13, 1), (codec2.FREEDV_MODE.datac1, 2)]:
+            instance = codec2.open_instance(mode.value)
+            bytes_per_frame = codec2.api.freedv_get_bits_per_modem_frame(instance) // 8
+            bursts.append(modem.create_burst(mode, frames, 500, [bytearray(bytes_per_frame - 2)]))
+        samples = np.concatenate(bursts)
+        noise = np.random.default_rng(0).standard_normal(len(samples)) * 200
+        cls.samples = (samples + noise).astype(np.int16)
+
+    def setUp(self):
+        self.data_queue = queue.Queue()
+        self.demodulator = Demodulator({}, queue.Queue(), self.data_queue, StateManager(queue.Queue()),
+                                       EventManager([queue.Queue()]), queue.Queue(), None)
+        self.demodulator.set_decode_mode({codec2.FREEDV_MODE.datac1.value: True})
+        self.replay = AudioReplay(self.demodulator)
+
+    def tearDown(self):
+        self.replay.stop()
+
+    def testReplay(self):
+        stats = self.replay.replay(self.samples)
+        self.assertEqual(self.data_queue.qsize(), 3)
+        self.assertEqual(stats["modes"]["SIGNALLING"]["decoded_frames"], 1)
+        self.assertEqual(stats["modes"]["DATAC1"]["decoded_frames"], 2)
+        self.assertGreater(stats["realtime_factor"], 1)
+
+    def testReplayWav48k(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "recording.wav")
+            with wave.open(path, "wb") as recording:
+                recording.setnchannels(1)
+                recording.setsampwidth(2)
+                recording.setframerate(48000)
+                recording.writeframes(codec2.resampler().resample8_to_48(self.samples).tobytes())
+
+            samples, sample_rate = read_recording(path)
+            self.assertEqual(sample_rate, 48000)
+            self.assertEqual(len(samples), 6 * len(self.samples))
+            self.replay.replay_file(path)
+        self.assertEqual(self.data_queue.qsize(), 3)
+
+    def testRawRecordingNeedsSampleRate(self):
+        with self.assertRaises(ValueError):
+            read_recording("recording.raw")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import sys
+sys.path.append('modem')
+
+import queue
+import unittest
+from state_manager import StateManager
+from channel_busy import ChannelBusyDetector
+
+
+class TestChannelBusyDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.states = StateManager(queue.Queue())
+        self.state_queue = self.states.statequeue
+
+    def testHoldTime(self):
+        detector = ChannelBusyDetector(self.states, hold_factor=10, max_hold_time=20)
+        signal = [0, 0, 5, 0, 0]
+        quiet = [0, 0, 0, 0, 0]
+        energy = [0, 0, 30, 0, 0]
+
+        # 0.3 s of traffic keeps the slot busy for 3 s
+        for _ in range(3):
+            detector.update(signal, energy, 0.1)
+        self.assertEqual(detector.slot_busy.tolist(), [False, False, True, False, False])
+        self.assertFalse(self.states.channel_busy_condition_traffic.is_set())
+
+        for _ in range(29):
+            detector.update(quiet, energy, 0.1)
+        self.assertTrue(detector.busy)
+        detector.update(quiet, energy, 0.1)
+        self.assertFalse(detector.busy)
+        self.assertTrue(self.states.channel_busy_condition_traffic.is_set())
+
+    def testAttackTime(self):
+        detector = ChannelBusyDetector(self.states, attack_time=0.5)
+        signal = [3, 0, 0, 0, 0]
+        for _ in range(4):
+            detector.update(signal, [0] * 5, 0.1)
+        self.assertFalse(detector.busy)
+        detector.update(signal, [0] * 5, 0.1)
+        self.assertTrue(detector.busy)
+
+    def testPublishOnlyChanges(self):
+        detector = ChannelBusyDetector(self.states)
+        for _ in range(10):
+            detector.update([0, 4, 0, 0, 0], [0] * 5, 0.1)
+        self.assertEqual(self.state_queue.qsize(), 1)
+
+    def testModeSlots(self):
+        detector = ChannelBusyDetector(self.states)
+        detector.update([0, 4, 0, 0, 0], [0] * 5, 0.1)
+        self.assertTrue(detector.is_busy_for_mode("datac1"))
+        self.assertFalse(detector.is_busy_for_mode("datac13"))
+
+    def testIndependentInstances(self):
+        other_states = StateManager(queue.Queue())
+        busy = ChannelBusyDetector(self.states)
+        idle = ChannelBusyDetector(other_states)
+        busy.update([0, 0, 4, 0, 0], [0] * 5, 0.1)
+        idle.update([0, 0, 0, 0, 0], [0] * 5, 0.1)
+        self.assertTrue(busy.busy)
+        self.assertFalse(idle.busy)
+        self.assertEqual(other_states.channel_busy_slot, [False] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import sys
+sys.path.append('modem')
+
+import queue
+import unittest
+import numpy as np
+import codec2
+import modulator
+from audio_replay import AudioReplay
+from channel_simulator import ChannelSimulator
+from demodulator import Demodulator
+from event_manager import EventManager
+from state_manager import StateManager
+
+
+def process_blocks(channel, samples, blocksize=800):
+    return np.concatenate([channel.process(samples[i:i + blocksize]) for i in range(0, len(samples), blocksize)])
+
+
+class TestChannelSimulator(unittest.TestCase):
+
+    def setUp(self):
+        t = np.arange(16000) / 8000
+        self.tone = (1000 * np.cos(2 * np.pi * 1000 * t)).astype(np.int16)
+
+    def testCleanChannel(self):
+        output = process_blocks(ChannelSimulator(), self.tone)
+        np.testing.assert_array_equal(output, self.tone)
+
+    def testNoiseLevel(self):
+        channel = ChannelSimulator(snr_db=10, seed=0)
+        noise = channel.process(np.zeros(80000, dtype=np.int16)).astype(np.float64)
+        # the snr refers to a 3 kHz bandwidth, white noise covers 4 kHz
+        expected = ChannelSimulator.SIGNAL_RMS / np.sqrt(10) * np.sqrt(4000 / 3000)
+        self.assertAlmostEqual(np.std(noise) / expected, 1, delta=0.02)
+
+    def testFrequencyOffset(self):
+        output = process_blocks(ChannelSimulator(frequency_offset=50), self.tone).astype(np.float64)
+        spectrum = np.abs(np.fft.rfft(output[400:]))
+        frequencies = np.fft.rfftfreq(len(output) - 400, 1 / 8000)
+        self.assertAlmostEqual(frequencies[np.argmax(spectrum)], 1050, delta=1)
+
+    def testClockDrift(self):
+        channel = ChannelSimulator(clock_drift_ppm=100)
+        length = sum(len(channel.process(np.zeros(800, dtype=np.int16))) for _ in range(100))
+        self.assertAlmostEqual(length, 80000 / 1.0001, delta=1)
+
+    def testFadingIsReproducible(self):
+        first = process_blocks(ChannelSimulator(fading="mpp", seed=1), self.tone)
+        second = process_blocks(ChannelSimulator(fading="mpp", seed=1), self.tone)
+        np.testing.assert_array_equal(first, second)
+        self.assertFalse(np.array_equal(first, self.tone))
+
+    def testDecodeThroughChannel(self):
+        modem = modulator.Modulator({'MODEM': {'tx_delay': 50}})
+        mode = codec2.FREEDV_MODE.datac3
+        instance = codec2.open_instance(mode.value)
+        bytes_per_frame = codec2.api.freedv_get_bits_per_modem_frame(instance) // 8
+        samples = modem.create_burst(mode, 2, 500, [bytearray(bytes_per_frame - 2)])
+
+        channel = ChannelSimulator(snr_db=10, frequency_offset=20, fading="mpg", clock_drift_ppm=50, seed=0)
+        samples = process_blocks(channel, samples)
+
+        data_queue = queue.Queue()
+        demodulator = Demodulator({}, queue.Queue(), data_queue, StateManager(queue.Queue()),
+                                  EventManager([queue.Queue()]), queue.Queue(), None)
+        demodulator.set_decode_mode({mode.value: True})
+        replay = AudioReplay(demodulator)
+        try:
+            stats = replay.replay(samples)
+        finally:
+            replay.stop()
+        self.assertEqual(stats["modes"]["DATAC3"]["decoded_frames"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import sys
+sys.path.append('modem')
+
+import ctypes
+import threading
+import unittest
+from unittest import mock
+import numpy as np
+import codec2
+import modulator
+
+
+class TestAudioRing(unittest.TestCase):
+
+    def testCursorsReadIndependently(self):
+        ring = codec2.audio_ring(400)
+        fast = ring.cursor(200)
+        slow = ring.cursor(200)
+        samples = np.arange(150, dtype=np.int16)
+        ring.push(samples)
+        self.assertEqual(fast.nbuffer, 150)
+        fast.pop(100)
+        self.assertEqual(fast.nbuffer, 50)
+        self.assertEqual(slow.nbuffer, 150)
+        np.testing.assert_array_equal(fast.buffer[:50], samples[100:])
+        np.testing.assert_array_equal(slow.buffer[:150], samples)
+
+    def testCursorOverflow(self):
+        ring = codec2.audio_ring(400)
+        cursor = ring.cursor(200)
+        self.assertFalse(ring.push(np.zeros(150, dtype=np.int16)))
+        self.assertTrue(ring.push(np.arange(150, dtype=np.int16)))
+        self.assertEqual(cursor.overflows, 1)
+        self.assertEqual(cursor.nbuffer, 200)
+        # the oldest samples have been dropped
+        np.testing.assert_array_equal(cursor.buffer[50:200], np.arange(150, dtype=np.int16))
+
+    def testDetachedCursor(self):
+        ring = codec2.audio_ring(400)
+        cursor = ring.cursor(200)
+        cursor.set_active(False)
+        self.assertFalse(ring.push(np.zeros(150, dtype=np.int16)))
+        self.assertFalse(ring.push(np.zeros(150, dtype=np.int16)))
+        self.assertEqual(cursor.nbuffer, 0)
+        self.assertEqual(cursor.overflows, 0)
+        cursor.set_active(True)
+        ring.push(np.arange(10, dtype=np.int16))
+        self.assertEqual(cursor.nbuffer, 10)
+        np.testing.assert_array_equal(cursor.buffer[:10], np.arange(10, dtype=np.int16))
+
+    def testPushPop(self):
+        ring = codec2.audio_ring(200)
+        cursor = ring.cursor(100)
+        ring.push(np.arange(60, dtype=np.int16))
+        self.assertEqual(cursor.nbuffer, 60)
+        cursor.pop(40)
+        self.assertEqual(cursor.nbuffer, 20)
+        np.testing.assert_array_equal(cursor.buffer[:20], np.arange(40, 60, dtype=np.int16))
+
+    def testWrapAroundIsContiguous(self):
+        ring = codec2.audio_ring(200)
+        cursor = ring.cursor(100)
+        samples = np.arange(1000, dtype=np.int16)
+        read = []
+        position = 0
+        # push blocks which don't divide the ring size for forcing wrap arounds
+        while position < len(samples):
+            block = samples[position:position + 30]
+            ring.push(block)
+            position += len(block)
+            while cursor.nbuffer >= 45:
+                read.append(cursor.buffer[:45].copy())
+                cursor.pop(45)
+        read = np.concatenate(read)
+        np.testing.assert_array_equal(read, samples[:len(read)])
+        self.assertEqual(cursor.overflows, 0)
+
+    def testWaitForSamples(self):
+        ring = codec2.audio_ring(400)
+        cursor = ring.cursor(200)
+        self.assertFalse(cursor.wait_for_samples(80, timeout=0.01))
+
+        pusher = threading.Timer(0.05, ring.push, args=[np.ones(100, dtype=np.int16)])
+        pusher.start()
+        self.assertTrue(cursor.wait_for_samples(80, timeout=5))
+        pusher.join()
+
+    def testCloseReleasesConsumer(self):
+        ring = codec2.audio_ring(400)
+        cursor = ring.cursor(200)
+        closer = threading.Timer(0.05, cursor.close)
+        closer.start()
+        self.assertFalse(cursor.wait_for_samples(10))
+        closer.join()
+
+
+class TestResampler(unittest.TestCase):
+
+    def testOddBlockSizes(self):
+        samples = (np.random.default_rng(1).standard_normal(48000) * 5000).astype(np.int16)
+        reference = codec2.resampler().resample48_to_8(samples)
+        self.assertEqual(len(reference), 8000)
+
+        resampler = codec2.resampler()
+        out = np.zeros(8000, dtype=np.int16)
+        blocks = []
+        position = 0
+        for length in [1, 7, 4799, 13, 10000, 33180]:
+            blocks.append(resampler.resample48_to_8(samples[position:position + length], out=out).copy())
+            position += length
+        np.testing.assert_array_equal(np.concatenate(blocks), reference)
+
+    def testUpsampleChunks(self):
+        samples = (np.random.default_rng(2).standard_normal(20000) * 5000).astype(np.int16)
+        reference = codec2.resampler().resample8_to_48(samples)
+        self.assertEqual(len(reference), 6 * 20000)
+
+        out = np.zeros(6 * 20000, dtype=np.int16)
+        result = codec2.resampler(tx_blocksize=800).resample8_to_48(samples, out=out)
+        np.testing.assert_array_equal(result, reference)
+
+
+class TestModemStatsSnapshot(unittest.TestCase):
+
+    def testSnapshotMatchesModemStats(self):
+        mode = codec2.FREEDV_MODE.datac13
+        tx = codec2.open_instance(mode.value)
+        bytes_per_frame = codec2.api.freedv_get_bits_per_modem_frame(tx) // 8
+        burst = modulator.Modulator({'MODEM': {'tx_delay': 50}}).create_burst(mode, 1, 0, [bytearray(bytes_per_frame - 2)])
+        samples = np.concatenate([burst, np.zeros(16000, dtype=np.int16)])
+        samples = (samples + np.random.default_rng(0).standard_normal(len(samples)) * 300).astype(np.int16)
+
+        rx = codec2.open_instance(mode.value)
+        codec2.api.freedv_set_frames_per_burst(rx, 1)
+        bytes_out = ctypes.create_string_buffer(bytes_per_frame)
+        snapshot = codec2.modem_stats_snapshot()
+        position = 0
+        decoded = False
+        while position + codec2.api.freedv_nin(rx) <= len(samples) and not decoded:
+            nin = codec2.api.freedv_nin(rx)
+            block = np.ascontiguousarray(samples[position:position + nin])
+            position += nin
+            decoded = codec2.api.freedv_rawdatarx(rx, bytes_out, block.ctypes) == bytes_per_frame
+        self.assertTrue(decoded)
+
+        snapshot.update(rx)
+        snr = ctypes.c_float()
+        sync = ctypes.c_int()
+        codec2.api.freedv_get_modem_stats(rx, ctypes.byref(sync), ctypes.byref(snr))
+        self.assertEqual(snapshot.snr, int(round(snr.value, 1)))
+        self.assertEqual(snapshot.rx_symbols.shape, (codec2.MODEM_STATS_NC_MAX, codec2.MODEM_STATS_NR_MAX))
+        self.assertTrue(np.any(snapshot.rx_symbols))
+
+
+class TestModeRegistry(unittest.TestCase):
+
+    def testMatchesInstance(self):
+        for mode in codec2.FREEDV_MODE:
+            instance = codec2.open_instance(mode.value)
+            info = codec2.get_mode_info(mode)
+            self.assertEqual(info.bytes_per_frame, int(codec2.api.freedv_get_bits_per_modem_frame(instance) / 8))
+            self.assertEqual(info.payload_per_frame, info.bytes_per_frame - 2)
+            self.assertEqual(info.preamble_samples, codec2.api.freedv_get_n_tx_preamble_modem_samples(instance))
+            self.assertEqual(info.postamble_samples, codec2.api.freedv_get_n_tx_postamble_modem_samples(instance))
+            self.assertEqual(info.frame_samples, info.preamble_samples + info.modem_samples + info.postamble_samples)
+            self.assertAlmostEqual(info.airtime, info.frame_samples / codec2.api.FREEDV_FS_8000)
+
+    def testLookupDoesNotOpenInstances(self):
+        codec2.init_mode_registry()
+        with mock.patch.object(codec2, "open_instance") as open_instance:
+            # mode, value, name and alias all resolve to the same entry
+            info = codec2.get_mode_info(codec2.FREEDV_MODE.datac13)
+            self.assertIs(codec2.get_mode_info(codec2.FREEDV_MODE.signalling.value), info)
+            self.assertIs(codec2.get_mode_info("signalling"), info)
+            self.assertEqual(codec2.get_bytes_per_frame(codec2.FREEDV_MODE.datac1.value), 512)
+            open_instance.assert_not_called()
+
+
+class TestModulator(unittest.TestCase):
+
+    def testBurstLength(self):
+        mode = codec2.FREEDV_MODE.datac3
+        frames = [bytearray(b"first"), bytearray(b"second")]
+        modem = modulator.Modulator({'MODEM': {'tx_delay': 50}})
+        burst = modem.create_burst(mode, 2, 300, frames)
+
+        instance = codec2.open_instance(mode.value)
+        frame_length = (codec2.api.freedv_get_n_tx_preamble_modem_samples(instance)
+                        + codec2.api.freedv_get_n_tx_modem_samples(instance)
+                        + codec2.api.freedv_get_n_tx_postamble_modem_samples(instance))
+        self.assertEqual(burst.dtype, np.int16)
+        self.assertEqual(len(burst), 400 + 2 * (2 * frame_length + 2400))
+        self.assertTrue(np.all(burst[:400] == 0))
+        self.assertTrue(np.all(burst[-2400:] == 0))
+
+    def testGeneratedBurstMatches(self):
+        # codec2 tx instances keep state between frames, so each burst needs a fresh modulator
+        frames = [bytearray(b"first"), bytearray(b"second")]
+        burst = modulator.Modulator({'MODEM': {'tx_delay': 50}}).create_burst(codec2.FREEDV_MODE.datac13, 2, 100, frames)
+        pieces = list(modulator.Modulator({'MODEM': {'tx_delay': 50}}).generate_burst(codec2.FREEDV_MODE.datac13, 2, 100, frames))
+        self.assertEqual(len(pieces), 1 + 2 * 3)
+        np.testing.assert_array_equal(np.concatenate(pieces), burst)
+
+
+if __name__ == '__main__':
+    unittest.main()
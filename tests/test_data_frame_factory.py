@@ -32,11 +32,13 @@ class TestDataFrameFactory(unittest.TestCase):
     def testARQConnect(self):
         dxcall = "DJ2LS-4"
         session_id = 123
-        frame = self.factory.build_arq_session_open(dxcall, session_id, 1700)
+        frame = self.factory.build_arq_session_open(dxcall, session_id, 1700, 2)
         frame_data = self.factory.deconstruct(frame)
 
         self.assertEqual(frame_data['origin'], self.factory.myfullcall)
         self.assertEqual(frame_data['session_id'] , session_id)
+        self.assertEqual(frame_data['version'], 2)
+        self.assertEqual(len(frame), self.factory.LENGTH_SIG0_FRAME)
 
     def testCQ(self):
         frame = self.factory.build_cq()
@@ -59,7 +61,28 @@ class TestDataFrameFactory(unittest.TestCase):
         payload = payload * 1000
         self.assertRaises(OverflowError, self.factory.build_arq_burst_frame,
             FREEDV_MODE.datac3, session_id, offset, payload, 0)
-        
+
+    def testBurstPosition(self):
+        frame = self.factory.build_arq_burst_frame(FREEDV_MODE.datac1, 1, 0, b'abc', 2,
+                                                   burst_index=3, more_frames=True)
+        frame_data = self.factory.deconstruct(frame)
+        self.assertEqual(frame_data['speed_level'], 2)
+        self.assertEqual(frame_data['burst_index'], 3)
+        self.assertTrue(frame_data['more_frames'])
+
+        # a single frame keeps the plain speed level byte of older versions
+        frame = self.factory.build_arq_burst_frame(FREEDV_MODE.datac1, 1, 0, b'abc', 2)
+        self.assertEqual(frame[2], 2)
+        self.assertFalse(self.factory.deconstruct(frame)['more_frames'])
+
+    def testBurstAckBitmap(self):
+        frame = self.factory.build_arq_burst_ack(5, 1000, 1, 3, 10, bitmap=0b1000000000000110)
+        self.assertEqual(len(frame), self.factory.LENGTH_SIG1_FRAME)
+        frame_data = self.factory.deconstruct(frame)
+        self.assertEqual(frame_data['offset'], 1000)
+        self.assertEqual(frame_data['frames_per_burst'], 3)
+        self.assertEqual(frame_data['bitmap'], 0b1000000000000110)
+
     def testAvailablePayload(self):
         avail = self.factory.get_available_data_payload_for_mode(FRAME_TYPE.ARQ_BURST_FRAME, FREEDV_MODE.datac3)
         self.assertEqual(avail, 119) # 128 bytes datac3 frame payload - BURST frame overhead
@@ -0,0 +1,85 @@
+import sys
+sys.path.append('modem')
+
+import queue
+import time
+import unittest
+import numpy as np
+import codec2
+from demodulator import Demodulator
+from event_manager import EventManager
+from state_manager import StateManager
+
+
+class FakeStream:
+    def __init__(self):
+        self.active = True
+
+
+class TestDemodulator(unittest.TestCase):
+
+    def setUp(self):
+        self.states = StateManager(queue.Queue())
+        self.event_queue = queue.Queue()
+        self.demodulator = Demodulator({}, queue.Queue(), queue.Queue(), self.states,
+                                       EventManager([self.event_queue]), queue.Queue(), None)
+        self.stream = FakeStream()
+        self.demodulator.start(self.stream)
+
+    def tearDown(self):
+        self.stream.active = False
+        for mode in self.demodulator.MODE_DICT.values():
+            mode["audio_buffer"].close()
+
+    def push_noise(self, blocks):
+        rng = np.random.default_rng(0)
+        for _ in range(blocks):
+            self.demodulator.push_audio((rng.standard_normal(800) * 1000).astype(np.int16))
+            time.sleep(0.1)
+
+    def testDecodersStartOnDemand(self):
+        stats = self.demodulator.get_stats()
+        self.assertTrue(stats["SIGNALLING"]["thread_running"])
+        self.assertFalse(stats["DATAC1"]["thread_running"])
+
+        self.demodulator.set_decode_mode({codec2.FREEDV_MODE.datac1.value: True})
+        stats = self.demodulator.get_stats()
+        self.assertTrue(stats["DATAC1"]["thread_running"])
+        self.assertTrue(stats["DATAC4"]["thread_running"])
+        self.assertFalse(stats["DATAC3"]["thread_running"])
+
+    def testParkedDecoder(self):
+        self.demodulator.set_decode_mode({codec2.FREEDV_MODE.datac1.value: True})
+        self.demodulator.set_decode_mode()
+        wakeups = self.demodulator.get_stats()["DATAC1"]["wakeups"]
+
+        self.push_noise(5)
+        stats = self.demodulator.get_stats()
+        self.assertEqual(stats["DATAC1"]["wakeups"], wakeups)
+        self.assertGreater(stats["SIGNALLING"]["demodulated_frames"], 0)
+
+        # resumes with the next block
+        self.demodulator.set_decode_mode({codec2.FREEDV_MODE.datac1.value: True})
+        self.push_noise(5)
+        self.assertGreater(self.demodulator.get_stats()["DATAC1"]["demodulated_frames"], 0)
+
+    def testScatter(self):
+        modem_stats = codec2.modem_stats_snapshot()
+        rng = np.random.default_rng(0)
+        modem_stats.rx_symbols[:20, :100] = rng.choice([-1, 1], size=(20, 100)) * 2000 + rng.standard_normal((20, 100)) * 100
+
+        self.demodulator.get_scatter(modem_stats)
+        scatter = self.event_queue.get_nowait()["scatter"]
+        # 1000 symbols, decimated
+        self.assertLessEqual(len(scatter), self.demodulator.SCATTER_MAX_POINTS)
+        self.assertGreater(len(scatter), 100)
+        self.assertTrue(all(len(point) == 2 and -127 <= min(point) and max(point) <= 127 for point in scatter))
+        self.assertEqual(max(abs(value) for point in scatter for value in point), 127)
+
+        # rate limited
+        self.demodulator.get_scatter(modem_stats)
+        self.assertTrue(self.event_queue.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
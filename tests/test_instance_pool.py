@@ -0,0 +1,74 @@
+import sys
+sys.path.append('modem')
+
+import queue
+import threading
+import unittest
+from unittest import mock
+import codec2
+import demodulator
+import modulator
+
+
+def get_rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * 4096 / 1e6
+
+
+class TestInstancePool(unittest.TestCase):
+
+    def testReleasedInstanceIsReused(self):
+        pool = codec2.instance_pool()
+        instance = pool.acquire(codec2.FREEDV_MODE.datac3)
+        pool.release(instance)
+        self.assertEqual(pool.acquire("datac3").value, instance.value)
+        # an idle instance of another mode is never handed out
+        self.assertNotEqual(pool.acquire(codec2.FREEDV_MODE.datac4).value, instance.value)
+
+        stats = pool.get_stats()
+        self.assertEqual((stats["opened"], stats["reused"], stats["in_use"]), (2, 1, 2))
+
+    def testCloseAll(self):
+        pool = codec2.instance_pool()
+        for mode in [codec2.FREEDV_MODE.datac0, codec2.FREEDV_MODE.datac13]:
+            pool.release(pool.acquire(mode))
+        pool.close_all()
+        stats = pool.get_stats()
+        self.assertEqual((stats["idle"], stats["closed"]), (0, 2))
+
+
+class TestModemRestart(unittest.TestCase):
+
+    class Stream:
+        active = True
+
+    def restart_cycle(self):
+        demod = demodulator.Demodulator({}, queue.Queue(), queue.Queue(), mock.Mock(), mock.Mock(),
+                                        queue.Queue(), mock.Mock())
+        mod = modulator.Modulator({'MODEM': {'tx_delay': 0}})
+        demod.start(self.Stream())
+        demod.stop()
+        mod.close()
+
+    def testRestartDoesNotLeak(self):
+        # warm up, the pool opens all instances once
+        for _ in range(5):
+            self.restart_cycle()
+        stats = codec2.INSTANCE_POOL.get_stats()
+        opened, in_use = stats["opened"], stats["in_use"]
+        threads = threading.active_count()
+        rss = get_rss_mb()
+
+        for _ in range(200):
+            self.restart_cycle()
+
+        stats = codec2.INSTANCE_POOL.get_stats()
+        self.assertEqual(stats["opened"], opened)
+        self.assertEqual(stats["in_use"], in_use)
+        self.assertLessEqual(threading.active_count(), threads)
+        # a leaked set of instances is several MB per cycle
+        self.assertLess(get_rss_mb() - rss, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,16 +43,19 @@ class TestModem:
         return time
 
     def transmit(self, mode, repeats: int, repeat_delay: int, frames: bytearray) -> bool:
-        # Simulate transmission time
-        tx_time = self.getFrameTransmissionTime(mode) + 0.1  # PTT
+        if not isinstance(frames, list): frames = [frames]
+        # Simulate transmission time, a burst of frames is sent with a single PTT
+        tx_time = len(frames) * self.getFrameTransmissionTime(mode) + 0.1  # PTT
         self.logger.info(f"TX {tx_time} seconds...")
         threading.Event().wait(tx_time)
 
-        transmission = {
-            'mode': mode,
-            'bytes': frames,
-        }
-        self.data_queue_received.put(transmission)
+        for frame in frames:
+            transmission = {
+                'mode': mode,
+                # received frames end with the crc16 added by the modulator
+                'bytes': frame + bytes(2),
+            }
+            self.data_queue_received.put(transmission)
 
 
 class TestMessageProtocol(unittest.TestCase):
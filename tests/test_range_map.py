@@ -0,0 +1,46 @@
+import sys
+sys.path.append('modem')
+
+import unittest
+from range_map import RangeMap
+
+
+class TestRangeMap(unittest.TestCase):
+
+    def testMerge(self):
+        ranges = RangeMap()
+        self.assertEqual(ranges.add(20, 40), 20)
+        self.assertEqual(ranges.add(60, 80), 20)
+        self.assertEqual(list(ranges), [(20, 40), (60, 80)])
+
+        # overlapping the known ranges, only the gap is new
+        self.assertEqual(ranges.add(30, 70), 20)
+        self.assertEqual(list(ranges), [(20, 80)])
+        # adjacent ranges are merged
+        self.assertEqual(ranges.add(0, 20), 20)
+        self.assertEqual(list(ranges), [(0, 80)])
+        self.assertEqual(ranges.add(10, 50), 0)
+
+    def testContains(self):
+        ranges = RangeMap()
+        ranges.add(0, 40)
+        ranges.add(60, 100)
+        self.assertTrue(ranges.contains(60, 100))
+        self.assertTrue(ranges.contains(10, 10))
+        self.assertFalse(ranges.contains(30, 70))
+        self.assertEqual(ranges.contiguous_end(), 40)
+        self.assertEqual(ranges.contiguous_end(70), 100)
+        self.assertEqual(ranges.contiguous_end(50), 50)
+
+    def testGaps(self):
+        ranges = RangeMap()
+        self.assertEqual(ranges.gaps(0, 100), [(0, 100)])
+        ranges.add(0, 40)
+        ranges.add(60, 80)
+        self.assertEqual(ranges.gaps(0, 100), [(40, 60), (80, 100)])
+        self.assertEqual(ranges.gaps(50, 70), [(50, 60)])
+        self.assertEqual(ranges.gaps(60, 80), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import sys
+sys.path.append('modem')
+
+import queue
+import unittest
+import numpy as np
+from state_manager import StateManager
+from spectrum import SpectrumEngine
+from channel_busy import ChannelBusyDetector
+
+
+def tone(frequency, samples=800, sample_rate=8000, amplitude=8000):
+    t = np.arange(samples) / sample_rate
+    noise = np.random.default_rng(1).standard_normal(samples) * 100
+    return (np.sin(2 * np.pi * frequency * t) * amplitude + noise).astype(np.int16)
+
+
+class TestSpectrumEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.fft_queue = queue.Queue()
+        self.states = StateManager(queue.Queue())
+
+    def testSlotDetection(self):
+        engine = SpectrumEngine(self.fft_queue, self.states, busy_detector=ChannelBusyDetector(self.states))
+        slot_busy = engine.process(tone(1500))
+        self.assertEqual(slot_busy.tolist(), [False, False, True, False, False])
+        self.assertEqual(self.states.channel_busy_slot, [False, False, True, False, False])
+
+        waterfall = self.fft_queue.get_nowait()
+        self.assertIsInstance(waterfall, bytes)
+        self.assertEqual(len(waterfall), 315)
+        self.assertEqual(waterfall[150], 100)
+
+    def testOnlyLatestLineQueued(self):
+        engine = SpectrumEngine(self.fft_queue, self.states)
+        for _ in range(3):
+            engine.process(tone(1000))
+        self.assertEqual(self.fft_queue.qsize(), 1)
+
+    def testNoSubscribers(self):
+        subscribers = set()
+        engine = SpectrumEngine(self.fft_queue, self.states, subscribers=subscribers,
+                                busy_detector=ChannelBusyDetector(self.states))
+
+        # busy detection still runs while receiving
+        self.assertTrue(engine.process(tone(500))[0])
+        # own transmission is only needed for the waterfall
+        self.assertIsNone(engine.process(tone(500, 4800, 48000), 48000, transmitting=True))
+        self.assertTrue(self.fft_queue.empty())
+
+        # nothing to do without busy detector and waterfall client
+        self.assertIsNone(SpectrumEngine(self.fft_queue, self.states, subscribers=subscribers).process(tone(500)))
+
+        subscribers.add("client")
+        engine.process(tone(500, 4800, 48000), 48000, transmitting=True)
+        self.assertEqual(len(self.fft_queue.get_nowait()), 315)
+
+    def testDecimation(self):
+        engine = SpectrumEngine(self.fft_queue, self.states, averaging=4, decimation=5)
+        for _ in range(4):
+            engine.process(tone(2000))
+        self.assertTrue(self.fft_queue.empty())
+        engine.process(tone(2000))
+        self.assertEqual(self.fft_queue.qsize(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
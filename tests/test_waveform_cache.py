@@ -0,0 +1,50 @@
+import sys
+sys.path.append('modem')
+
+import unittest
+import numpy as np
+import codec2
+from waveform_cache import WaveformCache
+
+
+class TestWaveformCache(unittest.TestCase):
+
+    def testHitAndMiss(self):
+        cache = WaveformCache(max_bytes=1000)
+        key = cache.create_key(codec2.FREEDV_MODE.signalling, bytearray(b"ack"), 1, 0, 0)
+        self.assertIsNone(cache.get(key))
+
+        self.assertTrue(cache.put(key, np.arange(10, dtype=np.int16)))
+        # frames given as list or single frame, and mode aliases share the same entry
+        same_key = cache.create_key(codec2.FREEDV_MODE.datac13, [b"ack"], 1, 0, 0)
+        waveform = cache.get(same_key)
+        np.testing.assert_array_equal(waveform, np.arange(10))
+        self.assertFalse(waveform.flags.writeable)
+
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["size_bytes"], 20)
+
+    def testLeastRecentlyUsedEviction(self):
+        cache = WaveformCache(max_bytes=400)
+        waveform = np.zeros(50, dtype=np.int16)
+        for key in ["a", "b", "c", "d"]:
+            cache.put(key, waveform)
+        # "a" was used recently, so "b" is the oldest one
+        cache.get("a")
+        cache.put("e", waveform)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("e"))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertLessEqual(cache.size, 400)
+
+    def testLargeWaveformIsNotCached(self):
+        cache = WaveformCache(max_bytes=400)
+        self.assertFalse(cache.put("large", np.zeros(100, dtype=np.int16)))
+        self.assertEqual(cache.get_stats()["entries"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
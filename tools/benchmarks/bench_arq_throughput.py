@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark ARQ throughput over a simulated HF channel
+
+Two in-process modems are connected by a LoopbackChannel, so every frame goes
+through the real modulator, resampler and demodulator. An ARQ session is
+started for every speed level, both stations are pinned to it, and the
+throughput in bytes per minute is printed together with the data frames the
+IRS decoded per speed level. Sessions run in real time.
+
+python3 tools/benchmarks/bench_arq_throughput.py --snr 10
+python3 tools/benchmarks/bench_arq_throughput.py --snr 5 --fading mpp --offset 20 --level 1
+
+"""
+import argparse
+import base64
+import copy
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import modem  # noqa: E402
+from arq_session import ARQSession  # noqa: E402
+from channel_simulator import ChannelSimulator, LoopbackChannel  # noqa: E402
+from command_arq_raw import ARQRawCommand  # noqa: E402
+from config import CONFIG  # noqa: E402
+from event_manager import EventManager  # noqa: E402
+from frame_dispatcher import DISPATCHER  # noqa: E402
+from radio_manager import RadioManager  # noqa: E402
+from state_manager import StateManager  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA ARQ throughput benchmark')
+parser.add_argument('--snr', dest="snr", default=10.0, help="SNR in 3 kHz bandwidth, in dB", type=float)
+parser.add_argument('--offset', dest="offset", default=0.0, help="Frequency offset in Hz", type=float)
+parser.add_argument('--fading', dest="fading", default=None, choices=["mpg", "mpp", "mpd"], help="Watterson fading profile")
+parser.add_argument('--drift', dest="drift", default=0.0, help="Sample clock drift in ppm", type=float)
+parser.add_argument('--level', dest="levels", default=list(ARQSession.SPEED_LEVEL_DICT), nargs="+", help="Speed levels to test", type=int)
+parser.add_argument('--size', dest="size", default=2000, help="Payload size in bytes", type=int)
+parser.add_argument('--timeout', dest="timeout", default=600, help="Maximum session duration in seconds", type=int)
+parser.add_argument('--seed', dest="seed", default=0, help="Random seed of the channel", type=int)
+args = parser.parse_args()
+
+
+class PinnedStateManager(StateManager):
+    """
+    Restricts the ARQ sessions of a station to a single speed level, once they are registered
+    """
+
+    def __init__(self, statequeue):
+        super().__init__(statequeue)
+        self.speed_level = None
+
+    def register_arq_iss_session(self, session):
+        session.allowed_speed_levels = [self.speed_level]
+        return super().register_arq_iss_session(session)
+
+    def register_arq_irs_session(self, session):
+        session.allowed_speed_levels = [self.speed_level]
+        return super().register_arq_irs_session(session)
+
+
+class Station:
+    def __init__(self, config):
+        self.event_queue = queue.Queue()
+        self.event_manager = EventManager([self.event_queue])
+        self.states = PinnedStateManager(queue.Queue())
+        radio = RadioManager(config, self.states, self.event_manager)
+        self.modem = modem.RF(config, self.event_manager, queue.Queue(), queue.Queue(), self.states, radio)
+        self.dispatcher = DISPATCHER(config, self.event_manager, self.states, self.modem)
+        self.dispatcher.start()
+
+
+def wait_for_session(event_queue, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            event = event_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        session = event.get("arq-transfer-outbound")
+        if session and "success" in session:
+            return session
+    return None
+
+
+def get_decoded_frames(station):
+    stats = station.modem.demodulator.get_stats()
+    return {level: stats[details['mode'].name.upper()]['decoded_frames']
+            for level, details in ARQSession.SPEED_LEVEL_DICT.items()}
+
+
+def create_channel():
+    return ChannelSimulator(snr_db=args.snr, frequency_offset=args.offset, fading=args.fading,
+                            clock_drift_ppm=args.drift, seed=args.seed)
+
+
+config = CONFIG(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem", "config.ini.example")).read()
+config['RADIO']['control'] = "disabled"
+iss = Station(copy.deepcopy(config))
+irs = Station(copy.deepcopy(config))
+loopback = LoopbackChannel(iss.modem, irs.modem, create_channel(), create_channel())
+loopback.start()
+
+results = []
+for level in args.levels:
+    # the speed controller of the IRS and the fallback of the ISS only choose from this level
+    iss.states.speed_level = level
+    irs.states.speed_level = level
+    decoded_before = get_decoded_frames(irs)
+    params = {
+        'dxcall': f"{config['STATION']['mycall']}-{config['STATION']['myssid']}",
+        'data': base64.b64encode(np.random.default_rng(args.seed).bytes(args.size)),
+        'type': "raw",
+    }
+    ARQRawCommand(config, iss.states, iss.event_queue, params).run(iss.event_queue, iss.modem)
+    session = wait_for_session(iss.event_queue, args.timeout)
+    decoded_after = get_decoded_frames(irs)
+    frames = {used: decoded_after[used] - decoded_before[used] for used in decoded_after}
+    results.append((level, session, frames))
+    # let both stations settle before the next session
+    time.sleep(5)
+
+loopback.stop()
+
+print(f"snr {args.snr} dB, offset {args.offset} Hz, fading {args.fading}, drift {args.drift} ppm, payload {args.size} bytes")
+print(f"{'level':>6} {'mode':>7} {'success':>8} {'duration s':>11} {'bytes/min':>10}  frames per level")
+for level, session, frames in results:
+    mode = ARQSession.SPEED_LEVEL_DICT[level]['mode'].name
+    used = " ".join(f"{used}:{count}" for used, count in frames.items() if count)
+    if session is None:
+        print(f"{level:>6} {mode:>7} {'timeout':>8} {'':>11} {'':>10}  {used}")
+        continue
+    statistics = session['statistics']
+    print(f"{level:>6} {mode:>7} {str(session['success']):>8} {statistics.get('duration', 0):>11.1f} "
+          f"{statistics.get('bytes_per_minute', 0):>10}  {used}")
+for name, station in [("iss", iss), ("irs", irs)]:
+    cache = station.modem.waveform_cache.get_stats()
+    print(f"{name} tx waveform cache: {cache['hits']} hits, {cache['misses']} misses")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the per-call overhead of the codec2 bindings
+
+Calls the hot rx and tx functions once through the typed bindings of codec2.api
+with integer buffer addresses, and once through a second, untyped handle of the
+same library with numpy .ctypes arguments, like before the prototypes were
+declared. Cheap functions show the marshalling overhead, expensive ones how
+little of their time it is.
+
+python3 tools/benchmarks/bench_codec2_calls.py
+python3 tools/benchmarks/bench_codec2_calls.py --iterations 50000 --mode datac1
+
+"""
+import argparse
+import ctypes
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import codec2  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA codec2 binding benchmark')
+parser.add_argument('--iterations', dest="iterations", default=20000, help="Calls per cheap function", type=int)
+parser.add_argument('--mode', dest="mode", default="datac13", help="codec2 mode of the instance",
+                    choices=[mode.name for mode in codec2.FREEDV_MODE])
+args = parser.parse_args()
+
+typed = codec2.api
+# new handle of the same library, its functions have no prototypes
+untyped = ctypes.CDLL(codec2.api._name)
+
+freedv = codec2.open_instance(codec2.freedv_get_mode_value_by_name(args.mode))
+info = codec2.get_mode_info(args.mode)
+bytes_out = ctypes.create_string_buffer(info.bytes_per_frame)
+payload = (ctypes.c_ubyte * info.bytes_per_frame)()
+crc_payload = bytes(info.payload_per_frame)
+samples = np.zeros(2 * codec2.api.freedv_get_n_max_modem_samples(freedv) + 8, dtype=np.int16)
+tx_buffer = np.zeros(info.frame_samples, dtype=np.int16)
+in8 = np.zeros(480 + codec2.api.FDMDV_OS_TAPS_48_8K, dtype=np.int16)
+out48 = np.zeros(6 * 480, dtype=np.int16)
+address = samples.ctypes.data
+
+
+def measure(function, iterations):
+    return min(timeit.repeat(function, number=iterations, repeat=5)) / iterations * 1e6
+
+
+def benchmark(name, untyped_call, typed_call, iterations):
+    before = measure(untyped_call, iterations)
+    after = measure(typed_call, iterations)
+    print(f"{name:<28} {before:>11.3f} {after:>11.3f} {before - after:>11.3f}")
+
+
+heavy = max(args.iterations // 100, 10)
+print(f"{'function':<28} {'untyped us':>11} {'typed us':>11} {'saved us':>11}")
+print("rx")
+benchmark("freedv_nin", lambda: untyped.freedv_nin(freedv), lambda: typed.freedv_nin(freedv), args.iterations)
+benchmark("freedv_get_rx_status", lambda: untyped.freedv_get_rx_status(freedv),
+          lambda: typed.freedv_get_rx_status(freedv), args.iterations)
+benchmark("freedv_rawdatarx",
+          lambda: untyped.freedv_rawdatarx(freedv, bytes_out, samples[2:].ctypes),
+          lambda: typed.freedv_rawdatarx(freedv, bytes_out, address + 4), heavy)
+print("tx")
+benchmark("freedv_gen_crc16", lambda: untyped.freedv_gen_crc16(crc_payload, info.payload_per_frame),
+          lambda: typed.freedv_gen_crc16(crc_payload, info.payload_per_frame), args.iterations)
+benchmark("freedv_rawdatapreambletx",
+          lambda: untyped.freedv_rawdatapreambletx(freedv, ctypes.c_void_p(tx_buffer.ctypes.data)),
+          lambda: typed.freedv_rawdatapreambletx(freedv, tx_buffer.ctypes.data), heavy)
+benchmark("freedv_rawdatatx",
+          lambda: untyped.freedv_rawdatatx(freedv, ctypes.c_void_p(tx_buffer.ctypes.data), payload),
+          lambda: typed.freedv_rawdatatx(freedv, tx_buffer.ctypes.data, payload), heavy)
+benchmark("fdmdv_8_to_48_short",
+          lambda: untyped.fdmdv_8_to_48_short(out48.ctypes, ctypes.c_void_p(in8.ctypes.data + 2 * 8), 480),
+          lambda: typed.fdmdv_8_to_48_short(out48.ctypes.data, in8.ctypes.data + 2 * 8, 480), heavy)
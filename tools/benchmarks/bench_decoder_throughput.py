@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark decoder throughput by replaying audio through the Demodulator
+
+Replays a WAV or raw int16 recording, or a generated test signal, as fast as
+the decoders allow and prints the real-time factor of every enabled mode.
+
+python3 tools/benchmarks/bench_decoder_throughput.py --modes datac1 datac3
+python3 tools/benchmarks/bench_decoder_throughput.py --file recording.wav --modes datac1
+
+"""
+import argparse
+import os
+import queue
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import codec2  # noqa: E402
+import modulator  # noqa: E402
+from audio_replay import AudioReplay, read_recording  # noqa: E402
+from demodulator import Demodulator  # noqa: E402
+from event_manager import EventManager  # noqa: E402
+from state_manager import StateManager  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA decoder throughput benchmark')
+parser.add_argument('--file', dest="file", default=None, help="WAV or raw int16 recording", type=str)
+parser.add_argument('--samplerate', dest="samplerate", default=None, help="Sample rate of a raw recording", type=int)
+parser.add_argument('--modes', dest="modes", default=["datac1", "datac3"], nargs="+", help="Data modes to decode additionally to signalling")
+parser.add_argument('--bursts', dest="bursts", default=5, help="Number of bursts per mode of the generated test signal", type=int)
+args = parser.parse_args()
+
+
+def generate_signal(modes):
+    modem = modulator.Modulator({'MODEM': {'tx_delay': 50}})
+    bursts = []
+    for mode in modes:
+        freedv_mode = codec2.FREEDV_MODE[mode]
+        instance = codec2.open_instance(freedv_mode.value)
+        bytes_per_frame = codec2.api.freedv_get_bits_per_modem_frame(instance) // 8
+        for _ in range(args.bursts):
+            bursts.append(modem.create_burst(freedv_mode, 1, 500, [bytearray(bytes_per_frame - 2)]))
+    samples = np.concatenate(bursts)
+    noise = np.random.default_rng(0).standard_normal(len(samples)) * 200
+    return (samples + noise).astype(np.int16), codec2.api.FREEDV_FS_8000
+
+
+if args.file:
+    samples, sample_rate = read_recording(args.file, args.samplerate)
+else:
+    samples, sample_rate = generate_signal(["datac13"] + args.modes)
+
+data_queue = queue.Queue()
+demodulator = Demodulator({}, queue.Queue(), data_queue, StateManager(queue.Queue()),
+                          EventManager([queue.Queue()]), queue.Queue(), None)
+demodulator.set_decode_mode({codec2.FREEDV_MODE[mode].value: True for mode in args.modes})
+
+replay = AudioReplay(demodulator)
+stats = replay.replay(samples, sample_rate)
+replay.stop()
+
+print(f"audio {stats['duration']:.1f} s, replayed in {stats['wall_time']:.2f} s, real-time factor {stats['realtime_factor']}")
+print(f"{'mode':<12} {'cpu s':>8} {'real-time factor':>18} {'frames':>8}")
+for name, mode in stats["modes"].items():
+    print(f"{name:<12} {mode['cpu_time']:>8.3f} {str(mode['realtime_factor']):>18} {mode['decoded_frames']:>8}")
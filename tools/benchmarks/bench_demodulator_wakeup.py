@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark decoder thread wakeup: 10 ms polling vs. event driven audio ring
+
+Runs one consumer thread per codec2 mode reading its own cursor of a shared
+codec2.audio_ring and measures
+  - CPU time used while no audio arrives (idle)
+  - latency between push() and the consumer noticing the samples
+
+python3 tools/benchmarks/bench_demodulator_wakeup.py --idle 5 --pushes 200
+
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import codec2  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA decoder wakeup benchmark')
+parser.add_argument('--threads', dest="threads", default=len(codec2.FREEDV_MODE), help="Number of decoder threads", type=int)
+parser.add_argument('--idle', dest="idle", default=5.0, help="Idle measurement duration in seconds", type=float)
+parser.add_argument('--pushes', dest="pushes", default=200, help="Number of pushes for latency measurement", type=int)
+parser.add_argument('--nin', dest="nin", default=880, help="Samples the decoder waits for", type=int)
+args = parser.parse_args()
+
+
+class Consumer:
+    def __init__(self, ring, polling):
+        self.polling = polling
+        self.buffer = ring.cursor(2 * 4800)
+        self.running = True
+        self.latencies = []
+        self.pushed_at = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        nin = args.nin
+        while self.running:
+            if self.polling:
+                # decoder loop before event driven wakeup
+                threading.Event().wait(0.01)
+            elif not self.buffer.wait_for_samples(nin):
+                break
+            while self.buffer.nbuffer >= nin:
+                self.latencies.append(time.perf_counter() - self.pushed_at)
+                self.buffer.pop(nin)
+
+    def stop(self):
+        self.running = False
+        self.buffer.close()
+        self.thread.join()
+
+
+def run_benchmark(polling):
+    ring = codec2.audio_ring(4 * 4800)
+    consumers = [Consumer(ring, polling) for _ in range(args.threads)]
+
+    # idle cpu usage
+    cpu_start = time.process_time()
+    time.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu_start
+
+    # push-to-decode latency
+    block = np.zeros(args.nin, dtype=np.int16)
+    for _ in range(args.pushes):
+        pushed_at = time.perf_counter()
+        for consumer in consumers:
+            consumer.pushed_at = pushed_at
+        ring.push(block)
+        time.sleep(0.02)
+
+    for consumer in consumers:
+        consumer.stop()
+
+    latencies = np.array([lat for consumer in consumers for lat in consumer.latencies]) * 1000
+    return idle_cpu, latencies
+
+
+for polling in [True, False]:
+    name = "polling 10 ms" if polling else "event driven"
+    idle_cpu, latencies = run_benchmark(polling)
+    print(f"{name:>14}: idle cpu {100 * idle_cpu / args.idle:6.2f} % "
+          f"| latency avg {np.mean(latencies):6.3f} ms "
+          f"p99 {np.percentile(latencies, 99):6.3f} ms "
+          f"max {np.max(latencies):6.3f} ms")
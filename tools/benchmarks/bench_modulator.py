@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark burst creation of the Modulator
+
+Measures Modulator.create_burst for signalling ACKs and for multi-frame
+datac1 bursts and prints the time per burst and the real-time factor.
+
+python3 tools/benchmarks/bench_modulator.py
+python3 tools/benchmarks/bench_modulator.py --frames 1 2 4 8 --iterations 50
+
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import codec2  # noqa: E402
+import modulator  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA modulator benchmark')
+parser.add_argument('--iterations', dest="iterations", default=100, help="Bursts per test case", type=int)
+parser.add_argument('--frames', dest="frames", default=[1, 2, 4], nargs="+", help="Frames per datac1 burst", type=int)
+parser.add_argument('--txdelay', dest="txdelay", default=50, help="TX delay in ms", type=int)
+args = parser.parse_args()
+
+modem = modulator.Modulator({'MODEM': {'tx_delay': args.txdelay}})
+
+
+def payload_size(mode):
+    return modem.get_frame_info(modem.get_tx_instance(mode))["bytes_per_frame"] - 2
+
+
+def benchmark(name, mode, frames, repeats=1, repeat_delay=0):
+    rng = np.random.default_rng(0)
+    frames = [bytearray(rng.bytes(payload_size(mode))) for _ in range(frames)]
+    # first burst warms up the codec2 instance
+    burst = modem.create_burst(mode, repeats, repeat_delay, frames)
+
+    durations = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        modem.create_burst(mode, repeats, repeat_delay, frames)
+        durations.append(time.perf_counter() - start)
+
+    audio_duration = len(burst) / codec2.api.FREEDV_FS_8000
+    durations = np.array(durations) * 1000
+    print(f"{name:<20} {audio_duration:>8.2f} {np.mean(durations):>9.2f} {np.min(durations):>9.2f} "
+          f"{np.percentile(durations, 99):>9.2f} {audio_duration * 1000 / np.mean(durations):>9.0f}")
+
+
+print(f"{'burst':<20} {'audio s':>8} {'mean ms':>9} {'min ms':>9} {'p99 ms':>9} {'realtime':>9}")
+benchmark("signalling ack", codec2.FREEDV_MODE.signalling, 1)
+for frames in args.frames:
+    benchmark(f"datac1 x{frames}", codec2.FREEDV_MODE.datac1, frames)
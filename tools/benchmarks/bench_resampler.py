@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark codec2 48<->8 kHz resampling: allocating vs. streaming resampler
+
+Measures
+  - RX: resample48_to_8 on 4800 sample blocks (one sound card callback)
+  - TX: resample8_to_48 on a complete multi second burst
+
+The allocating variant is the resampler implementation before the streaming
+resampler, kept here as reference.
+
+python3 tools/benchmarks/bench_resampler.py --blocks 2000 --burst 10 --bursts 50
+
+"""
+import argparse
+import ctypes
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import codec2  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA resampler benchmark')
+parser.add_argument('--blocks', dest="blocks", default=2000, help="Number of 4800 sample RX blocks", type=int)
+parser.add_argument('--burst', dest="burst", default=10.0, help="TX burst length in seconds", type=float)
+parser.add_argument('--bursts', dest="bursts", default=50, help="Number of TX bursts", type=int)
+args = parser.parse_args()
+
+
+class AllocatingResampler:
+    MEM8 = codec2.api.FDMDV_OS_TAPS_48_8K
+    MEM48 = codec2.api.FDMDV_OS_TAPS_48K
+
+    def __init__(self):
+        self.filter_mem8 = np.zeros(self.MEM8, dtype=np.int16)
+        self.filter_mem48 = np.zeros(self.MEM48)
+
+    def resample48_to_8(self, in48):
+        in48_mem = np.zeros(self.MEM48 + len(in48), dtype=np.int16)
+        in48_mem[: self.MEM48] = self.filter_mem48
+        in48_mem[self.MEM48 :] = in48
+        pin48 = ctypes.byref(np.ctypeslib.as_ctypes(in48_mem), 2 * self.MEM48)
+        n8 = int(len(in48) / codec2.api.FDMDV_OS_48)
+        out8 = np.zeros(n8, dtype=np.int16)
+        codec2.api.fdmdv_48_to_8_short(out8.ctypes, pin48, n8)
+        self.filter_mem48 = in48_mem[: self.MEM48]
+        return out8
+
+    def resample8_to_48(self, in8):
+        in8_mem = np.zeros(self.MEM8 + len(in8), dtype=np.int16)
+        in8_mem[: self.MEM8] = self.filter_mem8
+        in8_mem[self.MEM8 :] = in8
+        pin8 = ctypes.byref(np.ctypeslib.as_ctypes(in8_mem), 2 * self.MEM8)
+        out48 = np.zeros(codec2.api.FDMDV_OS_48 * len(in8), dtype=np.int16)
+        codec2.api.fdmdv_8_to_48_short(out48.ctypes, pin8, len(in8))
+        self.filter_mem8 = in8_mem[: self.MEM8]
+        return out48
+
+
+def bench_rx(resampler, out=None):
+    block = (np.random.default_rng(1).standard_normal(4800) * 5000).astype(np.int16)
+    start = time.perf_counter()
+    for _ in range(args.blocks):
+        if out is None:
+            resampler.resample48_to_8(block)
+        else:
+            resampler.resample48_to_8(block, out=out)
+    return (time.perf_counter() - start) / args.blocks
+
+
+def bench_tx(resampler, out=None):
+    burst = (np.random.default_rng(2).standard_normal(int(args.burst * 8000)) * 5000).astype(np.int16)
+    start = time.perf_counter()
+    for _ in range(args.bursts):
+        if out is None:
+            resampler.resample8_to_48(burst)
+        else:
+            resampler.resample8_to_48(burst, out=out)
+    return (time.perf_counter() - start) / args.bursts
+
+
+rx_out = np.zeros(800, dtype=np.int16)
+tx_out = np.zeros(int(args.burst * 8000) * codec2.api.FDMDV_OS_48, dtype=np.int16)
+
+results = [
+    ("allocating", bench_rx(AllocatingResampler()), bench_tx(AllocatingResampler())),
+    ("streaming", bench_rx(codec2.resampler()), bench_tx(codec2.resampler())),
+    ("streaming, out=", bench_rx(codec2.resampler(), rx_out), bench_tx(codec2.resampler(), tx_out)),
+]
+
+print(f"{'resampler':<18} {'RX 4800 block us':>18} {f'TX {args.burst:g} s burst ms':>20}")
+for name, rx, tx in results:
+    print(f"{name:<18} {rx * 1e6:>18.1f} {tx * 1e3:>20.2f}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark rx spectrum calculation: list based calculate_fft vs. SpectrumEngine
+
+Processes 800 sample blocks at 8 kHz, like the rx audio pipeline does ten times
+a second, with and without a connected waterfall client.
+
+The list based variant is the former audio.calculate_fft without the dbfs
+calculation, kept here as reference.
+
+python3 tools/benchmarks/bench_spectrum.py --blocks 5000
+
+"""
+import argparse
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+from channel_busy import ChannelBusyDetector  # noqa: E402
+from spectrum import SpectrumEngine  # noqa: E402
+from state_manager import StateManager  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA spectrum benchmark')
+parser.add_argument('--blocks', dest="blocks", default=5000, help="Number of 800 sample blocks", type=int)
+args = parser.parse_args()
+
+
+def calculate_fft_list(data, fft_queue, states):
+    fftarray = np.fft.rfft(data)
+    fftarray[fftarray == 0] = 1
+    dfft = 10.0 * np.log10(abs(fftarray))
+    avg = np.mean(dfft)
+    dfft[dfft > avg + 15] = 100
+    dfft = dfft.astype(int)
+    dfftlist = dfft.tolist()
+    slotbusy = [False, False, False, False, False]
+    for slot, (range_start, range_end) in enumerate([[0, 65], [65, 120], [120, 176], [176, 231], [231, len(dfftlist)]]):
+        slotdfft = dfft[range_start:range_end]
+        if np.sum(slotdfft[slotdfft > avg + 15]) >= 200:
+            slotbusy[slot] = True
+        states.set_channel_slot_busy(slotbusy)
+    states.set_channel_busy_condition_traffic(any(slotbusy))
+    if fft_queue.qsize() >= 1:
+        fft_queue = queue.Queue()
+    fft_queue.put(dfftlist[:315])
+    return slotbusy
+
+
+rng = np.random.default_rng(1)
+t = np.arange(800) / 8000
+blocks = [(np.sin(2 * np.pi * 1500 * t) * 4000 + rng.standard_normal(800) * 300).astype(np.int16) for _ in range(16)]
+
+
+def run(function):
+    start = time.process_time()
+    for i in range(args.blocks):
+        function(blocks[i % len(blocks)])
+    return (time.process_time() - start) / args.blocks
+
+
+list_queue = queue.Queue()
+engine_queue = queue.Queue()
+states = StateManager(queue.Queue())
+subscribed = SpectrumEngine(engine_queue, states, subscribers={"client"}, busy_detector=ChannelBusyDetector(states))
+unsubscribed = SpectrumEngine(engine_queue, states, subscribers=set(), busy_detector=ChannelBusyDetector(states))
+
+results = [
+    ("calculate_fft (list)", run(lambda block: calculate_fft_list(block, list_queue, states))),
+    ("SpectrumEngine, waterfall client", run(subscribed.process)),
+    ("SpectrumEngine, no client", run(unsubscribed.process)),
+]
+
+print(f"{'variant':<34} {'CPU us/block':>14}")
+for name, duration in results:
+    print(f"{name:<34} {duration * 1e6:>14.1f}")
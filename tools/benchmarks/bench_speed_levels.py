@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulate the speed level selection of ARQ sessions over SNR traces
+
+Compares the goodput of the former policy, which steps one level towards the static
+min_snr of the latest SNR value and falls back to the lowest level after two timeouts,
+with the goodput maximizing SpeedController. Frames are lost with a probability given by
+the SNR of a trace, the reported SNR values are noisy. Runs much faster than real time.
+
+python3 tools/benchmarks/bench_speed_levels.py
+python3 tools/benchmarks/bench_speed_levels.py --frames 3 --mode-offset 2 --runs 20
+
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modem"))
+import codec2  # noqa: E402
+from arq_session import ARQSession  # noqa: E402
+from arq_speed_controller import SpeedController  # noqa: E402
+from data_frame_factory import DataFrameFactory  # noqa: E402
+from modem_frametypes import FRAME_TYPE  # noqa: E402
+
+parser = argparse.ArgumentParser(description='FreeDATA ARQ speed level simulation')
+parser.add_argument('--duration', dest="duration", default=1800, help="Duration of a session in seconds", type=int)
+parser.add_argument('--runs', dest="runs", default=10, help="Runs per trace", type=int)
+parser.add_argument('--frames', dest="frames", default=1, help="Frames per burst", type=int)
+parser.add_argument('--mode-offset', dest="mode_offset", default=1.0,
+                    help="dB above min_snr, where a mode really loses half of its frames", type=float)
+parser.add_argument('--snr-noise', dest="snr_noise", default=1.0, help="Standard deviation of reported SNR values in dB", type=float)
+parser.add_argument('--seed', dest="seed", default=0, help="Random seed", type=int)
+args = parser.parse_args()
+
+SPEED_LEVELS = ARQSession.SPEED_LEVEL_DICT
+TIMEOUT = ARQSession.TIMEOUT_TRANSFER
+ACK_DURATION = codec2.get_mode_info(codec2.FREEDV_MODE.signalling).airtime
+factory = DataFrameFactory({'STATION': {'mycall': 'AA1AAA', 'myssid': 1, 'mygrid': 'JN12AA'}})
+PAYLOAD_SIZES = {level: factory.get_available_data_payload_for_mode(FRAME_TYPE.ARQ_BURST_FRAME, details['mode'])
+                 for level, details in SPEED_LEVELS.items()}
+
+
+def frame_success(level, snr):
+    midpoint = SPEED_LEVELS[level]['min_snr'] + args.mode_offset
+    return 1 / (1 + math.exp(-(snr - midpoint) / 0.7))
+
+
+def create_traces(rng):
+    walk = [2.0]
+    for _ in range(args.duration):
+        walk.append(min(max(walk[-1] + rng.gauss(0, 0.3), -8), 12))
+    fades = set()
+    for _ in range(args.duration // 300):
+        start = rng.randrange(args.duration)
+        fades.update(range(start, start + 60))
+    return {
+        'good 8 dB': lambda t: 8.0,
+        'marginal 1 dB': lambda t: 1.0,
+        'poor -3 dB': lambda t: -3.0,
+        'slow fading': lambda t: 3 + 6 * math.sin(2 * math.pi * t / 600),
+        'random walk': lambda t: walk[min(int(t), args.duration)],
+        'deep fades': lambda t: -5.0 if int(t) in fades else 6.0,
+    }
+
+
+class LegacyPolicy:
+    def __init__(self):
+        self.timeouts = 0
+
+    def irs_select(self, level, received_level, snr_history, frames, lost_frames, lost_bursts):
+        # the IRS waits until the ISS follows its speed level
+        if received_level != level:
+            return level
+        appropriate = 0
+        for candidate, details in SPEED_LEVELS.items():
+            if snr_history[-1] >= details['min_snr']:
+                appropriate = max(appropriate, candidate)
+        if appropriate > level:
+            return level + 1
+        if appropriate < level:
+            return level - 1
+        return level
+
+    def iss_timeout(self, level, frames, snr_history):
+        self.timeouts += 1
+        if self.timeouts == 2 and level > 0:
+            return 0
+        return level
+
+    def iss_ack(self, level, frames, lost_frames):
+        self.timeouts = 0
+
+
+class ControllerPolicy:
+    def __init__(self):
+        self.irs = SpeedController(SPEED_LEVELS, PAYLOAD_SIZES, ACK_DURATION, TIMEOUT)
+        self.iss = SpeedController(SPEED_LEVELS, PAYLOAD_SIZES, ACK_DURATION, TIMEOUT)
+
+    def irs_select(self, level, received_level, snr_history, frames, lost_frames, lost_bursts):
+        # bursts repeated by the ISS delayed this one
+        self.irs.add_frames(level, lost_bursts * frames, lost_bursts * frames)
+        if received_level < level:
+            # the ISS fell back
+            level = received_level
+        if received_level != level:
+            return level
+        self.irs.add_frames(received_level, frames, lost_frames)
+        return self.irs.select(level, snr_history, None, frames)
+
+    def iss_timeout(self, level, frames, snr_history):
+        self.iss.add_frames(level, frames, frames)
+        if level > 0 and self.iss.select(level, snr_history, [0, level]) == 0:
+            return 0
+        return level
+
+    def iss_ack(self, level, frames, lost_frames):
+        self.iss.add_frames(level, frames, lost_frames)
+
+
+def simulate(policy, trace, rng):
+    time = 0.0
+    irs_level = iss_level = 0
+    received_bytes = 0
+    snr_history = []
+    lost_bursts = 0
+    while time < args.duration:
+        time += args.frames * SPEED_LEVELS[iss_level]['duration_per_frame']
+        snr = trace(time)
+        received_frames = sum(rng.random() < frame_success(iss_level, snr) for _ in range(args.frames))
+        if not received_frames:
+            time += TIMEOUT
+            lost_bursts += 1
+            iss_level = policy.iss_timeout(iss_level, args.frames, snr_history)
+            continue
+        received_bytes += received_frames * PAYLOAD_SIZES[iss_level]
+        snr_history = (snr_history + [round(snr + rng.gauss(0, args.snr_noise))])[-20:]
+        irs_level = policy.irs_select(irs_level, iss_level, snr_history, args.frames,
+                                      args.frames - received_frames, lost_bursts)
+        lost_bursts = 0
+        policy.iss_ack(iss_level, args.frames, args.frames - received_frames)
+        # the ISS follows the speed level of the ack
+        time += ACK_DURATION
+        iss_level = irs_level
+    return received_bytes * 60 / time
+
+
+rng = random.Random(args.seed)
+results = {}
+for _ in range(args.runs):
+    traces = create_traces(rng)
+    for name, trace in traces.items():
+        for policy in [LegacyPolicy, ControllerPolicy]:
+            results.setdefault(name, {}).setdefault(policy.__name__, []).append(simulate(policy(), trace, rng))
+
+print(f"{args.runs} runs of {args.duration} s, {args.frames} frames per burst, mode offset {args.mode_offset} dB, snr noise {args.snr_noise} dB")
+print(f"{'trace':<16} {'legacy bytes/min':>17} {'controller bytes/min':>21} {'gain':>7}")
+for name, policies in results.items():
+    legacy = sum(policies['LegacyPolicy']) / args.runs
+    controller = sum(policies['ControllerPolicy']) / args.runs
+    print(f"{name:<16} {legacy:>17.0f} {controller:>21.0f} {controller / legacy - 1:>+7.0%}")